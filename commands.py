@@ -0,0 +1,95 @@
+import click
+from flask.cli import AppGroup
+
+crm_cli = AppGroup('crm', help='CRM maintenance commands.')
+
+@crm_cli.command('init-db')
+@click.option('--no-seed', is_flag=True, help='Only create and upgrade the schema.')
+def init_db(no_seed):
+    """Create or upgrade the database schema and seed the defaults; run once per deployment"""
+    from flask import current_app
+    from services.bootstrap import init_database_exclusive
+    init_database_exclusive(current_app._get_current_object(), seed=not no_seed)
+    click.echo('Database schema is up to date' + ('' if no_seed else ' and seeded'))
+
+@crm_cli.command('seed')
+@click.option('--admin-password', default=None, help='Password for a newly created admin account.')
+def seed(admin_password):
+    """Create the admin account and default settings where missing"""
+    from services.bootstrap import DEFAULT_ADMIN_PASSWORD, seed_database
+    if seed_database(admin_password or DEFAULT_ADMIN_PASSWORD):
+        click.echo('Created the admin account')
+    click.echo('Default settings are in place')
+
+@crm_cli.command('repair-notification-counters')
+def repair_notification_counters():
+    """Recompute the per-user unread/total notification counters"""
+    from services.notifications import rebuild_counters
+    users = rebuild_counters()
+    click.echo(f'Rebuilt notification counters for {users} users')
+
+@crm_cli.command('prune-notifications')
+@click.option('--archive-dir', default=None, help='Archive deleted rows as monthly NDJSON.gz files here.')
+def prune_notifications(archive_dir):
+    """Apply the notification retention policy once"""
+    from flask import current_app
+    from services.retention import run_retention
+    config = dict(current_app.config)
+    if archive_dir:
+        config['NOTIFICATION_ARCHIVE_DIR'] = archive_dir
+    report = run_retention(config)
+    click.echo(
+        f"Deleted {report['deleted']} notifications ({report['archived']} archived) "
+        f"in {report['batches']} batches over {report['duration_seconds']}s; "
+        f"write lock held {report['lock_seconds_total']}s total, {report['lock_seconds_max']}s max"
+    )
+
+@crm_cli.command('rebuild-chat-conversations')
+def rebuild_chat_conversations():
+    """Recompute the chat inbox summaries from existing messages"""
+    from services.chat import rebuild_conversations
+    rows = rebuild_conversations()
+    click.echo(f'Rebuilt {rows} chat conversation rows')
+
+@crm_cli.command('rebuild-chat-search')
+def rebuild_chat_search():
+    """Rebuild the chat full-text search index from chat_messages"""
+    from services.chat_search import rebuild_search_index
+    indexed = rebuild_search_index()
+    click.echo(f'Indexed {indexed} chat messages')
+
+@crm_cli.command('archive-chat')
+@click.option('--days', type=int, default=None, help='Override CHAT_ARCHIVE_AFTER_DAYS.')
+def archive_chat(days):
+    """Move chat messages past the hot window into the archive database"""
+    from flask import current_app
+    from services.chat_archive import archive_messages
+    config = dict(current_app.config)
+    if days is not None:
+        config['CHAT_ARCHIVE_AFTER_DAYS'] = days
+    report = archive_messages(config)
+    click.echo(f"Archived {report['archived']} messages in {report['batches']} batches over {report['duration_seconds']}s")
+
+@crm_cli.command('migrate-chat')
+@click.option('--keep-source', is_flag=True, help='Leave the copied tables in the main database.')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def migrate_chat(keep_source, batch_size):
+    """Move chat tables from the main database to the chat database"""
+    from services.chat_storage import chat_is_separate, migrate_chat_storage
+    if not chat_is_separate():
+        click.echo('The chat bind points at the main database; nothing to migrate')
+        return
+    report = migrate_chat_storage(batch_size, drop_source=not keep_source)
+    if not report['tables']:
+        click.echo('No chat tables left in the main database')
+        return
+    for name, counts in report['tables'].items():
+        click.echo(f"{name}: copied {counts['copied']} rows ({counts['chat_rows']}/{counts['source_rows']} present)")
+    click.echo('Dropped the source tables' if report['dropped'] else 'Source tables kept')
+
+@crm_cli.command('prune-revoked-tokens')
+def prune_tokens():
+    """Delete denylist rows for tokens that have expired anyway"""
+    from services.revocation import prune_revoked_tokens
+    removed = prune_revoked_tokens()
+    click.echo(f'Removed {removed} expired revoked tokens')
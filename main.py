@@ -3,10 +3,17 @@ import sys
 # DON'T CHANGE THIS PATH
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from datetime import timedelta
 from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from models.user import db
+from commands import crm_cli
+from services.retention import start_retention_worker
+from services.auth import init_auth
+from services.bootstrap import init_database_exclusive
+from services.passwords import init_password_hasher
+from services.revocation import init_denylist
 from routes.auth import auth_bp
 from routes.users import users_bp
 from routes.customers import customers_bp
@@ -18,71 +25,103 @@ from routes.reports import reports_bp
 from routes.settings import settings_bp
 from routes.chat import chat_bp
 
-app = Flask(__name__)
-
-# Configuration
-app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///crm.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = 'jwt-secret-string-change-in-production'
-
-# Initialize extensions
-db.init_app(app)
-jwt = JWTManager(app)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(users_bp)
-app.register_blueprint(customers_bp)
-app.register_blueprint(products_bp)
-app.register_blueprint(orders_bp)
-app.register_blueprint(tasks_bp)
-app.register_blueprint(notifications_bp)
-app.register_blueprint(reports_bp)
-app.register_blueprint(settings_bp)
-app.register_blueprint(chat_bp)
-
-# Serve static files
-@app.route('/')
-def index():
-    return send_from_directory('static', 'index.html')
-
-@app.route('/<path:path>')
-def static_files(path):
-    return send_from_directory('static', path)
-
-# Create tables and default data
-with app.app_context():
-    db.create_all()
+def create_app(config=None):
+    """Build the application; ``config`` overrides the defaults and CRM_* environment variables"""
+    # Pinned so `flask crm ...` and the workers agree on the instance folder whatever the working directory
+    app = Flask(__name__, instance_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+    
+    # Configuration
+    app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///crm.db'
+    # Chat gets its own SQLite file so message writes don't queue behind order and stock writes;
+    # set CHAT_DATABASE_URI to None to keep chat tables in the main database
+    app.config['CHAT_DATABASE_URI'] = 'sqlite:///chat.db'
+    app.config['CHAT_ARCHIVE_DATABASE_URI'] = 'sqlite:///chat_archive.db'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}  # pool settings, e.g. CRM_SQLALCHEMY_ENGINE_OPTIONS__pool_size=10
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = 'jwt-secret-string-change-in-production'
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=15)
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)  # rotated on every /auth/refresh
+    app.config['REVOKED_TOKEN_CAPACITY'] = 100000  # denylist entries held in memory per process
+    app.config['BCRYPT_ROUNDS'] = 12  # work factor for new hashes; older hashes are upgraded at login
+    app.config['PASSWORD_HASH_WORKERS'] = None  # bcrypt threads; defaults to the CPU count
+    app.config['PASSWORD_HASH_QUEUE'] = 16  # logins allowed to wait for a bcrypt thread before 503
+    app.config['PASSWORD_HASH_TIMEOUT'] = 10  # seconds
+    app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 15  # seconds between SSE keep-alive comments
+    app.config['NOTIFICATION_COALESCE_WINDOW'] = 600  # seconds; 0 disables coalescing of repeated events
+    app.config['CHAT_LONG_POLL_TIMEOUT'] = 25  # seconds a chat long-poll request may wait
+    app.config['CHAT_ARCHIVE_AFTER_DAYS'] = 180  # messages older than this move to the archive database
+    app.config['CHAT_ARCHIVE_BATCH_SIZE'] = 1000
+    app.config['CHAT_PRESENCE_TTL'] = 60  # seconds after the last heartbeat a user still counts as online
+    app.config['CHAT_TYPING_TTL'] = 6  # seconds a typing indicator lasts without a refresh
+    app.config['CHAT_PRESENCE_MAX_USERS'] = 65536  # user ids below this live in the shared presence array
+    app.config['CHAT_PRESENCE_SHARED'] = True  # share presence between workers through instance/presence.bin
+    app.config['SHARED_STATE_PATH'] = None  # defaults to instance/shared-state.bin; must be common to all workers
+    
+    # Notification retention policy (see services/retention.py)
+    app.config['NOTIFICATION_RETENTION_DAYS'] = 90
+    app.config['NOTIFICATION_RETENTION_MAX_PER_USER'] = 1000
+    app.config['NOTIFICATION_RETENTION_KEEP_UNREAD'] = True
+    app.config['NOTIFICATION_RETENTION_BATCH_SIZE'] = 500
+    app.config['NOTIFICATION_ARCHIVE_DIR'] = None
+    app.config['NOTIFICATION_RETENTION_INTERVAL'] = 0  # seconds; 0 disables the background job
+    # gunicorn.conf.py turns this off and starts the jobs in each worker instead of the preloading master
+    app.config['START_BACKGROUND_JOBS'] = True
     
-    # Create default admin user if not exists
-    from models.user import User, Setting
-    admin = User.query.filter_by(username='admin').first()
-    if not admin:
-        admin = User(
-            username='admin',
-            full_name='System Administrator',
-            email='admin@crm.com',
-            role='admin',
-            is_active=True
-        )
-        admin.set_password('admin123')
-        db.session.add(admin)
+    # Schema setup and seeding run once through `flask crm init-db`; set to create and seed on boot instead
+    app.config['AUTO_INIT_DB'] = False
     
-    # Create default settings if not exist
-    default_settings = [
-        {'key': 'company_name', 'value': 'شركة إدارة علاقات العملاء', 'description': 'اسم الشركة'},
-        {'key': 'language', 'value': 'ar', 'description': 'اللغة الافتراضية'},
-        {'key': 'theme', 'value': 'light', 'description': 'السمة الافتراضية'},
-        {'key': 'currency', 'value': 'SAR', 'description': 'العملة الافتراضية'},
-        {'key': 'low_stock_threshold', 'value': '10', 'description': 'حد تنبيه المخزون المنخفض'}
-    ]
+    # CRM_* environment variables override the defaults above, e.g. CRM_SQLALCHEMY_DATABASE_URI or
+    # CRM_JWT_SECRET_KEY; values are parsed as JSON where possible, so CRM_BCRYPT_ROUNDS=10 is an int
+    app.config.from_prefixed_env('CRM')
+    if config:
+        app.config.update(config)
+    if 'SQLALCHEMY_BINDS' not in app.config:
+        app.config['SQLALCHEMY_BINDS'] = {
+            'chat': app.config['CHAT_DATABASE_URI'] or app.config['SQLALCHEMY_DATABASE_URI'],
+            'chat_archive': app.config['CHAT_ARCHIVE_DATABASE_URI']
+        }
     
-    for setting_data in default_settings:
-        existing_setting = Setting.query.filter_by(key=setting_data['key']).first()
-        if not existing_setting:
-            setting = Setting(**setting_data)
-            db.session.add(setting)
+    # Initialize extensions
+    db.init_app(app)
+    jwt = JWTManager(app)
+    init_auth(jwt)
+    init_password_hasher(app)
+    init_denylist(app)
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
     
-    db.session.commit()
+    # Register blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(customers_bp)
+    app.register_blueprint(products_bp)
+    app.register_blueprint(orders_bp)
+    app.register_blueprint(tasks_bp)
+    app.register_blueprint(notifications_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(settings_bp)
+    app.register_blueprint(chat_bp)
+    
+    # Register CLI commands
+    app.cli.add_command(crm_cli)
+    
+    # Serve static files
+    @app.route('/')
+    def index():
+        return send_from_directory('static', 'index.html')
+    
+    @app.route('/<path:path>')
+    def static_files(path):
+        return send_from_directory('static', path)
+    
+    if app.config['AUTO_INIT_DB']:
+        init_database_exclusive(app)
+    
+    # Background jobs
+    if app.config['START_BACKGROUND_JOBS']:
+        start_retention_worker(app)
+    
+    return app
+
+# Module-level app for `flask --app main` and gunicorn's `main:app`
+app = create_app()
@@ -1,6 +1,11 @@
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
 from datetime import datetime
 import bcrypt
+import json
+import zlib
 
 db = SQLAlchemy()
 
@@ -14,7 +19,9 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     role = db.Column(db.String(50), nullable=False, default='employee')  # admin, manager, employee, sales, support
     permissions = db.Column(db.Text)  # JSON string of permissions
+    skills = db.Column(db.Text)  # JSON list of skill tags matched by automatic task assignment
     is_active = db.Column(db.Boolean, default=True)
+    auth_version = db.Column(db.Integer, default=0)  # bumped on role, permission or status changes; see services/auth.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -22,12 +29,18 @@ class User(db.Model):
     created_tasks = db.relationship('Task', foreign_keys='Task.created_by', backref='creator', lazy='dynamic')
     assigned_tasks = db.relationship('Task', foreign_keys='Task.assigned_to', backref='assignee', lazy='dynamic')
     notifications = db.relationship('Notification', backref='user', lazy='dynamic')
-    sent_messages = db.relationship('ChatMessage', foreign_keys='ChatMessage.sender_id', backref='sender', lazy='dynamic')
-    received_messages = db.relationship('ChatMessage', foreign_keys='ChatMessage.receiver_id', backref='receiver', lazy='dynamic')
+    # Chat tables live on the 'chat' bind, so these joins are declared without database foreign keys
+    sent_messages = db.relationship(
+        'ChatMessage', primaryjoin='User.id == foreign(ChatMessage.sender_id)', backref='sender', lazy='dynamic'
+    )
+    received_messages = db.relationship(
+        'ChatMessage', primaryjoin='User.id == foreign(ChatMessage.receiver_id)', backref='receiver', lazy='dynamic'
+    )
     created_orders = db.relationship('Order', backref='creator', lazy='dynamic')
     
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        rounds = current_app.config.get('BCRYPT_ROUNDS', 12) if has_app_context() else 12
+        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
     
     def check_password(self, password):
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
@@ -40,6 +53,7 @@ class User(db.Model):
             'email': self.email,
             'role': self.role,
             'permissions': self.permissions,
+            'skills': json.loads(self.skills) if self.skills else [],
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -200,6 +214,12 @@ class Task(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notifications_coalesce_key', 'coalesce_key', 'is_read'),
+        # Ids must never be reused once retention deletes the newest rows: SSE cursors compare them
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -209,7 +229,10 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     related_task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'), nullable=True)
     related_order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
+    coalesce_key = db.Column(db.String(120), nullable=True)  # user:type:entity, for repeated events
+    occurrences = db.Column(db.Integer, nullable=True, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
     
     def to_dict(self):
         return {
@@ -221,22 +244,69 @@ class Notification(db.Model):
             'is_read': self.is_read,
             'related_task_id': self.related_task_id,
             'related_order_id': self.related_order_id,
+            'occurrences': self.occurrences or 1,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+
+class BroadcastNotification(db.Model):
+    __tablename__ = 'broadcast_notifications'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    type = db.Column(db.String(50), nullable=False, default='info')
+    target_role = db.Column(db.String(50), nullable=True)  # None with no group means everyone
+    target_group_id = db.Column(db.Integer, nullable=True)  # chat_groups.id on the chat bind
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self, is_read=False):
+        return {
+            'id': f'broadcast-{self.id}',
+            'broadcast_id': self.id,
+            'is_broadcast': True,
+            'title': self.title,
+            'message': self.message,
+            'type': self.type,
+            'is_read': is_read,
+            'target_role': self.target_role,
+            'target_group_id': self.target_group_id,
+            'related_task_id': None,
+            'related_order_id': None,
+            'created_by': self.created_by,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class BroadcastReceipt(db.Model):
+    __tablename__ = 'broadcast_receipts'
+    
+    # Sparse read state: a row exists only once a user has read the broadcast
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcast_notifications.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    read_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ChatGroup(db.Model):
     __tablename__ = 'chat_groups'
+    __bind_key__ = 'chat'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_by = db.Column(db.Integer, nullable=False)  # users.id on the main bind
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     members = db.relationship('ChatGroupMember', backref='group', lazy='dynamic', cascade='all, delete-orphan')
     messages = db.relationship('ChatMessage', backref='group', lazy='dynamic')
-    creator = db.relationship('User', foreign_keys=[created_by])
+    creator = db.relationship('User', primaryjoin='foreign(ChatGroup.created_by) == User.id')
     
     def to_dict(self):
         return {
@@ -251,14 +321,18 @@ class ChatGroup(db.Model):
 
 class ChatGroupMember(db.Model):
     __tablename__ = 'chat_group_members'
+    __bind_key__ = 'chat'
+    __table_args__ = (
+        db.Index('uq_chat_group_members_group_user', 'group_id', 'user_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.Integer, db.ForeignKey('chat_groups.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)  # users.id on the main bind
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    user = db.relationship('User', backref='group_memberships')
+    user = db.relationship('User', primaryjoin='foreign(ChatGroupMember.user_id) == User.id', backref='group_memberships')
     
     def to_dict(self):
         return {
@@ -271,11 +345,18 @@ class ChatGroupMember(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __bind_key__ = 'chat'
+    __table_args__ = (
+        db.Index('ix_chat_messages_conversation_id', 'conversation_key', 'id'),
+        # Ids are never reused once archived, so an archived id always means the same message
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # For direct messages
+    sender_id = db.Column(db.Integer, nullable=False)  # users.id on the main bind
+    receiver_id = db.Column(db.Integer, nullable=True)  # For direct messages
     group_id = db.Column(db.Integer, db.ForeignKey('chat_groups.id'), nullable=True)  # For group messages
+    conversation_key = db.Column(db.String(64), nullable=True)  # dm:<min>:<max> or g:<group_id>, set on insert
     message_text = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
@@ -289,11 +370,83 @@ class ChatMessage(db.Model):
             'receiver_name': self.receiver.full_name if self.receiver else None,
             'group_id': self.group_id,
             'group_name': self.group.name if self.group else None,
+            'conversation_key': self.conversation_key,
             'message_text': self.message_text,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'is_read': self.is_read
         }
 
+class ChatConversation(db.Model):
+    __tablename__ = 'chat_conversations'
+    __bind_key__ = 'chat'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'conversation_key', name='uq_chat_conversations_user_key'),
+        db.Index('ix_chat_conversations_user_recent', 'user_id', 'last_message_at'),
+        db.Index('ix_chat_conversations_key', 'conversation_key'),
+    )
+    
+    # One row per user per conversation, kept current by the chat write endpoints
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    conversation_key = db.Column(db.String(64), nullable=False)  # dm:<min>:<max> or g:<group_id>
+    peer_user_id = db.Column(db.Integer, nullable=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('chat_groups.id'), nullable=True)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_preview = db.Column(db.String(200), nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    last_sender_id = db.Column(db.Integer, nullable=True)
+    last_read_message_id = db.Column(db.Integer, nullable=True)  # read watermark
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'conversation_key': self.conversation_key,
+            'type': 'group' if self.group_id else 'direct',
+            'peer_user_id': self.peer_user_id,
+            'group_id': self.group_id,
+            'last_message_id': self.last_message_id,
+            'last_message_preview': self.last_message_preview,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_sender_id': self.last_sender_id,
+            'last_read_message_id': self.last_read_message_id,
+            'unread_count': self.unread_count
+        }
+
+class ArchivedChatMessage(db.Model):
+    __tablename__ = 'archived_chat_messages'
+    __bind_key__ = 'chat_archive'
+    __table_args__ = (
+        db.Index('ix_archived_chat_messages_conversation_id', 'conversation_key', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    # Cold copy of a chat_messages row; lives in its own database, so no foreign keys
+    id = db.Column(db.Integer, primary_key=True)  # Always the chat_messages id
+    conversation_key = db.Column(db.String(64), nullable=False)
+    sender_id = db.Column(db.Integer, nullable=False)
+    receiver_id = db.Column(db.Integer, nullable=True)
+    group_id = db.Column(db.Integer, nullable=True)
+    message_compressed = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed UTF-8 text
+    timestamp = db.Column(db.DateTime, nullable=True)
+    archive_month = db.Column(db.String(7), nullable=True)  # YYYY-MM of timestamp
+    is_read = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def message_text(self):
+        return zlib.decompress(self.message_compressed).decode('utf-8')
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    
+    # Logged-out and rotated JWTs; kept until the token would have expired anyway
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    token_type = db.Column(db.String(10), nullable=False)  # access or refresh
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Setting(db.Model):
     __tablename__ = 'settings'
     
@@ -314,3 +467,45 @@ class Setting(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+def chat_connection():
+    """The session's connection to the chat database, for raw SQL against chat tables"""
+    return db.session.connection(bind_arguments={'mapper': ChatMessage})
+
+def _uses_autoincrement(connection, table):
+    sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': table.name}
+    ).scalar()
+    return 'AUTOINCREMENT' in (sql or '').upper()
+
+def _rebuild_with_autoincrement(connection, table):
+    """Recreate ``table`` as declared (with AUTOINCREMENT), keeping its rows and ids"""
+    rebuilt = f'{table.name}__rebuild'
+    create = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(text(create.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {rebuilt} ', 1)))
+    columns = ', '.join(column.name for column in table.columns)
+    # Explicit ids also seed sqlite_sequence with the current maximum
+    connection.execute(text(f'INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {table.name}'))
+    connection.execute(text(f'DROP TABLE {table.name}'))
+    connection.execute(text(f'ALTER TABLE {rebuilt} RENAME TO {table.name}'))
+
+def upgrade_schema():
+    """Bring existing databases up to date with columns, indexes and AUTOINCREMENT added after their tables were created"""
+    for bind_key, metadata in db.metadatas.items():
+        engine = db.engines[bind_key]
+        inspector = inspect(engine)
+        with engine.begin() as connection:
+            for table in metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if table.dialect_options['sqlite']['autoincrement'] and not _uses_autoincrement(connection, table):
+                    _rebuild_with_autoincrement(connection, table)
+            
+            for table in metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
@@ -1,6 +1,13 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import (
+    current_user, jwt_required, create_access_token, create_refresh_token, decode_token, get_jwt, get_jwt_identity
+)
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from models.user import User, db
+from services.auth import token_claims
+from services.revocation import publish_revocations, revoke_token
+from services.passwords import PasswordHasherBusy, verify_password
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -24,14 +31,27 @@ def login():
         if not user.is_active:
             return jsonify({'error': 'Account is inactive'}), 401
         
-        if not user.check_password(password):
-            return jsonify({'error': 'Invalid username or password'}), 401
+        # Hand the connection back to the pool while bcrypt runs; the loaded user stays usable
+        db.session.close()
+        try:
+            if not verify_password(user, password):
+                return jsonify({'error': 'Invalid username or password'}), 401
+        except PasswordHasherBusy:
+            return jsonify({'error': 'Too many logins in progress, please retry shortly'}), 503, {'Retry-After': '1'}
+        
+        # Store the hash re-computed at the current BCRYPT_ROUNDS, if any
+        if db.session.is_modified(user):
+            db.session.add(user)
+            db.session.commit()
         
-        # Create access token
-        access_token = create_access_token(identity=user.id)
+        # Create access token, plus a refresh token so clients don't resend the password
+        claims = token_claims(user)
+        access_token = create_access_token(identity=str(user.id), additional_claims=claims)
+        refresh_token = create_refresh_token(identity=str(user.id), additional_claims=claims)
         
         return jsonify({
             'access_token': access_token,
+            'refresh_token': refresh_token,
             'user': user.to_dict()
         }), 200
         
@@ -43,7 +63,7 @@ def login():
 def get_current_user():
     """Get current user information"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         user = User.query.get(current_user_id)
         
         if not user:
@@ -54,9 +74,51 @@ def get_current_user():
     except Exception as e:
         return jsonify({'error': 'Failed to get user information', 'details': str(e)}), 500
 
+@auth_bp.route('/auth/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    """Exchange a refresh token for a new access/refresh pair; the old refresh token is revoked"""
+    try:
+        # current_user is already checked for deactivation and role changes
+        claims = token_claims(current_user)
+        # Of two requests racing with the same refresh token, only the one that revokes it gets new tokens
+        if not revoke_token(get_jwt()):
+            db.session.rollback()
+            return jsonify({'error': 'Refresh token has already been used'}), 401
+        db.session.commit()
+        publish_revocations()
+        
+        return jsonify({
+            'access_token': create_access_token(identity=str(current_user.id), additional_claims=claims),
+            'refresh_token': create_refresh_token(identity=str(current_user.id), additional_claims=claims)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Token refresh failed', 'details': str(e)}), 500
+
 @auth_bp.route('/auth/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    """User logout endpoint (client-side token removal)"""
-    return jsonify({'message': 'Successfully logged out'}), 200
-
+    """User logout endpoint; revokes the access token and, if sent, the refresh token"""
+    try:
+        revoke_token(get_jwt())
+        
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            # A refresh token that does not decode cannot be used anyway; the access token is still revoked
+            try:
+                refresh_data = decode_token(data['refresh_token'], allow_expired=True)
+            except (PyJWTError, JWTExtendedException):
+                refresh_data = {}
+            if refresh_data.get('type') == 'refresh' and refresh_data.get('sub') == get_jwt_identity():
+                revoke_token(refresh_data)
+        
+        db.session.commit()
+        publish_revocations()
+        
+        return jsonify({'message': 'Successfully logged out'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Logout failed', 'details': str(e)}), 500
@@ -1,17 +1,29 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models.user import db, ChatMessage, ChatGroup, ChatGroupMember, User
+from models.user import db, ChatMessage, ChatGroup, ChatGroupMember, ChatConversation, User
+from services.chat import (
+    advance_read_watermark, chat_broker, conversation_participants, direct_key, group_key, group_member_ids, invalidate_memberships,
+    key_participants, membership_cache, message_key, message_participants, open_group_conversations, preload_users, publish_to_users, record_message, wait_for_updates
+)
+from services.chat_archive import archived_page
+from services.chat_search import search_messages
+from services.presence import heartbeat, presence_status, set_typing, typing_ttl, typing_users
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 chat_bp = Blueprint('chat', __name__)
 
+MAX_MESSAGES_PER_PAGE = 200
+MAX_PRESENCE_USERS = 500
+
 @chat_bp.route('/api/chat/messages', methods=['GET'])
 @jwt_required()
 def get_messages():
     try:
-        current_user_id = get_jwt_identity()
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        current_user_id = int(get_jwt_identity())
+        per_page = min(request.args.get('per_page', 50, type=int), MAX_MESSAGES_PER_PAGE)
+        before_id = request.args.get('before_id', type=int)
         chat_type = request.args.get('type', 'direct')  # direct or group
         chat_id = request.args.get('chat_id', type=int)
         
@@ -20,35 +32,38 @@ def get_messages():
             if not chat_id:
                 return jsonify({'error': 'chat_id (other user ID) is required for direct messages'}), 400
             
-            messages = ChatMessage.query.filter(
-                ((ChatMessage.sender_id == current_user_id) & (ChatMessage.receiver_id == chat_id)) |
-                ((ChatMessage.sender_id == chat_id) & (ChatMessage.receiver_id == current_user_id))
-            ).order_by(ChatMessage.timestamp.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
-            )
+            key = direct_key(current_user_id, chat_id)
         else:
             # Group messages
             if not chat_id:
                 return jsonify({'error': 'chat_id (group ID) is required for group messages'}), 400
             
             # Check if user is member of the group
-            membership = ChatGroupMember.query.filter_by(
-                group_id=chat_id, user_id=current_user_id
-            ).first()
-            if not membership:
+            if not membership_cache.is_member(current_user_id, chat_id):
                 return jsonify({'error': 'You are not a member of this group'}), 403
             
-            messages = ChatMessage.query.filter_by(group_id=chat_id).order_by(
-                ChatMessage.timestamp.desc()
-            ).paginate(
-                page=page, per_page=per_page, error_out=False
-            )
+            key = group_key(chat_id)
+        
+        # Keyset page over the (conversation_key, id) index: cost is independent of depth
+        query = ChatMessage.query.filter(ChatMessage.conversation_key == key)
+        if before_id:
+            query = query.filter(ChatMessage.id < before_id)
+        rows = query.order_by(ChatMessage.id.desc()).limit(per_page + 1).all()
+        preload_users({row.sender_id for row in rows} | {row.receiver_id for row in rows})
+        messages = [message.to_dict() for message in rows]
+        
+        # Past the hot window, continue the same seek in the archive
+        if len(messages) <= per_page:
+            archive_before = messages[-1]['id'] if messages else before_id
+            messages += archived_page(key, archive_before, per_page + 1 - len(messages))
+        
+        has_more = len(messages) > per_page
+        messages = messages[:per_page]
         
         return jsonify({
-            'messages': [message.to_dict() for message in messages.items],
-            'total': messages.total,
-            'pages': messages.pages,
-            'current_page': page
+            'messages': messages,
+            'has_more': has_more,
+            'next_before_id': messages[-1]['id'] if has_more else None
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -57,7 +72,7 @@ def get_messages():
 @jwt_required()
 def send_message():
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         data = request.get_json()
         
         message_text = data.get('message_text', '').strip()
@@ -87,10 +102,7 @@ def send_message():
                 return jsonify({'error': 'group_id is required for group messages'}), 400
             
             # Check if user is member of the group
-            membership = ChatGroupMember.query.filter_by(
-                group_id=group_id, user_id=current_user_id
-            ).first()
-            if not membership:
+            if not membership_cache.is_member(current_user_id, group_id):
                 return jsonify({'error': 'You are not a member of this group'}), 403
             
             message = ChatMessage(
@@ -100,9 +112,17 @@ def send_message():
             )
         
         db.session.add(message)
+        db.session.flush()  # Get message ID for the conversation summaries
+        
+        participants = message_participants(message)
+        record_message(message, participants)
         db.session.commit()
         
-        return jsonify(message.to_dict()), 201
+        message_data = message.to_dict()
+        publish_to_users(participants, 'message', message_data)
+        heartbeat(current_user_id)
+        
+        return jsonify(message_data), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -111,42 +131,57 @@ def send_message():
 @jwt_required()
 def get_conversations():
     try:
-        current_user_id = get_jwt_identity()
-        
-        # Get direct conversations (users who have exchanged messages)
-        direct_conversations = db.session.query(
-            ChatMessage.sender_id,
-            ChatMessage.receiver_id
-        ).filter(
-            (ChatMessage.sender_id == current_user_id) | 
-            (ChatMessage.receiver_id == current_user_id)
-        ).filter(
-            ChatMessage.receiver_id.isnot(None)
-        ).distinct().all()
-        
-        # Process direct conversations
-        user_ids = set()
-        for conv in direct_conversations:
-            if conv.sender_id != current_user_id:
-                user_ids.add(conv.sender_id)
-            if conv.receiver_id != current_user_id:
-                user_ids.add(conv.receiver_id)
-        
-        direct_users = User.query.filter(User.id.in_(user_ids)).all() if user_ids else []
-        
-        # Get group conversations
-        group_memberships = ChatGroupMember.query.filter_by(user_id=current_user_id).all()
-        groups = [membership.group for membership in group_memberships]
+        current_user_id = int(get_jwt_identity())
         
-        return jsonify({
-            'direct_conversations': [
-                {
+        # One indexed read of the caller's conversation summaries, newest first
+        conversations = ChatConversation.query.filter_by(
+            user_id=current_user_id
+        ).order_by(ChatConversation.last_message_at.desc()).all()
+        
+        peer_ids = {conv.peer_user_id for conv in conversations if conv.peer_user_id}
+        group_ids = {conv.group_id for conv in conversations if conv.group_id}
+        
+        users = preload_users(peer_ids)
+        groups = {group.id: group for group in ChatGroup.query.filter(ChatGroup.id.in_(group_ids))} if group_ids else {}
+        member_counts = dict(db.session.query(
+            ChatGroupMember.group_id, func.count(ChatGroupMember.id)
+        ).filter(ChatGroupMember.group_id.in_(group_ids)).group_by(ChatGroupMember.group_id).all()) if group_ids else {}
+        
+        inbox = []
+        direct_conversations = []
+        group_conversations = []
+        for conv in conversations:
+            summary = conv.to_dict()
+            if conv.group_id:
+                group = groups.get(conv.group_id)
+                if not group:
+                    continue
+                summary.update({
+                    'id': group.id,
+                    'name': group.name,
+                    'description': group.description,
+                    'created_by': group.created_by,
+                    'created_at': group.created_at.isoformat() if group.created_at else None,
+                    'member_count': member_counts.get(group.id, 0)
+                })
+                group_conversations.append(summary)
+                inbox.append(summary)
+            else:
+                user = users.get(conv.peer_user_id)
+                if not user:
+                    continue
+                summary.update({
                     'user_id': user.id,
                     'user_name': user.full_name,
                     'user_role': user.role
-                } for user in direct_users
-            ],
-            'group_conversations': [group.to_dict() for group in groups]
+                })
+                direct_conversations.append(summary)
+                inbox.append(summary)
+        
+        return jsonify({
+            'conversations': inbox,
+            'direct_conversations': direct_conversations,
+            'group_conversations': group_conversations
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -155,11 +190,12 @@ def get_conversations():
 @jwt_required()
 def get_groups():
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
         # Get groups where user is a member
-        memberships = ChatGroupMember.query.filter_by(user_id=current_user_id).all()
-        groups = [membership.group for membership in memberships]
+        group_ids = membership_cache.group_ids(current_user_id)
+        groups = ChatGroup.query.filter(ChatGroup.id.in_(group_ids)).order_by(ChatGroup.id).all() if group_ids else []
+        preload_users(group.created_by for group in groups)
         
         return jsonify({
             'groups': [group.to_dict() for group in groups]
@@ -171,7 +207,7 @@ def get_groups():
 @jwt_required()
 def create_group():
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         data = request.get_json()
         
         name = data.get('name', '').strip()
@@ -196,8 +232,9 @@ def create_group():
         
         # Add other members if provided
         member_ids = data.get('member_ids', [])
+        added_ids = [current_user_id]
         for member_id in member_ids:
-            if member_id != current_user_id:  # Don't add creator twice
+            if member_id not in added_ids:  # Don't add creator or anyone else twice
                 user = User.query.get(member_id)
                 if user:
                     membership = ChatGroupMember(
@@ -205,10 +242,16 @@ def create_group():
                         user_id=member_id
                     )
                     db.session.add(membership)
+                    added_ids.append(member_id)
         
+        open_group_conversations(group.id, added_ids)
         db.session.commit()
+        invalidate_memberships()
+        
+        group_data = group.to_dict()
+        publish_to_users(group_member_ids(group.id), 'group_created', group_data)
         
-        return jsonify(group.to_dict()), 201
+        return jsonify(group_data), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -217,16 +260,14 @@ def create_group():
 @jwt_required()
 def get_group_members(group_id):
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
         # Check if user is member of the group
-        membership = ChatGroupMember.query.filter_by(
-            group_id=group_id, user_id=current_user_id
-        ).first()
-        if not membership:
+        if not membership_cache.is_member(current_user_id, group_id):
             return jsonify({'error': 'You are not a member of this group'}), 403
         
         members = ChatGroupMember.query.filter_by(group_id=group_id).all()
+        preload_users(member.user_id for member in members)
         
         return jsonify({
             'members': [member.to_dict() for member in members]
@@ -238,14 +279,11 @@ def get_group_members(group_id):
 @jwt_required()
 def add_group_member(group_id):
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         data = request.get_json()
         
         # Check if user is member of the group (only members can add others)
-        membership = ChatGroupMember.query.filter_by(
-            group_id=group_id, user_id=current_user_id
-        ).first()
-        if not membership:
+        if not membership_cache.is_member(current_user_id, group_id):
             return jsonify({'error': 'You are not a member of this group'}), 403
         
         user_id = data.get('user_id')
@@ -258,10 +296,7 @@ def add_group_member(group_id):
             return jsonify({'error': 'User not found'}), 404
         
         # Check if user is already a member
-        existing_membership = ChatGroupMember.query.filter_by(
-            group_id=group_id, user_id=user_id
-        ).first()
-        if existing_membership:
+        if membership_cache.is_member(user_id, group_id):
             return jsonify({'error': 'User is already a member of this group'}), 400
         
         new_membership = ChatGroupMember(
@@ -270,9 +305,19 @@ def add_group_member(group_id):
         )
         
         db.session.add(new_membership)
-        db.session.commit()
+        open_group_conversations(group_id, [user_id])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Lost a race with a concurrent add; the unique index is the final word
+            db.session.rollback()
+            return jsonify({'error': 'User is already a member of this group'}), 400
+        invalidate_memberships()
+        
+        membership_data = new_membership.to_dict()
+        publish_to_users(group_member_ids(group_id), 'member_added', membership_data)
         
-        return jsonify(new_membership.to_dict()), 201
+        return jsonify(membership_data), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -281,7 +326,7 @@ def add_group_member(group_id):
 @jwt_required()
 def get_chat_users():
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
         # Get all active users except current user
         users = User.query.filter(
@@ -306,18 +351,247 @@ def get_chat_users():
 @jwt_required()
 def mark_message_read(message_id):
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         message = ChatMessage.query.get_or_404(message_id)
         
         # Only receiver can mark message as read
         if message.receiver_id != current_user_id:
             return jsonify({'error': 'You can only mark your own messages as read'}), 403
         
+        # Reading a message reads everything before it: advance the watermark
         message.is_read = True
+        conversation = ChatConversation.query.filter_by(
+            user_id=current_user_id, conversation_key=message_key(message)
+        ).first()
+        moved = conversation is not None and advance_read_watermark(conversation, message.id)
         db.session.commit()
         
+        if moved:
+            publish_to_users([message.sender_id, message.receiver_id], 'read', {
+                'conversation_key': conversation.conversation_key,
+                'reader_id': current_user_id,
+                'last_read_message_id': conversation.last_read_message_id
+            })
+        
         return jsonify({'message': 'Message marked as read'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+
+@chat_bp.route('/api/chat/conversations/<string:conversation_key>/read', methods=['PUT'])
+@jwt_required()
+def mark_conversation_read(conversation_key):
+    """Advance the caller's read watermark to ?up_to= (default: latest message)"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        up_to = request.args.get('up_to', type=int)
+        
+        conversation = ChatConversation.query.filter_by(
+            user_id=current_user_id, conversation_key=conversation_key
+        ).first()
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        if conversation.group_id:
+            if not membership_cache.is_member(current_user_id, conversation.group_id):
+                return jsonify({'error': 'You are not a member of this group'}), 403
+        
+        moved = advance_read_watermark(conversation, up_to)
+        db.session.commit()
+        
+        summary = conversation.to_dict()
+        if moved:
+            publish_to_users(conversation_participants(conversation), 'read', {
+                'conversation_key': conversation_key,
+                'reader_id': current_user_id,
+                'last_read_message_id': conversation.last_read_message_id
+            })
+        
+        return jsonify(summary)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/conversations/<string:conversation_key>/receipts', methods=['GET'])
+@jwt_required()
+def get_read_receipts(conversation_key):
+    """Participants' read watermarks; with ?message_id= also who has read that message"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        message_id = request.args.get('message_id', type=int)
+        
+        own = ChatConversation.query.filter_by(
+            user_id=current_user_id, conversation_key=conversation_key
+        ).first()
+        if not own:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        if own.group_id:
+            if not membership_cache.is_member(current_user_id, own.group_id):
+                return jsonify({'error': 'You are not a member of this group'}), 403
+        
+        participants = ChatConversation.query.filter_by(conversation_key=conversation_key).all()
+        receipts = [
+            {'user_id': conv.user_id, 'last_read_message_id': conv.last_read_message_id}
+            for conv in participants
+        ]
+        
+        response = {'conversation_key': conversation_key, 'receipts': receipts}
+        if message_id:
+            response['read_by'] = [
+                conv.user_id for conv in participants
+                if conv.user_id != current_user_id and (conv.last_read_message_id or 0) >= message_id
+            ]
+        
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/presence', methods=['GET'])
+@jwt_required()
+def get_presence():
+    """Online status for ``user_ids`` (comma separated); ids that are not active users are left out"""
+    try:
+        raw_ids = request.args.get('user_ids', '')
+        try:
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in raw_ids.split(',') if user_id.strip()))
+        except ValueError:
+            return jsonify({'error': 'user_ids must be a comma separated list of ids'}), 400
+        if len(user_ids) > MAX_PRESENCE_USERS:
+            return jsonify({'error': f'At most {MAX_PRESENCE_USERS} user_ids per request'}), 400
+        
+        # Same audience as /api/chat/users: only people the caller could chat with
+        active_ids = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids), User.is_active == True)}
+        user_ids = [user_id for user_id in user_ids if user_id in active_ids]
+        
+        return jsonify({'presence': {str(user_id): status for user_id, status in presence_status(user_ids).items()}})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/presence/heartbeat', methods=['POST'])
+@jwt_required()
+def presence_heartbeat():
+    """Mark the current user online for another CHAT_PRESENCE_TTL seconds"""
+    try:
+        heartbeat(int(get_jwt_identity()))
+        return jsonify({'online': True, 'ttl': current_app.config.get('CHAT_PRESENCE_TTL', 60)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/conversations/<conversation_key>/typing', methods=['GET', 'POST'])
+@jwt_required()
+def conversation_typing(conversation_key):
+    """Report (POST) or list (GET) who is typing in a conversation"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        participants = key_participants(conversation_key)
+        if participants is None:
+            return jsonify({'error': 'Invalid conversation key'}), 400
+        if current_user_id not in participants:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        if request.method == 'GET':
+            return jsonify({'conversation_key': conversation_key, 'typing': typing_users(conversation_key)})
+        
+        data = request.get_json(silent=True) or {}
+        typing = bool(data.get('typing', True))
+        heartbeat(current_user_id)
+        if set_typing(conversation_key, current_user_id, typing):
+            publish_to_users(
+                [user_id for user_id in participants if user_id != current_user_id],
+                'typing',
+                {
+                    'conversation_key': conversation_key,
+                    'user_id': current_user_id,
+                    'typing': typing,
+                    'expires_in': typing_ttl() if typing else 0
+                }
+            )
+        
+        return jsonify({'conversation_key': conversation_key, 'typing': typing})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/search', methods=['GET'])
+@jwt_required()
+def search_chat():
+    """Search the caller's conversations; page with ?before_id=<next_before_id>"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'q is required'}), 400
+        
+        per_page = min(request.args.get('per_page', 20, type=int), MAX_MESSAGES_PER_PAGE)
+        before_id = request.args.get('before_id', type=int)
+        conversation_key = request.args.get('conversation_key')
+        
+        hits = search_messages(current_user_id, query, before_id, per_page + 1, conversation_key)
+        has_more = len(hits) > per_page
+        hits = hits[:per_page]
+        
+        messages = {
+            message.id: message
+            for message in ChatMessage.query.filter(ChatMessage.id.in_([hit[0] for hit in hits]))
+        } if hits else {}
+        preload_users({m.sender_id for m in messages.values()} | {m.receiver_id for m in messages.values()})
+        
+        results = []
+        for message_id, snippet in hits:
+            message = messages.get(message_id)
+            if message:
+                result = message.to_dict()
+                result['snippet'] = snippet
+                results.append(result)
+        
+        return jsonify({
+            'results': results,
+            'has_more': has_more,
+            'next_before_id': hits[-1][0] if has_more else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/api/chat/updates', methods=['GET'])
+@jwt_required()
+def get_chat_updates():
+    """Long-poll for new messages, read receipts and membership changes.
+    
+    Call without ``since`` to get the current cursor, then pass the returned
+    cursor back each time. The request waits up to ``timeout`` seconds
+    (capped by CHAT_LONG_POLL_TIMEOUT) for something to arrive. When
+    ``resync`` is true the client missed events and should reload its open
+    conversations before continuing from the new cursor. Cursors are only
+    valid on the worker process that issued them; any other cursor gets an
+    immediate ``resync``. Each waiting
+    request holds a worker thread or greenlet, so serve this endpoint from
+    threaded or gevent workers.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        since = request.args.get('since')
+        
+        if not since:
+            return jsonify({'events': [], 'cursor': chat_broker.cursor(), 'resync': False})
+        
+        max_timeout = current_app.config.get('CHAT_LONG_POLL_TIMEOUT', 25)
+        timeout = min(request.args.get('timeout', max_timeout, type=float), max_timeout)
+        
+        # A waiting long-poll counts as being online
+        heartbeat(current_user_id)
+        
+        # Release the pooled connection before blocking
+        db.session.remove()
+        events, cursor, complete = wait_for_updates(current_user_id, since, timeout)
+        
+        return jsonify({
+            'events': [
+                {'seq': seq, 'type': event_name, 'data': data}
+                for seq, _, event_name, data in events
+            ] if complete else [],
+            'cursor': cursor,
+            'resync': not complete
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,15 +1,33 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models.user import Notification, db
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_jwt_extended import current_user, jwt_required, get_jwt_identity
+from models.user import Notification, BroadcastNotification, db
+from services.notifications import (
+    BROADCAST_TOPIC, adjust_counters, audience_for, audience_matches, broker, mark_broadcasts_read,
+    queue_event, send_broadcast, total_unread_count, user_topic, visible_broadcasts
+)
+from services.permissions import requires
+import json
 
 notifications_bp = Blueprint('notifications', __name__)
 
+# Maximum number of missed notifications replayed on Last-Event-ID resume
+STREAM_REPLAY_LIMIT = 100
+
+def format_sse(event_name, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_name}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
 @notifications_bp.route('/notifications', methods=['GET'])
 @jwt_required()
 def get_notifications():
     """Get notifications for current user"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
+        audience = audience_for(current_user)
         
         # Get query parameters
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
@@ -27,9 +45,18 @@ def get_notifications():
         if limit:
             query = query.limit(limit)
         
-        notifications = query.all()
+        notifications = [notification.to_dict() for notification in query.all()]
+        
+        # Merge broadcasts addressed to this user at read time
+        broadcasts = visible_broadcasts(audience, unread_only=unread_only, limit=limit)
+        if broadcasts:
+            notifications = sorted(
+                notifications + broadcasts, key=lambda item: item['created_at'] or '', reverse=True
+            )
+            if limit:
+                notifications = notifications[:limit]
         
-        return jsonify([notification.to_dict() for notification in notifications]), 200
+        return jsonify(notifications), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to fetch notifications', 'details': str(e)}), 500
@@ -39,12 +66,7 @@ def get_notifications():
 def get_notification_count():
     """Get unread notification count for current user"""
     try:
-        current_user_id = get_jwt_identity()
-        
-        count = Notification.query.filter_by(
-            user_id=current_user_id, 
-            is_read=False
-        ).count()
+        count = total_unread_count(audience_for(current_user))
         
         return jsonify({'count': count}), 200
         
@@ -56,14 +78,23 @@ def get_notification_count():
 def mark_notification_read(notification_id):
     """Mark notification as read"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        notification = Notification.query.filter_by(
+        Notification.query.filter_by(
             id=notification_id, 
             user_id=current_user_id
         ).first_or_404()
         
-        notification.is_read = True
+        # Only an unread -> read transition moves the counter
+        updated = Notification.query.filter_by(
+            id=notification_id, 
+            user_id=current_user_id,
+            is_read=False
+        ).update({'is_read': True})
+        
+        if updated:
+            adjust_counters({current_user_id: (-updated, 0)})
+            queue_event(current_user_id, 'count')
         db.session.commit()
         
         return jsonify({'message': 'Notification marked as read'}), 200
@@ -77,13 +108,17 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read for current user"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
-        Notification.query.filter_by(
+        updated = Notification.query.filter_by(
             user_id=current_user_id, 
             is_read=False
         ).update({'is_read': True})
         
+        if updated:
+            adjust_counters({current_user_id: (-updated, 0)})
+            queue_event(current_user_id, 'count')
+        mark_broadcasts_read(audience_for(current_user))
         db.session.commit()
         
         return jsonify({'message': 'All notifications marked as read'}), 200
@@ -97,13 +132,14 @@ def mark_all_notifications_read():
 def delete_read_notifications():
     """Delete all read notifications for current user"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         
         deleted_count = Notification.query.filter_by(
             user_id=current_user_id, 
             is_read=True
         ).delete()
         
+        adjust_counters({current_user_id: (0, -deleted_count)})
         db.session.commit()
         
         return jsonify({
@@ -114,3 +150,152 @@ def delete_read_notifications():
         db.session.rollback()
         return jsonify({'error': 'Failed to delete read notifications', 'details': str(e)}), 500
 
+
+@notifications_bp.route('/notifications/broadcasts', methods=['POST'])
+@jwt_required()
+@requires('notifications.broadcast')
+def create_broadcast():
+    """Send one notification to a role, a chat group or everyone (needs notifications.broadcast)"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        
+        data = request.get_json()
+        if not data or not data.get('title') or not data.get('message'):
+            return jsonify({'error': 'Title and message are required'}), 400
+        
+        if data.get('target_role') and data.get('target_group_id'):
+            return jsonify({'error': 'Target either a role or a group, not both'}), 400
+        
+        broadcast = send_broadcast(
+            title=data['title'],
+            message=data['message'],
+            created_by=current_user_id,
+            notification_type=data.get('type', 'info'),
+            target_role=data.get('target_role') or None,
+            target_group_id=data.get('target_group_id') or None
+        )
+        db.session.commit()
+        
+        return jsonify(broadcast.to_dict()), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to send broadcast', 'details': str(e)}), 500
+
+@notifications_bp.route('/notifications/broadcasts/<int:broadcast_id>/read', methods=['PUT'])
+@jwt_required()
+def mark_broadcast_read(broadcast_id):
+    """Mark a broadcast as read for the current user"""
+    try:
+        BroadcastNotification.query.get_or_404(broadcast_id)
+        mark_broadcasts_read(audience_for(current_user), [broadcast_id])
+        db.session.commit()
+        
+        return jsonify({'message': 'Notification marked as read'}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to mark notification as read', 'details': str(e)}), 500
+
+@notifications_bp.route('/notifications/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_notifications():
+    """Server-Sent Events stream of new notifications and unread count changes.
+    
+    EventSource cannot send headers, so the JWT may also be passed as
+    ``?jwt=<token>``. Each event carries the notification id, so a client
+    reconnecting with ``Last-Event-ID`` gets the rows it missed replayed
+    from the table before live delivery resumes.
+    
+    Broadcasts are delivered to every stream whose user they target.
+    Per-connection cost is one broker subscription (a deque of at most
+    100 queued events, measured at ~2.7 KB empty and ~45 KB when full of
+    typical notifications) plus the worker thread or greenlet serving the
+    response, which dominates: ~8 KB for a gevent greenlet, ~64 KB resident
+    for an OS thread. Use gevent workers when many tabs stay connected.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        
+        audience = audience_for(current_user)
+        
+        # The generator runs after the app context is gone, so it keeps this app's broker itself
+        stream_broker = broker._get_current_object()
+        
+        # Subscribe before reading the backlog so nothing committed in between is lost
+        subscription = stream_broker.subscribe([user_topic(current_user_id), BROADCAST_TOPIC])
+        
+        try:
+            backlog = []
+            if last_event_id is not None:
+                backlog = [
+                    notification.to_dict() for notification in Notification.query.filter(
+                        Notification.user_id == current_user_id,
+                        Notification.id > last_event_id
+                    ).order_by(Notification.id).limit(STREAM_REPLAY_LIMIT).all()
+                ]
+            count = total_unread_count(audience)
+        except Exception:
+            stream_broker.unsubscribe(subscription)
+            raise
+        
+        app = current_app._get_current_object()
+        heartbeat = app.config.get('NOTIFICATION_STREAM_HEARTBEAT', 15)
+        
+        def generate():
+            last_sent_id = last_event_id or 0
+            try:
+                yield 'retry: 5000\n\n'
+                for data in backlog:
+                    last_sent_id = max(last_sent_id, data['id'])
+                    yield format_sse('notification', data, data['id'])
+                yield format_sse('count', {'count': count})
+                
+                while True:
+                    events = subscription.drain(timeout=heartbeat)
+                    if subscription.closed:
+                        break
+                    if subscription.lagged:
+                        subscription.lagged = False
+                        yield format_sse('resync', {})
+                    if not events:
+                        yield ': heartbeat\n\n'
+                        continue
+                    
+                    count_changed = False
+                    for _, _, event_name, data in events:
+                        if event_name == 'broadcast':
+                            if not audience_matches(audience, data):
+                                continue
+                            # No id: broadcasts must not move the Last-Event-ID cursor
+                            yield format_sse('notification', data)
+                        elif event_name == 'notification_updated':
+                            # A coalesced row changed in place; clients replace it by id
+                            yield format_sse('notification_updated', data)
+                        elif event_name == 'notification':
+                            if data['id'] <= last_sent_id:
+                                continue
+                            last_sent_id = data['id']
+                            yield format_sse('notification', data, data['id'])
+                        count_changed = True
+                    
+                    # Bursts of events produce a single count refresh
+                    if count_changed:
+                        with app.app_context():
+                            unread = total_unread_count(audience)
+                        yield format_sse('count', {'count': unread})
+            finally:
+                stream_broker.unsubscribe(subscription)
+        
+        return Response(generate(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to open notification stream', 'details': str(e)}), 500
@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import db, Order, OrderItem, Customer, Product, User, Notification
 from datetime import datetime
+from services.notifications import notify
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -48,7 +49,7 @@ def get_order(order_id):
 @jwt_required()
 def create_order():
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         data = request.get_json()
         
         # Validate required fields
@@ -211,7 +212,7 @@ def delete_order(order_id):
 @jwt_required()
 def update_order_status(order_id):
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         order = Order.query.get_or_404(order_id)
         data = request.get_json()
         
@@ -234,17 +235,14 @@ def update_order_status(order_id):
                 if product:
                     product.stock_quantity += item.quantity
         
-        db.session.commit()
-        
-        # Create notification for status change
-        notification = Notification(
+        # Create notification for status change, folded into a recent one for the same order
+        notify(
             user_id=current_user_id,
             title='تم تحديث حالة الطلب',
             message=f'تم تحديث حالة الطلب رقم {order.id} من {old_status} إلى {new_status}',
-            type='info',
+            notification_type='info',
             related_order_id=order.id
         )
-        db.session.add(notification)
         db.session.commit()
         
         return jsonify(order.to_dict())
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import db, Product
+from services.settings import setting_value
 from datetime import datetime
 
 products_bp = Blueprint('products', __name__)
@@ -28,7 +29,7 @@ def get_products():
             query = query.filter_by(category=category)
         
         if low_stock:
-            query = query.filter(Product.stock_quantity <= 10)
+            query = query.filter(Product.stock_quantity <= setting_value('low_stock_threshold', 10))
         
         products = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -154,7 +155,7 @@ def get_categories():
 @jwt_required()
 def get_low_stock_products():
     try:
-        threshold = request.args.get('threshold', 10, type=int)
+        threshold = request.args.get('threshold', setting_value('low_stock_threshold', 10), type=int)
         
         products = Product.query.filter(
             Product.stock_quantity <= threshold,
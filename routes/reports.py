@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request, make_response
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models.user import Task, User, Notification, db
+from flask_jwt_extended import current_user, jwt_required, get_jwt_identity
+from models.user import Task, Notification, db
 from datetime import datetime, date, timedelta
 import csv
 import io
@@ -12,14 +12,13 @@ reports_bp = Blueprint('reports', __name__)
 def get_tasks_summary_report():
     """Generate tasks summary report"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build base query
         query = Task.query
         
-        # Non-admin users can only see their own tasks
-        if current_user.role != 'admin':
+        # Without reports.view_all users only see their own tasks
+        if not current_user.can('reports.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
@@ -75,14 +74,13 @@ def get_tasks_summary_report():
 def export_tasks_summary_csv():
     """Export tasks summary as CSV"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build base query
         query = Task.query
         
-        # Non-admin users can only see their own tasks
-        if current_user.role != 'admin':
+        # Without reports.view_all users only see their own tasks
+        if not current_user.can('reports.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
@@ -149,14 +147,13 @@ def export_tasks_summary_csv():
 def get_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build base query
         query = Task.query
         
-        # Non-admin users can only see their own tasks
-        if current_user.role != 'admin':
+        # Without reports.view_all users only see their own tasks
+        if not current_user.can('reports.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
@@ -207,14 +204,13 @@ def get_dashboard_stats():
 def get_tasks_by_status():
     """Get tasks grouped by status"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build base query
         query = Task.query
         
-        # Non-admin users can only see their own tasks
-        if current_user.role != 'admin':
+        # Without reports.view_all users only see their own tasks
+        if not current_user.can('reports.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
@@ -238,14 +234,13 @@ def get_tasks_by_status():
 def get_tasks_by_priority():
     """Get tasks grouped by priority"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build base query
         query = Task.query
         
-        # Non-admin users can only see their own tasks
-        if current_user.role != 'admin':
+        # Without reports.view_all users only see their own tasks
+        if not current_user.can('reports.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
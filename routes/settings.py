@@ -1,27 +1,25 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models.user import Setting, User, db
+from flask_jwt_extended import current_user, jwt_required
+from models.user import db
+from services.settings import delete_setting as remove_setting, save_settings, settings_snapshot, validate_setting
 
 settings_bp = Blueprint('settings', __name__)
 
 def require_admin():
-    """Helper function to check if current user is admin"""
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
-    return user and user.role == 'admin'
+    """Helper function to check if current user may manage settings"""
+    return current_user.can('settings.manage')
 
 @settings_bp.route('/settings', methods=['GET'])
 @jwt_required()
 def get_settings():
     """Get all settings"""
     try:
-        settings = Setting.query.all()
         settings_dict = {}
         
-        for setting in settings:
-            settings_dict[setting.key] = {
-                'value': setting.value,
-                'description': setting.description
+        for key, setting in settings_snapshot().items():
+            settings_dict[key] = {
+                'value': setting['value'],
+                'description': setting['description']
             }
         
         return jsonify(settings_dict), 200
@@ -41,24 +39,16 @@ def update_settings():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        updated_settings = []
-        
         for key, value in data.items():
-            setting = Setting.query.filter_by(key=key).first()
-            
-            if setting:
-                setting.value = str(value) if value is not None else None
-            else:
-                setting = Setting(key=key, value=str(value) if value is not None else None)
-                db.session.add(setting)
-            
-            updated_settings.append(key)
-        
-        db.session.commit()
+            error = validate_setting(key, value)
+            if error:
+                return jsonify({'error': error}), 400
+        
+        save_settings(data)
         
         return jsonify({
             'message': 'Settings updated successfully',
-            'updated_settings': updated_settings
+            'updated_settings': list(data.keys())
         }), 200
         
     except Exception as e:
@@ -70,15 +60,15 @@ def update_settings():
 def get_setting(key):
     """Get specific setting"""
     try:
-        setting = Setting.query.filter_by(key=key).first()
+        setting = settings_snapshot().get(key)
         
         if not setting:
             return jsonify({'error': 'Setting not found'}), 404
         
         return jsonify({
-            'key': setting.key,
-            'value': setting.value,
-            'description': setting.description
+            'key': setting['key'],
+            'value': setting['value'],
+            'description': setting['description']
         }), 200
         
     except Exception as e:
@@ -96,25 +86,15 @@ def update_setting(key):
         if not data or 'value' not in data:
             return jsonify({'error': 'Value is required'}), 400
         
-        setting = Setting.query.filter_by(key=key).first()
-        
-        if setting:
-            setting.value = str(data['value']) if data['value'] is not None else None
-            if 'description' in data:
-                setting.description = data['description']
-        else:
-            setting = Setting(
-                key=key,
-                value=str(data['value']) if data['value'] is not None else None,
-                description=data.get('description')
-            )
-            db.session.add(setting)
+        error = validate_setting(key, data['value'])
+        if error:
+            return jsonify({'error': error}), 400
         
-        db.session.commit()
+        save_settings({key: data['value']}, {key: data['description']} if data.get('description') is not None else None)
         
         return jsonify({
             'message': 'Setting updated successfully',
-            'setting': setting.to_dict()
+            'setting': settings_snapshot()[key]
         }), 200
         
     except Exception as e:
@@ -129,10 +109,8 @@ def delete_setting(key):
         if not require_admin():
             return jsonify({'error': 'Admin access required'}), 403
         
-        setting = Setting.query.filter_by(key=key).first_or_404()
-        
-        db.session.delete(setting)
-        db.session.commit()
+        if not remove_setting(key):
+            return jsonify({'error': 'Setting not found'}), 404
         
         return jsonify({'message': 'Setting deleted successfully'}), 200
         
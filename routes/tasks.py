@@ -1,47 +1,57 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import current_user, jwt_required, get_jwt_identity
 from models.user import Task, User, db
+from services.assignment import pick_assignee, record_bulk_task_update
+from services.notifications import add_notifications, notify
 from datetime import datetime, date
 
 tasks_bp = Blueprint('tasks', __name__)
 
+# Upper bound on the number of tasks a single bulk request may touch
+BULK_TASK_LIMIT = 1000
+
+def apply_task_filters(query, filters):
+    """Apply the status/priority/assignee/search filters shared by list and bulk endpoints"""
+    status = filters.get('status')
+    if status:
+        query = query.filter(Task.status == status)
+    
+    priority = filters.get('priority')
+    if priority:
+        query = query.filter(Task.priority == priority)
+    
+    assigned_to = filters.get('assigned_to')
+    if assigned_to:
+        query = query.filter(Task.assigned_to == assigned_to)
+    
+    search = filters.get('search')
+    if search:
+        query = query.filter(
+            (Task.title.contains(search)) | 
+            (Task.description.contains(search))
+        )
+    
+    return query
+
 @tasks_bp.route('/tasks', methods=['GET'])
 @jwt_required()
 def get_tasks():
     """Get tasks with optional filtering"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         # Build query
         query = Task.query
         
-        # Non-admin users can only see their own tasks (assigned or created)
-        if current_user.role != 'admin':
+        # Without tasks.view_all users only see their own tasks (assigned or created)
+        if not current_user.can('tasks.view_all'):
             query = query.filter(
                 (Task.assigned_to == current_user_id) | 
                 (Task.created_by == current_user_id)
             )
         
         # Apply filters
-        status = request.args.get('status')
-        if status:
-            query = query.filter(Task.status == status)
-        
-        priority = request.args.get('priority')
-        if priority:
-            query = query.filter(Task.priority == priority)
-        
-        assigned_to = request.args.get('assigned_to')
-        if assigned_to:
-            query = query.filter(Task.assigned_to == assigned_to)
-        
-        search = request.args.get('search')
-        if search:
-            query = query.filter(
-                (Task.title.contains(search)) | 
-                (Task.description.contains(search))
-            )
+        query = apply_task_filters(query, request.args)
         
         # Order by created_at desc
         tasks = query.order_by(Task.created_at.desc()).all()
@@ -56,7 +66,7 @@ def get_tasks():
 def create_task():
     """Create new task"""
     try:
-        current_user_id = get_jwt_identity()
+        current_user_id = int(get_jwt_identity())
         data = request.get_json()
         
         if not data or not data.get('title'):
@@ -70,10 +80,19 @@ def create_task():
             except ValueError:
                 return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
+        assigned_to = data.get('assigned_to')
+        # "auto" hands the task to the least-loaded matching employee
+        if assigned_to == 'auto':
+            if not current_user.can('tasks.assign'):
+                return jsonify({'error': 'Only admins and managers can assign tasks'}), 403
+            assigned_to = pick_assignee(data.get('assign_role'), data.get('assign_skill'))
+            if assigned_to is None:
+                return jsonify({'error': 'No eligible employee for automatic assignment'}), 409
+        
         task = Task(
             title=data['title'],
             description=data.get('description', ''),
-            assigned_to=data.get('assigned_to'),
+            assigned_to=assigned_to,
             created_by=current_user_id,
             status=data.get('status', 'pending'),
             priority=data.get('priority', 'medium'),
@@ -107,13 +126,12 @@ def create_task():
 def get_task(task_id):
     """Get specific task"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         task = Task.query.get_or_404(task_id)
         
         # Check access permissions
-        if (current_user.role != 'admin' and 
+        if (not current_user.can('tasks.view_all') and 
             task.assigned_to != current_user_id and 
             task.created_by != current_user_id):
             return jsonify({'error': 'Access denied'}), 403
@@ -128,13 +146,12 @@ def get_task(task_id):
 def update_task(task_id):
     """Update task"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         task = Task.query.get_or_404(task_id)
         
         # Check access permissions
-        if (current_user.role != 'admin' and 
+        if (not current_user.can('tasks.manage_all') and 
             task.assigned_to != current_user_id and 
             task.created_by != current_user_id):
             return jsonify({'error': 'Access denied'}), 403
@@ -153,23 +170,21 @@ def update_task(task_id):
         if 'priority' in data:
             task.priority = data['priority']
         
-        # Only admins and creators can reassign tasks
-        if 'assigned_to' in data and (current_user.role == 'admin' or task.created_by == current_user_id):
+        # Only tasks.manage_all holders and creators can reassign tasks
+        if 'assigned_to' in data and (current_user.can('tasks.manage_all') or task.created_by == current_user_id):
             old_assigned_to = task.assigned_to
             task.assigned_to = data['assigned_to']
             
             # Create notification for newly assigned user
             if (task.assigned_to and task.assigned_to != old_assigned_to and 
                 task.assigned_to != current_user_id):
-                from models.user import Notification
-                notification = Notification(
+                notify(
                     user_id=task.assigned_to,
                     title='Task Reassigned',
                     message=f'You have been assigned to task: {task.title}',
-                    type='task_assigned',
+                    notification_type='task_assigned',
                     related_task_id=task.id
                 )
-                db.session.add(notification)
         
         # Parse due_date if provided
         if 'due_date' in data:
@@ -193,13 +208,12 @@ def update_task(task_id):
 def delete_task(task_id):
     """Delete task"""
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
         task = Task.query.get_or_404(task_id)
         
-        # Only admins and creators can delete tasks
-        if current_user.role != 'admin' and task.created_by != current_user_id:
+        # Only tasks.manage_all holders and creators can delete tasks
+        if not current_user.can('tasks.manage_all') and task.created_by != current_user_id:
             return jsonify({'error': 'Access denied'}), 403
         
         db.session.delete(task)
@@ -211,3 +225,127 @@ def delete_task(task_id):
         db.session.rollback()
         return jsonify({'error': 'Failed to delete task', 'details': str(e)}), 500
 
+
+
+@tasks_bp.route('/tasks/bulk', methods=['POST'])
+@jwt_required()
+def bulk_update_tasks():
+    """Apply status/priority/assignee/due date changes to many tasks at once"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        
+        data = request.get_json()
+        if not data or not data.get('changes'):
+            return jsonify({'error': 'changes are required'}), 400
+        
+        changes = data['changes']
+        allowed_fields = {'status', 'priority', 'assigned_to', 'due_date'}
+        unknown_fields = set(changes) - allowed_fields
+        if unknown_fields:
+            return jsonify({'error': f'Unsupported fields: {", ".join(sorted(unknown_fields))}'}), 400
+        
+        task_ids = data.get('ids')
+        filters = data.get('filter')
+        if not task_ids and filters is None:
+            return jsonify({'error': 'Either ids or filter is required'}), 400
+        
+        values = {}
+        if 'status' in changes:
+            values['status'] = changes['status']
+        if 'priority' in changes:
+            values['priority'] = changes['priority']
+        if 'due_date' in changes:
+            if changes['due_date']:
+                try:
+                    values['due_date'] = datetime.strptime(changes['due_date'], '%Y-%m-%d').date()
+                except ValueError:
+                    return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+            else:
+                values['due_date'] = None
+        
+        new_assignee = None
+        if 'assigned_to' in changes:
+            new_assignee = changes['assigned_to']
+            if new_assignee and not User.query.get(new_assignee):
+                return jsonify({'error': 'Assignee not found'}), 404
+            values['assigned_to'] = new_assignee
+        
+        # Resolve the target set with the same rules as update_task, in one query
+        query = db.session.query(Task.id, Task.title, Task.assigned_to, Task.status, Task.priority)
+        if task_ids:
+            if len(task_ids) > BULK_TASK_LIMIT:
+                return jsonify({'error': f'At most {BULK_TASK_LIMIT} tasks can be updated at once'}), 400
+            query = query.filter(Task.id.in_(task_ids))
+        else:
+            query = apply_task_filters(query, filters)
+        
+        if not current_user.can('tasks.manage_all'):
+            if 'assigned_to' in values:
+                # Only tasks.manage_all holders and creators can reassign tasks
+                query = query.filter(Task.created_by == current_user_id)
+            else:
+                query = query.filter(
+                    (Task.assigned_to == current_user_id) | 
+                    (Task.created_by == current_user_id)
+                )
+        
+        targets = query.limit(BULK_TASK_LIMIT + 1).all()
+        if len(targets) > BULK_TASK_LIMIT:
+            return jsonify({'error': f'At most {BULK_TASK_LIMIT} tasks can be updated at once'}), 400
+        
+        target_ids = [target.id for target in targets]
+        skipped_ids = sorted(set(task_ids) - set(target_ids)) if task_ids else []
+        
+        if not target_ids:
+            return jsonify({'updated': 0, 'task_ids': [], 'skipped': skipped_ids, 'notifications': 0}), 200
+        
+        values['updated_at'] = datetime.utcnow()
+        Task.query.filter(Task.id.in_(target_ids)).update(values, synchronize_session=False)
+        # The bulk update skips the mapper events that keep assignee loads current
+        record_bulk_task_update(db.session, targets, values)
+        
+        # Coalesce notifications: one per affected assignee, never to the acting user
+        affected = {}
+        for target in targets:
+            if new_assignee and target.assigned_to != new_assignee:
+                affected.setdefault(new_assignee, {'assigned': [], 'updated': []})['assigned'].append(target)
+            elif target.assigned_to and ('assigned_to' not in values or target.assigned_to == new_assignee):
+                affected.setdefault(target.assigned_to, {'assigned': [], 'updated': []})['updated'].append(target)
+        
+        notifications = []
+        for user_id, groups in affected.items():
+            if user_id == current_user_id:
+                continue
+            tasks = groups['assigned'] + groups['updated']
+            titles = ', '.join(task.title for task in tasks[:5]) + (' ...' if len(tasks) > 5 else '')
+            if groups['assigned']:
+                title = 'Tasks Assigned' if len(tasks) > 1 else 'Task Reassigned'
+                message = f'You have been assigned {len(groups["assigned"])} task(s) by {current_user.full_name}: {titles}'
+                notification_type = 'task_assigned'
+            else:
+                title = 'Tasks Updated'
+                message = f'{current_user.full_name} updated {len(tasks)} of your task(s): {titles}'
+                notification_type = 'info'
+            notifications.append({
+                'user_id': user_id,
+                'title': title,
+                'message': message,
+                'type': notification_type,
+                'is_read': False,
+                'related_task_id': tasks[0].id if len(tasks) == 1 else None
+            })
+        
+        add_notifications(notifications)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'updated': len(target_ids),
+            'task_ids': target_ids,
+            'skipped': skipped_ids,
+            'notifications': len(notifications)
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to bulk update tasks', 'details': str(e)}), 500
@@ -1,22 +1,25 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models.user import db, User, Task, Notification
+from flask_jwt_extended import current_user, jwt_required, get_jwt_identity
+from models.user import db, User, Task
+from services.assignment import pick_assignee
+from services.auth import AUTH_FIELDS, invalidate_identities
+from services.notifications import notify
+from services.permissions import EMPLOYEE_ROLES, ROLES, requires
+from services.provisioning import parse_csv_rows, provision_users
+from services.workload import assigned_task_counts, employee_workload
 from datetime import datetime
 import json
 
 users_bp = Blueprint('users', __name__)
 
+# Upper bound on the number of users a single bulk request may create
+BULK_USER_LIMIT = 1000
+
 @users_bp.route('/api/users', methods=['GET'])
 @jwt_required()
+@requires('users.view')
 def get_users():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Only admins and managers can view all users
-        if current_user.role not in ['admin', 'manager']:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         search = request.args.get('search', '')
@@ -51,11 +54,10 @@ def get_users():
 @jwt_required()
 def get_user(user_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
-        # Users can view their own profile, admins and managers can view all
-        if current_user_id != user_id and current_user.role not in ['admin', 'manager']:
+        # Users can view their own profile; users.view allows viewing all
+        if current_user_id != user_id and not current_user.can('users.view'):
             return jsonify({'error': 'Insufficient permissions'}), 403
         
         user = User.query.get_or_404(user_id)
@@ -65,15 +67,9 @@ def get_user(user_id):
 
 @users_bp.route('/api/users', methods=['POST'])
 @jwt_required()
+@requires('users.create', 'Only admins can create users')
 def create_user():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Only admins can create users
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Only admins can create users'}), 403
-        
         data = request.get_json()
         
         # Validate required fields
@@ -95,27 +91,58 @@ def create_user():
             email=data['email'],
             role=data.get('role', 'employee'),
             permissions=json.dumps(data.get('permissions', {})) if data.get('permissions') else None,
+            skills=json.dumps(data['skills']) if data.get('skills') else None,
             is_active=data.get('is_active', True)
         )
         user.set_password(data['password'])
         
         db.session.add(user)
         db.session.commit()
+        invalidate_identities()
         
         return jsonify(user.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@users_bp.route('/api/users/bulk', methods=['POST'])
+@jwt_required()
+@requires('users.create', 'Only admins can create users')
+def bulk_create_users():
+    """Create many users from a JSON list or a CSV upload, reporting each row"""
+    try:
+        if request.mimetype == 'text/csv':
+            rows = parse_csv_rows(request.get_data(as_text=True))
+        elif 'file' in request.files:
+            rows = parse_csv_rows(request.files['file'].read().decode('utf-8'))
+        else:
+            data = request.get_json(silent=True)
+            rows = data.get('users') if isinstance(data, dict) else data
+        
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'error': 'A non-empty list of users is required'}), 400
+        if len(rows) > BULK_USER_LIMIT:
+            return jsonify({'error': f'At most {BULK_USER_LIMIT} users per request'}), 400
+        
+        created, results = provision_users(rows)
+        
+        return jsonify({
+            'created': created,
+            'failed': len(rows) - created,
+            'results': results
+        }), 201 if created else 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @users_bp.route('/api/users/<int:user_id>', methods=['PUT'])
 @jwt_required()
 def update_user(user_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
-        # Users can update their own profile, admins can update all
-        if current_user_id != user_id and current_user.role != 'admin':
+        # Users can update their own profile; users.update allows updating all
+        if current_user_id != user_id and not current_user.can('users.update'):
             return jsonify({'error': 'Insufficient permissions'}), 403
         
         user = User.query.get_or_404(user_id)
@@ -137,11 +164,19 @@ def update_user(user_id):
         user.full_name = data.get('full_name', user.full_name)
         user.email = data.get('email', user.email)
         
-        # Only admins can change role and permissions
-        if current_user.role == 'admin':
+        # Skills steer automatic assignment, so only users.update holders set them
+        if 'skills' in data and current_user.can('users.update'):
+            user.skills = json.dumps(data['skills']) if data['skills'] else None
+        
+        # Only users.manage_access holders can change role, permissions and status
+        if current_user.can('users.manage_access'):
+            previous = tuple(getattr(user, field) for field in AUTH_FIELDS)
             user.role = data.get('role', user.role)
             user.permissions = json.dumps(data.get('permissions', {})) if data.get('permissions') else user.permissions
             user.is_active = data.get('is_active', user.is_active)
+            # Tokens carrying the old role or status stop working
+            if tuple(getattr(user, field) for field in AUTH_FIELDS) != previous:
+                user.auth_version = (user.auth_version or 0) + 1
         
         # Update password if provided
         if data.get('password'):
@@ -149,6 +184,7 @@ def update_user(user_id):
         
         user.updated_at = datetime.utcnow()
         db.session.commit()
+        invalidate_identities(user.id)
         
         return jsonify(user.to_dict())
     except Exception as e:
@@ -157,14 +193,10 @@ def update_user(user_id):
 
 @users_bp.route('/api/users/<int:user_id>', methods=['DELETE'])
 @jwt_required()
+@requires('users.delete', 'Only admins can delete users')
 def delete_user(user_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Only admins can delete users
-        if current_user.role != 'admin':
-            return jsonify({'error': 'Only admins can delete users'}), 403
+        current_user_id = int(get_jwt_identity())
         
         # Cannot delete self
         if current_user_id == user_id:
@@ -178,6 +210,7 @@ def delete_user(user_id):
         
         db.session.delete(user)
         db.session.commit()
+        invalidate_identities(user_id)
         
         return jsonify({'message': 'User deleted successfully'})
     except Exception as e:
@@ -185,40 +218,39 @@ def delete_user(user_id):
         return jsonify({'error': str(e)}), 500
 
 @users_bp.route('/api/users/<int:user_id>/assign-task', methods=['POST'])
+@users_bp.route('/api/users/auto/assign-task', methods=['POST'], defaults={'user_id': None})
 @jwt_required()
+@requires('tasks.assign', 'Only admins and managers can assign tasks')
 def assign_task_to_user(user_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Only admins and managers can assign tasks
-        if current_user.role not in ['admin', 'manager']:
-            return jsonify({'error': 'Only admins and managers can assign tasks'}), 403
-        
         data = request.get_json()
         task_id = data.get('task_id')
         
         if not task_id:
             return jsonify({'error': 'task_id is required'}), 400
         
-        user = User.query.get_or_404(user_id)
         task = Task.query.get_or_404(task_id)
         
+        # Least-loaded employee, optionally limited by role and skill
+        if user_id is None:
+            user_id = pick_assignee(data.get('role'), data.get('skill'))
+            if user_id is None:
+                return jsonify({'error': 'No eligible employee for automatic assignment'}), 409
+        
+        user = User.query.get_or_404(user_id)
+        
         # Assign task to user
         task.assigned_to = user_id
         task.updated_at = datetime.utcnow()
         
-        db.session.commit()
-        
-        # Create notification for assigned user
-        notification = Notification(
+        # Create notification for assigned user in the same transaction
+        notify(
             user_id=user_id,
             title='مهمة جديدة تم إسنادها إليك',
             message=f'تم إسناد المهمة "{task.title}" إليك من قبل {current_user.full_name}',
-            type='info',
+            notification_type='info',
             related_task_id=task_id
         )
-        db.session.add(notification)
         db.session.commit()
         
         return jsonify({
@@ -233,11 +265,10 @@ def assign_task_to_user(user_id):
 @jwt_required()
 def get_user_tasks(user_id):
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user_id = int(get_jwt_identity())
         
-        # Users can view their own tasks, admins and managers can view all
-        if current_user_id != user_id and current_user.role not in ['admin', 'manager']:
+        # Users can view their own tasks; users.view allows viewing all
+        if current_user_id != user_id and not current_user.can('users.view'):
             return jsonify({'error': 'Insufficient permissions'}), 403
         
         user = User.query.get_or_404(user_id)
@@ -269,11 +300,8 @@ def get_user_tasks(user_id):
 def get_roles():
     try:
         roles = [
-            {'value': 'admin', 'label': 'مدير النظام'},
-            {'value': 'manager', 'label': 'مدير'},
-            {'value': 'sales', 'label': 'موظف مبيعات'},
-            {'value': 'support', 'label': 'دعم فني'},
-            {'value': 'employee', 'label': 'موظف'}
+            {'value': role, 'label': definition['label'], 'permissions': definition['permissions']}
+            for role, definition in ROLES.items()
         ]
         
         return jsonify({'roles': roles})
@@ -282,19 +310,14 @@ def get_roles():
 
 @users_bp.route('/api/users/employees', methods=['GET'])
 @jwt_required()
+@requires('users.view')
 def get_employees():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
-        
-        # Only admins and managers can view employees list
-        if current_user.role not in ['admin', 'manager']:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         employees = User.query.filter(
             User.is_active == True,
-            User.role.in_(['employee', 'sales', 'support'])
+            User.role.in_(EMPLOYEE_ROLES)
         ).all()
+        task_counts = assigned_task_counts([emp.id for emp in employees])
         
         return jsonify({
             'employees': [
@@ -303,10 +326,19 @@ def get_employees():
                     'full_name': emp.full_name,
                     'role': emp.role,
                     'email': emp.email,
-                    'assigned_tasks_count': emp.assigned_tasks.count()
+                    'assigned_tasks_count': task_counts.get(emp.id, 0)
                 } for emp in employees
             ]
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@users_bp.route('/api/users/workload', methods=['GET'])
+@jwt_required()
+@requires('users.view')
+def get_workload():
+    """Open tasks by status and priority, overdue tasks and this month's orders for every active employee"""
+    try:
+        return jsonify({'employees': employee_workload()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,172 @@
+"""Least-loaded automatic task assignment.
+
+Each active employee's load is the priority-weighted count of their open
+tasks. Loads sit in a min-heap, so picking an assignee pops entries
+until one meets the role/skill constraints, which takes microseconds.
+Stale heap entries (whose load has since changed) are skipped lazily.
+
+The heap is built from one grouped query at startup. After that, task
+writes in this process keep it current: mapper events collect
+``(user, weight)`` deltas during flush and apply them after commit. A bulk
+``Query.update`` skips those events, so its caller records the deltas with
+``record_bulk_task_update``. When
+the shared ``workload`` counter shows a write this process did not make
+(another worker, or a bulk ``Query.update``), or the ``users`` counter shows
+changed users, the heap is rebuilt from the query on the next pick.
+"""
+import heapq
+import json
+import threading
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session, object_session
+from models.user import db, Task, User
+from services.permissions import EMPLOYEE_ROLES
+from services.shared_state import app_local, get_counter
+from services.workload import CLOSED_TASK_STATUSES
+
+PRIORITY_WEIGHTS = {'low': 1, 'medium': 2, 'high': 3, 'urgent': 5}
+
+def task_weight(status, priority):
+    if status in CLOSED_TASK_STATUSES:
+        return 0
+    return PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS['medium'])
+
+def parse_skills(skills_json):
+    try:
+        skills = json.loads(skills_json) if skills_json else []
+    except (TypeError, ValueError):
+        return frozenset()
+    return frozenset(str(skill).strip().lower() for skill in skills) if isinstance(skills, list) else frozenset()
+
+class AssignmentHeap:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._load = {}
+        self._profiles = {}  # user_id -> (role, skills)
+        self._versions = None  # (workload, users) counters the heap reflects
+    
+    def rebuild(self):
+        versions = (get_counter('workload'), get_counter('users'))
+        employees = db.session.query(User.id, User.role, User.skills).filter(
+            User.is_active == True,
+            User.role.in_(EMPLOYEE_ROLES)
+        ).all()
+        weight = case(
+            *[(Task.priority == priority, value) for priority, value in PRIORITY_WEIGHTS.items()],
+            else_=PRIORITY_WEIGHTS['medium']
+        )
+        loads = dict(db.session.query(Task.assigned_to, func.sum(weight)).filter(
+            Task.assigned_to.isnot(None),
+            Task.status.notin_(CLOSED_TASK_STATUSES)
+        ).group_by(Task.assigned_to).all())
+        
+        with self._lock:
+            self._profiles = {user_id: (role, parse_skills(skills)) for user_id, role, skills in employees}
+            self._load = {user_id: loads.get(user_id, 0) for user_id in self._profiles}
+            self._heap = [(load, user_id) for user_id, load in self._load.items()]
+            heapq.heapify(self._heap)
+            self._versions = versions
+    
+    def apply(self, deltas):
+        """Apply committed load changes made by this process"""
+        with self._lock:
+            versions = (get_counter('workload'), get_counter('users'))
+            # Exactly one workload bump (this commit's own) keeps the heap trustworthy
+            if self._versions is None or versions != (self._versions[0] + 1, self._versions[1]):
+                self._versions = None
+                return
+            for user_id, delta in deltas.items():
+                if user_id in self._load and delta:
+                    self._load[user_id] += delta
+                    heapq.heappush(self._heap, (self._load[user_id], user_id))
+            self._versions = versions
+    
+    def invalidate(self):
+        with self._lock:
+            self._versions = None
+    
+    def pick(self, role=None, skill=None):
+        """Least-loaded active employee matching the constraints, or None"""
+        if self._versions != (get_counter('workload'), get_counter('users')):
+            self.rebuild()
+        skill = skill.strip().lower() if skill else None
+        with self._lock:
+            skipped = []
+            chosen = None
+            while self._heap:
+                load, user_id = heapq.heappop(self._heap)
+                if self._load.get(user_id) != load:
+                    continue  # stale entry; a fresher one is further down
+                skipped.append((load, user_id))
+                user_role, skills = self._profiles[user_id]
+                if (role is None or user_role == role) and (skill is None or skill in skills):
+                    chosen = user_id
+                    break
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+            # Drop stale entries that piled up from frequent updates
+            if len(self._heap) > 4 * max(len(self._load), 16):
+                self._heap = [(load, user_id) for user_id, load in self._load.items()]
+                heapq.heapify(self._heap)
+            return chosen
+    
+    def loads(self):
+        with self._lock:
+            return dict(self._load)
+
+assignment_heap = app_local('assignment_heap', lambda app: AssignmentHeap())
+
+def pick_assignee(role=None, skill=None):
+    return assignment_heap.pick(role, skill)
+
+def _add_delta(target, user_id, weight):
+    session = object_session(target)
+    if session is not None:
+        _add_session_delta(session, user_id, weight)
+
+def _add_session_delta(session, user_id, weight):
+    if not user_id or not weight:
+        return
+    deltas = session.info.setdefault('assignment_deltas', {})
+    deltas[user_id] = deltas.get(user_id, 0) + weight
+
+def _previous(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, name)
+
+def record_bulk_task_update(session, rows, values):
+    """Record the load changes of a ``Query.update`` setting ``values`` on ``rows`` (with assigned_to, status, priority)"""
+    for row in rows:
+        _add_session_delta(session, row.assigned_to, -task_weight(row.status, row.priority))
+        _add_session_delta(
+            session, values.get('assigned_to', row.assigned_to),
+            task_weight(values.get('status', row.status), values.get('priority', row.priority))
+        )
+
+@event.listens_for(Task, 'after_insert')
+def _task_inserted(mapper, connection, target):
+    _add_delta(target, target.assigned_to, task_weight(target.status, target.priority))
+
+@event.listens_for(Task, 'after_update')
+def _task_updated(mapper, connection, target):
+    state = inspect(target)
+    _add_delta(target, _previous(state, 'assigned_to'), -task_weight(_previous(state, 'status'), _previous(state, 'priority')))
+    _add_delta(target, target.assigned_to, task_weight(target.status, target.priority))
+
+@event.listens_for(Task, 'after_delete')
+def _task_deleted(mapper, connection, target):
+    _add_delta(target, target.assigned_to, -task_weight(target.status, target.priority))
+
+# Registered after services.workload's listener, so the workload counter is already bumped here
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_deltas(session):
+    deltas = session.info.pop('assignment_deltas', None)
+    if deltas:
+        assignment_heap.apply(deltas)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_deltas(session):
+    session.info.pop('assignment_deltas', None)
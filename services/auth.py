@@ -0,0 +1,86 @@
+"""Request identity for JWT-protected endpoints.
+
+Access tokens carry the user's ``auth_version`` as a claim; role and
+status are read from the identity, never trusted from the token. ``init_auth`` registers a user lookup with Flask-JWT-Extended, so
+every ``@jwt_required()`` handler can use ``flask_jwt_extended.current_user``.
+That is an ``AuthUser`` snapshot from a small per-process LRU, so in the
+steady state it needs no SQL. The snapshot carries the user's compiled
+permission mask (services/permissions.py).
+
+The LRU is keyed by the user's shared counter (services/shared_state.py).
+A change to a user (``update_user``, ``delete_user``) bumps that user's
+counter after commit, so every worker refetches that user, and only that
+user, on its next lookup. Changes to role, permissions or the active flag
+also raise the user's own ``auth_version``. Tokens issued before such a
+change stop matching and are rejected with 401.
+Logged-out and rotated tokens are rejected through the denylist in
+services/revocation.py.
+"""
+from collections import namedtuple
+from flask import jsonify
+from models.user import User
+from services.permissions import compile_permissions, has_permission
+from services.revocation import is_token_revoked
+from services.shared_state import VersionedCache, app_local, bump_counter, bump_user_counter, get_user_counter
+
+class AuthUser(namedtuple('AuthUser', [
+    'id', 'username', 'full_name', 'role', 'permissions', 'is_active', 'auth_version', 'created_at', 'permission_mask'
+])):
+    __slots__ = ()
+    
+    def can(self, permission):
+        return has_permission(self, permission)
+
+# Fields whose change invalidates tokens already issued to the user
+AUTH_FIELDS = ('role', 'permissions', 'is_active')
+
+_identities = app_local('identities', lambda app: VersionedCache(None, max_entries=1024))
+
+def _snapshot(user_id):
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    return AuthUser(
+        user.id, user.username, user.full_name, user.role, user.permissions,
+        bool(user.is_active), user.auth_version or 0, user.created_at,
+        compile_permissions(user.role, user.permissions)
+    )
+
+def load_identity(user_id):
+    # Token subjects are strings
+    user_id = int(user_id)
+    return _identities.get((user_id, get_user_counter(user_id)), lambda: _snapshot(user_id))
+
+def invalidate_identities(*user_ids):
+    """Call after committing changes to user rows, passing the ids of changed or deleted users"""
+    for user_id in user_ids:
+        bump_user_counter(user_id)
+    # Assignment and workload figures cover every active user
+    bump_counter('users')
+
+def token_claims(user):
+    """Additional claims embedded in access tokens at login"""
+    return {'auth_version': user.auth_version or 0}
+
+def init_auth(jwt):
+    @jwt.user_lookup_loader
+    def _lookup_user(jwt_header, jwt_data):
+        identity = load_identity(jwt_data['sub'])
+        if identity is None or not identity.is_active:
+            return None
+        # Tokens minted before the current auth version (or without one) predate a role or status change
+        if jwt_data.get('auth_version', 0) != identity.auth_version:
+            return None
+        return identity
+    
+    @jwt.token_in_blocklist_loader
+    def _token_revoked(jwt_header, jwt_data):
+        return is_token_revoked(jwt_data['jti'])
+    
+    @jwt.revoked_token_loader
+    def _revoked(jwt_header, jwt_data):
+        return jsonify({'error': 'Token has been revoked, please log in again'}), 401
+    
+    @jwt.user_lookup_error_loader
+    def _lookup_failed(jwt_header, jwt_data):
+        return jsonify({'error': 'Session is no longer valid, please log in again'}), 401
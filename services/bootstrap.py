@@ -0,0 +1,66 @@
+"""One-time database setup for ``flask crm init-db`` and ``flask crm seed``.
+
+Creating tables, upgrading older schemas, moving chat tables to their own
+database and backfilling derived chat data all reflect the schema and run
+queries. That is too slow to repeat in every worker process, so
+``create_app`` does none of it unless ``AUTO_INIT_DB`` is set. Even then it
+runs under a host-wide lock, so workers booting together do not race to
+create tables or insert the admin user.
+"""
+import fcntl
+import os
+from models.user import db, upgrade_schema, ChatConversation, ChatMessage, User
+from services.chat import backfill_conversation_keys, ensure_unique_memberships, rebuild_conversations
+from services.chat_search import index_missing_messages
+from services.chat_storage import migrate_chat_storage
+from services.settings import seed_default_settings
+
+DEFAULT_ADMIN_PASSWORD = 'admin123'
+
+def init_database(batch_size=1000):
+    """Create missing tables and bring existing databases up to date"""
+    db.create_all()
+    ensure_unique_memberships()
+    upgrade_schema()
+    migrate_chat_storage(batch_size)
+    backfill_conversation_keys()
+    build_missing_conversations()
+    index_missing_messages()
+
+def build_missing_conversations():
+    """Build chat_conversations from the messages of databases that predate it; returns rows written"""
+    if db.session.query(ChatConversation.id).first() or not db.session.query(ChatMessage.id).first():
+        return 0
+    return rebuild_conversations()
+
+def seed_database(admin_password=DEFAULT_ADMIN_PASSWORD):
+    """Create the admin account and default settings where missing; returns True if the admin was created"""
+    created = False
+    if not User.query.filter_by(username='admin').first():
+        admin = User(
+            username='admin',
+            full_name='System Administrator',
+            email='admin@crm.com',
+            role='admin',
+            is_active=True
+        )
+        admin.set_password(admin_password)
+        db.session.add(admin)
+        created = True
+    seed_default_settings()
+    db.session.commit()
+    return created
+
+def init_database_exclusive(app, seed=True):
+    """``init_database`` (and ``seed_database``) under a host-wide lock; concurrent callers wait, then find nothing to do"""
+    lock_path = os.path.join(app.instance_path, 'init-db.lock')
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with app.app_context():
+                init_database(app.config.get('CHAT_MIGRATION_BATCH_SIZE', 1000))
+                if seed:
+                    seed_database()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,325 @@
+"""Chat delivery: an in-process broker fed by the chat write endpoints.
+
+Every chat event is published to a per-user topic for each participant
+(both sides of a direct message, every member of a group), after the
+write has committed. The broker keeps the last ``CHAT_EVENT_HISTORY``
+events per user so ``GET /api/chat/updates?since=`` can return what a
+client missed between polls without touching the database.
+
+``chat_conversations`` holds one summary row per user per conversation
+(last message, preview, unread count). It is written in the same
+transaction as the message or read it reflects, so the inbox is a single
+indexed query.
+
+Read state is a per-user watermark (``last_read_message_id``) on that row:
+everything up to it is read, unread counts are the messages from others
+above it, and group read receipts are answered by comparing the members'
+watermarks instead of storing a row per member per message.
+
+Group membership is cached per process (each user's group ids and each
+group's member ids) under the shared ``chat_membership`` version, which
+every membership change bumps after commit, so authorization checks on
+the send path cost no SQL once warm.
+"""
+from datetime import datetime
+from sqlalchemy import case, event, func, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.user import db, chat_connection, ChatConversation, ChatGroupMember, ChatMessage, User
+from services.pubsub import Broker
+from services.shared_state import VersionedCache, app_local, bump_counter
+
+CHAT_EVENT_HISTORY = 50
+
+PREVIEW_LENGTH = 100
+
+chat_broker = app_local('chat_broker', lambda app: Broker(max_queue=200, history=CHAT_EVENT_HISTORY))
+
+def chat_topic(user_id):
+    return f'chat:user:{user_id}'
+
+class MembershipCache:
+    """User -> group ids and group -> member ids, valid for one membership version"""
+    
+    def __init__(self, max_entries=20000):
+        self._cache = VersionedCache('chat_membership', max_entries)
+    
+    def group_ids(self, user_id):
+        return self._cache.get(('user', int(user_id)), lambda: frozenset(
+            group_id for (group_id,) in db.session.query(ChatGroupMember.group_id).filter_by(user_id=user_id)
+        ))
+    
+    def member_ids(self, group_id):
+        return self._cache.get(('group', int(group_id)), lambda: frozenset(
+            user_id for (user_id,) in db.session.query(ChatGroupMember.user_id).filter_by(group_id=group_id)
+        ))
+    
+    def is_member(self, user_id, group_id):
+        return int(group_id) in self.group_ids(user_id)
+
+membership_cache = app_local('membership_cache', lambda app: MembershipCache())
+
+def invalidate_memberships():
+    """Call after committing any chat_group_members change"""
+    bump_counter('chat_membership')
+
+def group_member_ids(group_id):
+    return list(membership_cache.member_ids(group_id))
+
+def ensure_unique_memberships():
+    """Drop duplicate memberships so the unique (group_id, user_id) index can be created"""
+    indexes = {index['name'] for index in inspect(db.engines['chat']).get_indexes('chat_group_members')}
+    if 'uq_chat_group_members_group_user' in indexes:
+        return 0
+    result = chat_connection().execute(text("""
+        DELETE FROM chat_group_members
+        WHERE id NOT IN (SELECT MIN(id) FROM chat_group_members GROUP BY group_id, user_id)
+    """))
+    db.session.commit()
+    return result.rowcount
+
+def publish_to_users(user_ids, event_name, data):
+    for user_id in set(user_ids):
+        chat_broker.publish(chat_topic(user_id), event_name, data)
+
+def preload_users(user_ids):
+    """Load users from the main database in one query.
+    
+    They stay in the session identity map, so the sender, receiver, creator
+    and member relationships of chat rows resolve without a query each.
+    """
+    ids = {int(user_id) for user_id in user_ids if user_id}
+    return {user.id: user for user in User.query.filter(User.id.in_(ids))} if ids else {}
+
+def message_participants(message):
+    if message.group_id:
+        return group_member_ids(message.group_id)
+    return [message.sender_id, message.receiver_id]
+
+def wait_for_updates(user_id, cursor, timeout):
+    """Return ``(events, cursor, complete)`` for ``user_id``, blocking up to ``timeout`` seconds.
+    
+    A cursor issued by another worker process (or before a restart) cannot
+    be compared with local sequence numbers, so it is answered at once
+    with ``complete=False`` and a fresh cursor.
+    """
+    since = chat_broker.parse_cursor(cursor)
+    if since is None:
+        return [], chat_broker.cursor(), False
+    topic = chat_topic(user_id)
+    # Subscribe before reading history so an event published in between is not lost
+    subscription = chat_broker.subscribe([topic])
+    try:
+        events, complete = chat_broker.events_since([topic], since)
+        if complete and not events:
+            events = [item for item in subscription.drain(timeout) if item[0] > since]
+    finally:
+        chat_broker.unsubscribe(subscription)
+    cursor = chat_broker.cursor(max([since] + [item[0] for item in events]) if complete else None)
+    return events, cursor, complete
+
+def direct_key(user_a, user_b):
+    low, high = sorted((int(user_a), int(user_b)))
+    return f'dm:{low}:{high}'
+
+def group_key(group_id):
+    return f'g:{group_id}'
+
+def key_participants(conversation_key):
+    """User ids in a conversation, from the key and the membership cache; None if malformed"""
+    parts = conversation_key.split(':')
+    try:
+        if parts[0] == 'dm' and len(parts) == 3:
+            return [int(parts[1]), int(parts[2])]
+        if parts[0] == 'g' and len(parts) == 2:
+            return group_member_ids(int(parts[1]))
+    except ValueError:
+        pass
+    return None
+
+def message_key(message):
+    if message.group_id:
+        return group_key(message.group_id)
+    return direct_key(message.sender_id, message.receiver_id)
+
+@event.listens_for(ChatMessage, 'before_insert')
+def _set_conversation_key(mapper, connection, target):
+    if not target.conversation_key:
+        target.conversation_key = message_key(target)
+
+def backfill_conversation_keys():
+    """Fill conversation_key on messages written before the column existed"""
+    result = chat_connection().execute(text("""
+        UPDATE chat_messages
+        SET conversation_key = CASE
+            WHEN group_id IS NOT NULL THEN 'g:' || group_id
+            ELSE 'dm:' || MIN(sender_id, receiver_id) || ':' || MAX(sender_id, receiver_id)
+        END
+        WHERE conversation_key IS NULL
+    """))
+    db.session.commit()
+    return result.rowcount
+
+def _conversation_upsert():
+    table = ChatConversation.__table__
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'conversation_key'],
+        set_={
+            'last_message_id': stmt.excluded.last_message_id,
+            'last_message_preview': stmt.excluded.last_message_preview,
+            'last_message_at': stmt.excluded.last_message_at,
+            'last_sender_id': stmt.excluded.last_sender_id,
+            # Sending a message implies having read everything before it
+            'last_read_message_id': case(
+                (stmt.excluded.user_id == stmt.excluded.last_sender_id, stmt.excluded.last_message_id),
+                else_=table.c.last_read_message_id
+            ),
+            'unread_count': case(
+                (stmt.excluded.user_id == stmt.excluded.last_sender_id, 0),
+                else_=table.c.unread_count + stmt.excluded.unread_count
+            )
+        }
+    )
+
+def record_message(message, participant_ids):
+    """Move every participant's conversation row to ``message`` (flushed, same transaction)"""
+    key = message_key(message)
+    preview = message.message_text[:PREVIEW_LENGTH]
+    rows = []
+    for user_id in set(participant_ids):
+        if message.group_id:
+            peer_user_id = None
+        else:
+            peer_user_id = message.receiver_id if user_id == message.sender_id else message.sender_id
+        rows.append({
+            'user_id': user_id,
+            'conversation_key': key,
+            'peer_user_id': peer_user_id,
+            'group_id': message.group_id,
+            'last_message_id': message.id,
+            'last_message_preview': preview,
+            'last_message_at': message.timestamp,
+            'last_sender_id': message.sender_id,
+            'last_read_message_id': message.id if user_id == message.sender_id else None,
+            'unread_count': 0 if user_id == message.sender_id else 1
+        })
+    db.session.execute(_conversation_upsert(), rows)
+
+def open_group_conversations(group_id, user_ids):
+    """Give new members an inbox row for the group before any message is sent"""
+    stmt = sqlite_insert(ChatConversation.__table__).on_conflict_do_nothing()
+    now = datetime.utcnow()
+    db.session.execute(stmt, [
+        {
+            'user_id': user_id,
+            'conversation_key': group_key(group_id),
+            'group_id': group_id,
+            'last_message_at': now,
+            'unread_count': 0
+        } for user_id in set(user_ids)
+    ])
+
+def count_unread_after(user_id, key, watermark):
+    query = db.session.query(func.count(ChatMessage.id)).filter(
+        ChatMessage.conversation_key == key,
+        ChatMessage.sender_id != user_id
+    )
+    if watermark:
+        query = query.filter(ChatMessage.id > watermark)
+    return query.scalar()
+
+def advance_read_watermark(conversation, up_to=None):
+    """Move ``conversation``'s watermark forward to ``up_to`` (default: latest); returns True if it moved"""
+    target = conversation.last_message_id or 0
+    if up_to is not None:
+        target = min(up_to, target)
+    if target <= (conversation.last_read_message_id or 0):
+        return False
+    
+    conversation.last_read_message_id = target
+    conversation.unread_count = count_unread_after(conversation.user_id, conversation.conversation_key, target)
+    
+    if not conversation.group_id:
+        # Keep the per-message flag that older clients read in step for direct messages
+        ChatMessage.query.filter(
+            ChatMessage.conversation_key == conversation.conversation_key,
+            ChatMessage.receiver_id == conversation.user_id,
+            ChatMessage.id <= target,
+            ChatMessage.is_read == False
+        ).update({'is_read': True}, synchronize_session=False)
+    return True
+
+def conversation_participants(conversation):
+    if conversation.group_id:
+        return group_member_ids(conversation.group_id)
+    return [conversation.user_id, conversation.peer_user_id]
+
+def rebuild_conversations():
+    """Recompute every conversation row from chat_messages and memberships; returns rows written"""
+    watermarks = {
+        (user_id, key): last_read for user_id, key, last_read in db.session.query(
+            ChatConversation.user_id, ChatConversation.conversation_key, ChatConversation.last_read_message_id
+        ) if last_read
+    }
+    ChatConversation.query.delete()
+    rows = {}
+    
+    # Direct messages, seen from both sides
+    sides = [
+        (ChatMessage.sender_id, ChatMessage.receiver_id, db.literal(0)),
+        (ChatMessage.receiver_id, ChatMessage.sender_id, db.case((ChatMessage.is_read == False, 1), else_=0))
+    ]
+    for owner, peer, unread in sides:
+        grouped = db.session.query(
+            owner, peer, func.max(ChatMessage.id), func.sum(unread)
+        ).filter(ChatMessage.receiver_id.isnot(None)).group_by(owner, peer)
+        for user_id, peer_user_id, last_id, unread_total in grouped:
+            row = rows.setdefault((user_id, direct_key(user_id, peer_user_id)), {
+                'user_id': user_id,
+                'conversation_key': direct_key(user_id, peer_user_id),
+                'peer_user_id': peer_user_id,
+                'group_id': None,
+                'last_message_id': 0,
+                'unread_count': 0
+            })
+            row['last_message_id'] = max(row['last_message_id'], last_id)
+            row['unread_count'] += unread_total or 0
+    
+    # Groups: every member gets the group's latest message
+    latest_by_group = dict(db.session.query(
+        ChatMessage.group_id, func.max(ChatMessage.id)
+    ).filter(ChatMessage.group_id.isnot(None)).group_by(ChatMessage.group_id).all())
+    for group_id, user_id, joined_at in db.session.query(
+        ChatGroupMember.group_id, ChatGroupMember.user_id, ChatGroupMember.joined_at
+    ):
+        rows[(user_id, group_key(group_id))] = {
+            'user_id': user_id,
+            'conversation_key': group_key(group_id),
+            'peer_user_id': None,
+            'group_id': group_id,
+            'last_message_id': latest_by_group.get(group_id),
+            'last_message_at': joined_at,
+            'unread_count': 0
+        }
+    
+    message_ids = list({row['last_message_id'] for row in rows.values() if row['last_message_id']})
+    messages = {}
+    for start in range(0, len(message_ids), 500):
+        for message in ChatMessage.query.filter(ChatMessage.id.in_(message_ids[start:start + 500])):
+            messages[message.id] = message
+    
+    for (user_id, key), row in rows.items():
+        row['last_read_message_id'] = watermarks.get((user_id, key))
+        if row['last_read_message_id']:
+            row['unread_count'] = count_unread_after(user_id, key, row['last_read_message_id'])
+    
+    for row in rows.values():
+        message = messages.get(row['last_message_id'])
+        row['last_message_preview'] = message.message_text[:PREVIEW_LENGTH] if message else None
+        row['last_message_at'] = message.timestamp if message else row.get('last_message_at')
+        row['last_sender_id'] = message.sender_id if message else None
+    
+    if rows:
+        db.session.execute(ChatConversation.__table__.insert(), list(rows.values()))
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,126 @@
+"""Tiered storage for chat history.
+
+Messages older than ``CHAT_ARCHIVE_AFTER_DAYS`` move out of the main
+database into ``archived_chat_messages`` on the ``chat_archive`` bind (a
+separate SQLite file). Text is stored zlib-compressed with the month it
+was sent, indexed by ``(conversation_key, id)`` so history pages keep
+using keyset seeks once they run past the hot window.
+
+Each batch is first copied (keyed by message id) and committed to the
+archive, then deleted from the hot table together with its search index
+rows. A crash between the two steps leaves rows that are already in the
+archive; the next run recognises them as the same messages and only
+deletes them. Any other id collision raises ``ArchiveConflict`` before
+anything is deleted, so a message is never dropped in favour of a
+different one. Archived messages drop out of full-text search.
+"""
+import time
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from models.user import db, ArchivedChatMessage, ChatGroup, ChatMessage, User
+from services.chat_search import unindex_messages
+
+class ArchiveConflict(Exception):
+    pass
+
+def _archive_row(message):
+    return {
+        'id': message.id,
+        'conversation_key': message.conversation_key,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'group_id': message.group_id,
+        'message_compressed': zlib.compress(message.message_text.encode('utf-8')),
+        'timestamp': message.timestamp,
+        'archive_month': message.timestamp.strftime('%Y-%m') if message.timestamp else None,
+        'is_read': message.is_read,
+        'archived_at': datetime.utcnow()
+    }
+
+def _already_archived(messages):
+    """Messages of the batch a previous run copied before it was interrupted; raises ArchiveConflict on any other id"""
+    by_id = {message.id: message for message in messages}
+    existing = db.session.query(
+        ArchivedChatMessage.id, ArchivedChatMessage.conversation_key,
+        ArchivedChatMessage.sender_id, ArchivedChatMessage.timestamp
+    ).filter(ArchivedChatMessage.id.in_(by_id)).all()
+    conflicts = [
+        row.id for row in existing
+        if (row.conversation_key, row.sender_id, row.timestamp) != (
+            by_id[row.id].conversation_key, by_id[row.id].sender_id, by_id[row.id].timestamp
+        )
+    ]
+    if conflicts:
+        raise ArchiveConflict(f'Archive already holds different messages with ids {conflicts}')
+    return {row.id for row in existing}
+
+def archive_messages(config):
+    """Move messages past the hot window to the archive and return a report"""
+    max_age_days = config.get('CHAT_ARCHIVE_AFTER_DAYS', 0)
+    batch_size = config.get('CHAT_ARCHIVE_BATCH_SIZE', 1000)
+    report = {'archived': 0, 'batches': 0, 'duration_seconds': 0.0}
+    if not max_age_days:
+        return report
+    
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    while True:
+        messages = ChatMessage.query.filter(ChatMessage.timestamp < cutoff).order_by(
+            ChatMessage.id
+        ).limit(batch_size).all()
+        if not messages:
+            break
+        
+        ids = [message.id for message in messages]
+        copied = _already_archived(messages)
+        pending = [_archive_row(message) for message in messages if message.id not in copied]
+        if pending:
+            # A plain insert: an id that appears in between still fails instead of being skipped
+            db.session.execute(insert(ArchivedChatMessage.__table__), pending)
+            db.session.commit()
+        
+        unindex_messages(ids)
+        ChatMessage.query.filter(ChatMessage.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        
+        report['archived'] += len(ids)
+        report['batches'] += 1
+        if len(ids) < batch_size:
+            break
+    
+    report['duration_seconds'] = round(time.perf_counter() - started, 4)
+    return report
+
+def archived_page(conversation_key, before_id, limit):
+    """Keyset page of archived messages, newest first, serialised like ChatMessage.to_dict"""
+    query = ArchivedChatMessage.query.filter(ArchivedChatMessage.conversation_key == conversation_key)
+    if before_id:
+        query = query.filter(ArchivedChatMessage.id < before_id)
+    rows = query.order_by(ArchivedChatMessage.id.desc()).limit(limit).all()
+    if not rows:
+        return []
+    
+    # Users and groups live in the main database: one lookup each for the page
+    user_ids = {row.sender_id for row in rows} | {row.receiver_id for row in rows if row.receiver_id}
+    group_ids = {row.group_id for row in rows if row.group_id}
+    names = dict(db.session.query(User.id, User.full_name).filter(User.id.in_(user_ids)))
+    group_names = dict(db.session.query(ChatGroup.id, ChatGroup.name).filter(ChatGroup.id.in_(group_ids))) if group_ids else {}
+    
+    return [
+        {
+            'id': row.id,
+            'sender_id': row.sender_id,
+            'sender_name': names.get(row.sender_id),
+            'receiver_id': row.receiver_id,
+            'receiver_name': names.get(row.receiver_id),
+            'group_id': row.group_id,
+            'group_name': group_names.get(row.group_id),
+            'conversation_key': row.conversation_key,
+            'message_text': row.message_text,
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+            'is_read': row.is_read,
+            'archived': True
+        } for row in rows
+    ]
@@ -0,0 +1,135 @@
+"""Full-text search over chat history using an SQLite FTS5 index.
+
+``chat_messages_fts`` is keyed by the message id (its rowid) and holds a
+normalised copy of the text plus light-stemmed tokens. Normalisation makes
+Arabic spelling variants match each other: diacritics and tatweel are
+dropped, alef/hamza forms fold to bare alef, alef maqsura to ya and ta
+marbuta to ha. Stemming strips the definite article and its attached
+prepositions (ال، بال، وال، فال، كال، لل), so "بالعميل" finds "العميل".
+
+Rows are written from an ``after_insert`` hook in the same transaction as
+the message. Search joins back to ``chat_messages`` and applies the same
+visibility rules as ``get_messages`` inside the SQL.
+"""
+import re
+from sqlalchemy import event, text
+from models.user import db, chat_connection, ChatMessage
+
+FTS_TABLE = 'chat_messages_fts'
+
+# Harakat, Quranic marks, superscript alef and tatweel
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_LETTER_FOLDS = str.maketrans({
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0649': '\u064a',  # alef maqsura -> ya
+    '\u0629': '\u0647',  # ta marbuta -> ha
+    '\u0624': '\u0648',  # waw with hamza -> waw
+    '\u0626': '\u064a',  # ya with hamza -> ya
+})
+# Definite article with attached prepositions, longest first
+_ARTICLE_PREFIXES = ('\u0648\u0627\u0644', '\u0628\u0627\u0644', '\u0641\u0627\u0644',
+                     '\u0643\u0627\u0644', '\u0644\u0644', '\u0627\u0644')
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def normalize(value):
+    return _DIACRITICS.sub('', value or '').translate(_LETTER_FOLDS).lower()
+
+def stem(token):
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+def _document(message_text):
+    body = normalize(message_text)
+    stems = ' '.join(stem(token) for token in _TOKEN.findall(body))
+    return body, stems
+
+def build_match_query(query):
+    """Turn user input into an FTS5 expression: every term must match, as a prefix"""
+    terms = []
+    for token in _TOKEN.findall(normalize(query)):
+        stemmed = stem(token)
+        terms.append(f'(body:"{token}"* OR stems:"{stemmed}"*)')
+    return ' AND '.join(terms)
+
+def ensure_search_index(connection=None):
+    (connection or chat_connection()).execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5(body, stems, tokenize='unicode61 remove_diacritics 2')"
+    ))
+
+def index_messages(messages, connection=None):
+    rows = []
+    for message in messages:
+        body, stems = _document(message.message_text)
+        rows.append({'rowid': message.id, 'body': body, 'stems': stems})
+    if rows:
+        (connection or chat_connection()).execute(
+            text(f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, body, stems) VALUES (:rowid, :body, :stems)'),
+            rows
+        )
+
+def unindex_messages(message_ids, connection=None):
+    if message_ids:
+        (connection or chat_connection()).execute(
+            text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :rowid'),
+            [{'rowid': message_id} for message_id in message_ids]
+        )
+
+def index_missing_messages(batch_size=1000):
+    """Index messages newer than the highest indexed id; returns the number indexed"""
+    ensure_search_index()
+    last_indexed = chat_connection().execute(text(f'SELECT COALESCE(MAX(rowid), 0) FROM {FTS_TABLE}')).scalar()
+    total = 0
+    while True:
+        messages = ChatMessage.query.filter(ChatMessage.id > last_indexed).order_by(
+            ChatMessage.id
+        ).limit(batch_size).all()
+        if not messages:
+            break
+        index_messages(messages)
+        db.session.commit()
+        last_indexed = messages[-1].id
+        total += len(messages)
+    return total
+
+def rebuild_search_index(batch_size=1000):
+    ensure_search_index()
+    chat_connection().execute(text(f'DELETE FROM {FTS_TABLE}'))
+    db.session.commit()
+    return index_missing_messages(batch_size)
+
+def search_messages(user_id, query, before_id=None, limit=20, conversation_key=None):
+    """Return ``[(message_id, snippet)]``, newest first, limited to conversations ``user_id`` can read"""
+    match = build_match_query(query)
+    if not match:
+        return []
+    
+    sql = f"""
+        SELECT m.id, snippet({FTS_TABLE}, 0, '<mark>', '</mark>', '…', 12)
+        FROM {FTS_TABLE} f
+        JOIN chat_messages m ON m.id = f.rowid
+        WHERE {FTS_TABLE} MATCH :match
+          AND (
+            (m.group_id IS NULL AND (m.sender_id = :user_id OR m.receiver_id = :user_id))
+            OR m.group_id IN (SELECT group_id FROM chat_group_members WHERE user_id = :user_id)
+          )
+    """
+    params = {'match': match, 'user_id': user_id, 'limit': limit}
+    if before_id:
+        sql += ' AND f.rowid < :before_id'
+        params['before_id'] = before_id
+    if conversation_key:
+        sql += ' AND m.conversation_key = :conversation_key'
+        params['conversation_key'] = conversation_key
+    sql += ' ORDER BY f.rowid DESC LIMIT :limit'
+    
+    return chat_connection().execute(text(sql), params).all()
+
+@event.listens_for(ChatMessage, 'after_insert')
+def _index_inserted_message(mapper, connection, target):
+    index_messages([target], connection)
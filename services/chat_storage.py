@@ -0,0 +1,99 @@
+"""Moving chat tables from the main database to the ``chat`` bind.
+
+Chat writes are the most frequent writes in the app. SQLite allows one
+writer per file, so keeping chat in its own file stops message traffic from
+queueing behind order and stock writes. Databases created before the split
+still hold chat_groups, chat_group_members, chat_messages and
+chat_conversations in the main file. ``migrate_chat_storage`` copies them
+across in id order, in batches, keeping their ids. The copy is idempotent,
+so an interrupted run can be repeated. Older files may hold duplicate
+memberships or conversation rows that the unique indexes on the chat bind
+refuse; the first (lowest id) of each is kept, as ``ensure_unique_memberships``
+does. The source tables are dropped only after every distinct row (by
+unique key) is present on the chat bind. ``flask crm init-db`` runs
+the migration (services/bootstrap.py) before workers start serving, so no
+new message can take a legacy id first.
+"""
+from sqlalchemy import UniqueConstraint, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.user import db, ChatConversation, ChatGroup, ChatGroupMember, ChatMessage
+
+# Parents before children
+CHAT_TABLES = [ChatGroup.__table__, ChatGroupMember.__table__, ChatMessage.__table__, ChatConversation.__table__]
+
+def chat_is_separate():
+    return db.engines['chat'].url != db.engine.url
+
+def legacy_chat_tables():
+    """Chat tables still present in the main database"""
+    if not chat_is_separate():
+        return []
+    existing = set(inspect(db.engine).get_table_names())
+    return [table for table in CHAT_TABLES if table.name in existing]
+
+def _identity_columns(table, source_columns):
+    """Columns that identify a row for the completeness check: the first unique key the source can be read by"""
+    unique_keys = [index.columns for index in table.indexes if index.unique]
+    unique_keys += [constraint.columns for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+    for columns in unique_keys:
+        if all(column.name in source_columns for column in columns):
+            return list(columns)
+    return list(table.primary_key.columns)
+
+def _count_distinct(connection, columns):
+    return connection.execute(select(func.count()).select_from(select(*columns).distinct().subquery())).scalar()
+
+def _copy_table(source, target, table, batch_size):
+    source_columns = {column['name'] for column in inspect(source).get_columns(table.name)}
+    columns = [column for column in table.columns if column.name in source_columns]
+    copied = 0
+    last_id = 0
+    with source.connect() as reader:
+        while True:
+            rows = reader.execute(
+                select(*columns).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+            with target.begin() as writer:
+                writer.execute(sqlite_insert(table).on_conflict_do_nothing(), [dict(row) for row in rows])
+            copied += len(rows)
+            last_id = rows[-1]['id']
+    
+    # Duplicates of a unique key are dropped on the way, so compare distinct keys rather than rows
+    identity = _identity_columns(table, source_columns)
+    with source.connect() as reader, target.connect() as writer:
+        source_count = _count_distinct(reader, identity)
+        target_count = _count_distinct(writer, identity)
+    return copied, source_count, target_count
+
+def migrate_chat_storage(batch_size=1000, drop_source=True):
+    """Copy legacy chat tables to the chat bind and return a per-table report"""
+    from services.chat import backfill_conversation_keys, invalidate_memberships
+    from services.chat_search import index_missing_messages
+    
+    report = {'tables': {}, 'dropped': False}
+    tables = legacy_chat_tables()
+    if not tables:
+        return report
+    
+    source = db.engine
+    target = db.engines['chat']
+    complete = True
+    for table in tables:
+        copied, source_count, target_count = _copy_table(source, target, table, batch_size)
+        report['tables'][table.name] = {'copied': copied, 'source_rows': source_count, 'chat_rows': target_count}
+        complete = complete and target_count >= source_count
+    
+    # Rows arrive through Core inserts, which skip the ORM hooks that fill these
+    report['conversation_keys'] = backfill_conversation_keys()
+    report['indexed'] = index_missing_messages(batch_size)
+    invalidate_memberships()
+    
+    if drop_source and complete:
+        with source.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS chat_messages_fts'))
+            for table in reversed(tables):
+                connection.execute(text(f'DROP TABLE {table.name}'))
+        report['dropped'] = True
+    return report
@@ -0,0 +1,262 @@
+"""Notification delivery helpers.
+
+Every ``Notification`` written through the ORM session is collected after
+flush and published to the in-process broker once the transaction commits,
+so push subscribers never see rows that were rolled back. Bulk inserts go
+through ``add_notifications`` which queues the inserted rows the same way.
+
+Unread and total counts per user live in ``notification_counters`` and are
+adjusted in the same transaction as the change to ``notifications``. A
+missing counter row is initialised from the table on its first adjustment,
+so databases created before the counters existed converge on their own;
+``flask crm repair-notification-counters`` recomputes every row.
+
+Broadcasts are stored once in ``broadcast_notifications`` and merged into
+each recipient's list and unread count at read time. Read state is sparse:
+``broadcast_receipts`` only gains a row when a user reads a broadcast, so
+sending costs one insert whatever the audience size.
+
+Repeated events about the same order or task are coalesced by ``notify``:
+within ``NOTIFICATION_COALESCE_WINDOW`` seconds an unread notification with
+the same (user, type, entity) key is updated in place with the latest
+message and an occurrence counter instead of inserting a new row.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, event, false, insert, or_, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models.user import (
+    db, Notification, NotificationCounter, BroadcastNotification, BroadcastReceipt
+)
+from services.chat import membership_cache
+from services.pubsub import Broker
+from services.shared_state import app_local
+
+broker = app_local('notification_broker', lambda app: Broker(max_queue=100))
+
+BROADCAST_TOPIC = 'broadcasts'
+
+# Who a user is for the purpose of broadcast targeting
+Audience = namedtuple('Audience', ['user_id', 'role', 'group_ids', 'since'])
+
+def user_topic(user_id):
+    return f'user:{user_id}'
+
+def _outbox(session):
+    return session.info.setdefault('notification_outbox', [])
+
+def queue_event(user_id, event_name, data=None, session=None):
+    """Publish ``event_name`` to ``user_id`` after the current transaction commits"""
+    queue_topic_event(user_topic(user_id), event_name, data, session)
+
+def queue_topic_event(topic, event_name, data=None, session=None):
+    session = session or db.session()
+    _outbox(session).append((topic, event_name, data))
+
+# The SELECT seeds a missing row from the table, which already reflects the
+# change being counted; an existing row is adjusted by the deltas instead.
+COUNTER_UPSERT = text("""
+    INSERT INTO notification_counters (user_id, unread_count, total_count)
+    SELECT :user_id,
+           (SELECT COUNT(*) FROM notifications WHERE user_id = :user_id AND is_read = 0),
+           (SELECT COUNT(*) FROM notifications WHERE user_id = :user_id)
+    WHERE 1
+    ON CONFLICT (user_id) DO UPDATE SET
+        unread_count = unread_count + :unread_delta,
+        total_count = total_count + :total_delta
+""")
+
+COUNTER_REBUILD = text("""
+    INSERT INTO notification_counters (user_id, unread_count, total_count)
+    SELECT user_id, SUM(CASE WHEN is_read = 0 THEN 1 ELSE 0 END), COUNT(*)
+    FROM notifications
+    GROUP BY user_id
+""")
+
+def adjust_counters(deltas, connection=None):
+    """Apply ``{user_id: (unread_delta, total_delta)}`` to the counters in one executemany"""
+    params = [
+        {'user_id': user_id, 'unread_delta': unread_delta, 'total_delta': total_delta}
+        for user_id, (unread_delta, total_delta) in deltas.items()
+        if unread_delta or total_delta
+    ]
+    if not params:
+        return
+    if connection is not None:
+        connection.execute(COUNTER_UPSERT, params)
+    else:
+        db.session.execute(COUNTER_UPSERT, params)
+
+def unread_count(user_id):
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is not None:
+        return counter.unread_count
+    # No counter yet: either no notifications or rows predating the counters
+    return Notification.query.filter_by(user_id=user_id, is_read=False).count()
+
+def rebuild_counters():
+    """Recompute every counter from the notifications table, returning the number of users"""
+    NotificationCounter.query.delete()
+    db.session.execute(COUNTER_REBUILD)
+    db.session.commit()
+    return NotificationCounter.query.count()
+
+def add_notifications(rows):
+    """Insert many notifications with one executemany and queue them for delivery"""
+    if not rows:
+        return []
+    notifications = db.session.scalars(insert(Notification).returning(Notification), rows).all()
+    per_user = Counter(notification.user_id for notification in notifications)
+    unread = Counter(notification.user_id for notification in notifications if not notification.is_read)
+    adjust_counters({user_id: (unread[user_id], total) for user_id, total in per_user.items()})
+    for notification in notifications:
+        queue_event(notification.user_id, 'notification', notification.to_dict())
+    return notifications
+
+def coalesce_key_for(user_id, notification_type, related_order_id=None, related_task_id=None):
+    if related_order_id:
+        return f'{user_id}:{notification_type}:order:{related_order_id}'
+    if related_task_id:
+        return f'{user_id}:{notification_type}:task:{related_task_id}'
+    return None
+
+def notify(user_id, title, message, notification_type='info', related_task_id=None, related_order_id=None):
+    """Create a notification, or fold it into a recent unread one about the same entity"""
+    now = datetime.utcnow()
+    key = coalesce_key_for(user_id, notification_type, related_order_id, related_task_id)
+    window = current_app.config.get('NOTIFICATION_COALESCE_WINDOW', 0)
+    
+    if key and window:
+        existing = Notification.query.filter(
+            Notification.coalesce_key == key,
+            Notification.is_read == False,
+            Notification.updated_at >= now - timedelta(seconds=window)
+        ).order_by(Notification.id.desc()).first()
+        if existing:
+            existing.title = title
+            existing.message = message
+            existing.occurrences = (existing.occurrences or 1) + 1
+            existing.updated_at = now
+            queue_event(user_id, 'notification_updated', existing.to_dict())
+            return existing
+    
+    notification = Notification(
+        user_id=user_id,
+        title=title,
+        message=message,
+        type=notification_type,
+        related_task_id=related_task_id,
+        related_order_id=related_order_id,
+        coalesce_key=key,
+        updated_at=now
+    )
+    db.session.add(notification)
+    return notification
+
+def audience_for(user):
+    # Group ids come from the shared membership cache, so count polls and stream opens stay query-free
+    return Audience(user.id, user.role, membership_cache.group_ids(user.id), user.created_at)
+
+def audience_matches(audience, broadcast):
+    """Check a broadcast dict against an audience without touching the database"""
+    if broadcast['target_role'] is None and broadcast['target_group_id'] is None:
+        return True
+    return broadcast['target_role'] == audience.role or broadcast['target_group_id'] in audience.group_ids
+
+def _audience_filter(audience):
+    conditions = [
+        and_(BroadcastNotification.target_role.is_(None), BroadcastNotification.target_group_id.is_(None)),
+        BroadcastNotification.target_role == audience.role,
+        BroadcastNotification.target_group_id.in_(audience.group_ids) if audience.group_ids else false()
+    ]
+    condition = or_(*conditions)
+    if audience.since:
+        # New users do not inherit announcements made before they joined
+        condition = and_(condition, BroadcastNotification.created_at >= audience.since)
+    return condition
+
+def _unread_receipt_join(query, audience):
+    return query.outerjoin(BroadcastReceipt, and_(
+        BroadcastReceipt.broadcast_id == BroadcastNotification.id,
+        BroadcastReceipt.user_id == audience.user_id
+    ))
+
+def visible_broadcasts(audience, unread_only=False, limit=None):
+    query = _unread_receipt_join(
+        db.session.query(BroadcastNotification, BroadcastReceipt.read_at), audience
+    ).filter(_audience_filter(audience))
+    if unread_only:
+        query = query.filter(BroadcastReceipt.broadcast_id.is_(None))
+    query = query.order_by(BroadcastNotification.created_at.desc())
+    if limit:
+        query = query.limit(limit)
+    return [broadcast.to_dict(is_read=read_at is not None) for broadcast, read_at in query]
+
+def unread_broadcast_count(audience):
+    return _unread_receipt_join(BroadcastNotification.query, audience).filter(
+        _audience_filter(audience),
+        BroadcastReceipt.broadcast_id.is_(None)
+    ).count()
+
+def total_unread_count(audience):
+    return unread_count(audience.user_id) + unread_broadcast_count(audience)
+
+def mark_broadcasts_read(audience, broadcast_ids=None):
+    """Record receipts for unread broadcasts visible to the audience; returns rows written"""
+    query = select(
+        BroadcastNotification.id, db.literal(audience.user_id), db.literal(datetime.utcnow())
+    ).where(_audience_filter(audience))
+    if broadcast_ids is not None:
+        query = query.where(BroadcastNotification.id.in_(broadcast_ids))
+    result = db.session.execute(
+        sqlite_insert(BroadcastReceipt).from_select(
+            ['broadcast_id', 'user_id', 'read_at'], query
+        ).on_conflict_do_nothing()
+    )
+    if result.rowcount:
+        queue_event(audience.user_id, 'count')
+    return result.rowcount
+
+def send_broadcast(title, message, created_by, notification_type='info', target_role=None, target_group_id=None):
+    broadcast = BroadcastNotification(
+        title=title,
+        message=message,
+        type=notification_type,
+        target_role=target_role,
+        target_group_id=target_group_id,
+        created_by=created_by
+    )
+    db.session.add(broadcast)
+    db.session.flush()
+    queue_topic_event(BROADCAST_TOPIC, 'broadcast', broadcast.to_dict())
+    return broadcast
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_notifications(session, flush_context):
+    inserted = [obj for obj in session.new if isinstance(obj, Notification)]
+    if not inserted:
+        return
+    # Counted once per flush: a batched INSERT writes every row before any per-row event runs,
+    # so a counter seeded from the table already includes all of them
+    per_user = Counter(notification.user_id for notification in inserted)
+    unread = Counter(notification.user_id for notification in inserted if not notification.is_read)
+    adjust_counters(
+        {user_id: (unread[user_id], total) for user_id, total in per_user.items()},
+        session.connection(bind_arguments={'mapper': Notification.__mapper__})
+    )
+    for notification in inserted:
+        _outbox(session).append((user_topic(notification.user_id), 'notification', notification.to_dict()))
+
+@event.listens_for(Session, 'after_commit')
+def _publish_outbox(session):
+    outbox = session.info.pop('notification_outbox', None)
+    if not outbox:
+        return
+    for topic, event_name, data in outbox:
+        broker.publish(topic, event_name, data)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_outbox(session):
+    session.info.pop('notification_outbox', None)
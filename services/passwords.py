@@ -0,0 +1,124 @@
+"""Password verification on a bounded bcrypt pool.
+
+bcrypt is meant to be slow, and a login storm would otherwise pin every
+request worker on hashing. Verification runs on a small thread pool:
+bcrypt releases the GIL, so the pool size caps the cores spent on
+hashing. Under gevent the pool uses gevent's native threads, so hashing
+never blocks the event loop that serves the other connections. An
+admission semaphore caps how many verifications may wait. Past that
+limit ``verify_password`` raises ``PasswordHasherBusy`` right away, and
+so does a verification that has not finished within
+``PASSWORD_HASH_TIMEOUT``. Login answers 503 either way instead of
+queueing behind the CPU.
+
+``BCRYPT_ROUNDS`` sets the work factor for new hashes. When a login
+succeeds against a hash made with a lower cost, the same pool task
+re-hashes the password at the configured cost, and the caller stores it.
+Hashes with a higher cost are kept, so lowering the setting never
+weakens stored passwords.
+
+Bulk provisioning hashes hundreds of new passwords at once with
+``hash_passwords``. That work runs on a short-lived process pool sized to
+the cores, outside the login pool, so it cannot eat the login admission
+slots. Its children come from a ``forkserver`` that only imports bcrypt,
+never from a fork of the multithreaded request worker.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import repeat
+import bcrypt
+from services.shared_state import app_local, set_app_state
+
+class PasswordHasherBusy(Exception):
+    pass
+
+def hash_cost(password_hash):
+    """Work factor encoded in a ``$2b$<cost>$...`` hash"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _verify_and_upgrade(password, password_hash, rounds):
+    encoded = password.encode('utf-8')
+    if not bcrypt.checkpw(encoded, password_hash.encode('utf-8')):
+        return False, None
+    if (hash_cost(password_hash) or 0) < rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+def _native_thread_pool(workers):
+    """A pool of OS threads, even in a gevent worker where patched threads would run bcrypt on the event loop"""
+    try:
+        from gevent import monkey
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return GeventThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=2, max_pending=16, timeout=10):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = _native_thread_pool(workers)
+        self._admission = threading.BoundedSemaphore(workers + max_pending)
+    
+    def verify(self, password, password_hash):
+        """Return ``(matches, upgraded_hash_or_None)``; raises PasswordHasherBusy when saturated or too slow"""
+        if not self._admission.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._executor.submit(_verify_and_upgrade, password, password_hash, self.rounds)
+        except Exception:
+            self._admission.release()
+            raise
+        future.add_done_callback(lambda _: self._admission.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Still queued: drop it; already hashing: it finishes and frees its slot on its own
+            future.cancel()
+            raise PasswordHasherBusy()
+
+def _create_password_hasher(app):
+    return PasswordHasher(
+        rounds=app.config.get('BCRYPT_ROUNDS', 12),
+        workers=app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 2,
+        max_pending=app.config.get('PASSWORD_HASH_QUEUE', 16),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+    )
+
+password_hasher = app_local('password_hasher', _create_password_hasher)
+
+def init_password_hasher(app):
+    return set_app_state(app, 'password_hasher', _create_password_hasher(app))
+
+def verify_password(user, password):
+    """Check ``password`` for ``user``, upgrading the stored hash in the session when its cost is stale"""
+    matches, upgraded_hash = password_hasher.verify(password, user.password_hash)
+    if upgraded_hash:
+        user.password_hash = upgraded_hash
+    return matches
+
+def hash_passwords(passwords, workers=None):
+    """Hash ``passwords`` at the configured cost on a process pool, preserving order"""
+    rounds = password_hasher.rounds
+    workers = min(workers or os.cpu_count() or 1, len(passwords))
+    if workers <= 1:
+        return [_hash(password, rounds) for password in passwords]
+    # Forking a threaded worker can copy a lock another thread holds mid-update, so children
+    # are forked from a single-threaded server that has imported only bcrypt. Like spawn, each
+    # child still imports the script's __main__ (flask or gunicorn), whose startup is guarded.
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['bcrypt'])
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        chunksize = max(1, len(passwords) // (workers * 4))
+        return list(pool.map(_hash, passwords, repeat(rounds), chunksize=chunksize))
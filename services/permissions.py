@@ -0,0 +1,87 @@
+"""Permission registry compiled to integer bitmasks.
+
+Every right has a fixed bit. A role maps to the union of its rights'
+bits, and ``User.permissions`` (JSON) adjusts that per user. There,
+``{"reports.view_all": true, "tasks.assign": false}`` grants one right and
+revokes the other, and a plain list of names only grants. The compiled
+mask is stored on the cached request identity (services/auth.py), so an
+authorization check is a single AND.
+
+Bits are positional: add new permissions at the end of ``PERMISSIONS``.
+"""
+import json
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import current_user
+
+PERMISSIONS = [
+    'users.view',           # list users and view other users' profiles and tasks
+    'users.create',
+    'users.update',         # edit other users' profiles
+    'users.manage_access',  # change role, permissions and active flag
+    'users.delete',
+    'tasks.view_all',       # see every task, not only own
+    'tasks.manage_all',     # edit, reassign and delete any task
+    'tasks.assign',         # assign tasks to other users
+    'reports.view_all',     # reports over every task, not only own
+    'settings.manage',
+    'notifications.broadcast',
+]
+
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = (1 << len(PERMISSIONS)) - 1
+
+ROLES = {
+    'admin': {'label': 'مدير النظام', 'permissions': PERMISSIONS},
+    'manager': {'label': 'مدير', 'permissions': ['users.view', 'tasks.assign', 'notifications.broadcast']},
+    'sales': {'label': 'موظف مبيعات', 'permissions': []},
+    'support': {'label': 'دعم فني', 'permissions': []},
+    'employee': {'label': 'موظف', 'permissions': []},
+}
+
+# Roles that do the work tasks are assigned to
+EMPLOYEE_ROLES = ('employee', 'sales', 'support')
+
+def _mask(names):
+    mask = 0
+    for name in names:
+        mask |= PERMISSION_BITS.get(name, 0)
+    return mask
+
+ROLE_MASKS = {role: _mask(definition['permissions']) for role, definition in ROLES.items()}
+
+def compile_permissions(role, permissions_json=None):
+    """Role mask adjusted by a user's JSON grants; unknown names are ignored"""
+    mask = ROLE_MASKS.get(role, 0)
+    if not permissions_json:
+        return mask
+    try:
+        grants = json.loads(permissions_json)
+    except (TypeError, ValueError):
+        return mask
+    if isinstance(grants, list):
+        return mask | _mask(grants)
+    if isinstance(grants, dict):
+        for name, granted in grants.items():
+            bit = PERMISSION_BITS.get(name, 0)
+            mask = mask | bit if granted else mask & ~bit
+    return mask
+
+def permission_names(mask):
+    return [name for name in PERMISSIONS if mask & PERMISSION_BITS[name]]
+
+def has_permission(user, permission):
+    return bool(user.permission_mask & PERMISSION_BITS[permission])
+
+def requires(permission, message='Insufficient permissions'):
+    """Reject the request with 403 unless the current user holds ``permission``; place under @jwt_required()"""
+    bit = PERMISSION_BITS[permission]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_user.permission_mask & bit:
+                return jsonify({'error': message}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
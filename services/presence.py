@@ -0,0 +1,139 @@
+"""Chat presence and typing indicators, kept in memory only.
+
+A user is online while their last heartbeat is younger than
+CHAT_PRESENCE_TTL. Heartbeats are millisecond timestamps in an mmap-backed
+array indexed by user id, so a heartbeat is one 8-byte store and a
+presence query is a handful of reads. With CHAT_PRESENCE_SHARED the
+array is backed by a file (opened on first use, in the instance folder
+unless CHAT_PRESENCE_PATH says otherwise), so every worker on the host
+shares it. Ids past CHAT_PRESENCE_MAX_USERS fall back to a dict local to
+the process that only keeps heartbeats younger than the TTL.
+
+Typing state is per conversation and expires after CHAT_TYPING_TTL. It is
+delivered as ``typing`` events through the chat broker. Repeated keystroke
+pings inside the TTL are absorbed here instead of producing an event each.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from services.shared_state import app_local
+
+SLOT_SIZE = 8
+
+class PresenceRegistry:
+    def __init__(self, max_users=65536, ttl=60, path=None):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.path = path
+        size = max_users * SLOT_SIZE
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                os.close(fd)
+        else:
+            self._map = mmap.mmap(-1, size)
+        self._lock = threading.Lock()
+        self._overflow = OrderedDict()  # user_id -> stamp, oldest heartbeat first
+
+    def touch(self, user_id, now=None):
+        """Record a heartbeat; returns True when the user was offline before it"""
+        user_id = int(user_id)
+        stamp = int((now or time.time()) * 1000)
+        previous = self._last_seen_ms(user_id)
+        if 0 < user_id < self.max_users:
+            struct.pack_into('<Q', self._map, user_id * SLOT_SIZE, stamp)
+        else:
+            with self._lock:
+                self._overflow[user_id] = stamp
+                self._overflow.move_to_end(user_id)
+                # Anyone whose heartbeat is past the TTL is offline anyway
+                cutoff = stamp - self.ttl * 1000
+                while self._overflow and next(iter(self._overflow.values())) < cutoff:
+                    self._overflow.popitem(last=False)
+        return not previous or stamp - previous > self.ttl * 1000
+
+    def _last_seen_ms(self, user_id):
+        if 0 < user_id < self.max_users:
+            return struct.unpack_from('<Q', self._map, user_id * SLOT_SIZE)[0]
+        return self._overflow.get(user_id, 0)
+
+    def status(self, user_ids, now=None):
+        now_ms = int((now or time.time()) * 1000)
+        result = {}
+        for user_id in user_ids:
+            stamp = self._last_seen_ms(int(user_id))
+            result[int(user_id)] = {
+                'online': bool(stamp) and now_ms - stamp <= self.ttl * 1000,
+                'last_seen': datetime.utcfromtimestamp(stamp / 1000).isoformat() if stamp else None
+            }
+        return result
+
+class TypingRegistry:
+    def __init__(self, ttl=6):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._typing = {}  # conversation_key -> {user_id: (expires_at, announced_until)}
+
+    def update(self, conversation_key, user_id, typing, now=None):
+        """Apply a typing ping; returns True when listeners need an event"""
+        now = now or time.time()
+        with self._lock:
+            users = self._typing.setdefault(conversation_key, {})
+            for other_id in [uid for uid, (expires, _) in users.items() if expires <= now]:
+                del users[other_id]
+            entry = users.get(user_id)
+            if typing:
+                # Re-announce once half the announced TTL has passed so clients keep the indicator alive
+                announce = entry is None or entry[1] - now < self.ttl / 2
+                users[user_id] = (now + self.ttl, now + self.ttl if announce else entry[1])
+                return announce
+            users.pop(user_id, None)
+            if not users:
+                del self._typing[conversation_key]
+            return entry is not None
+
+    def typing_users(self, conversation_key, now=None):
+        now = now or time.time()
+        with self._lock:
+            users = self._typing.get(conversation_key, {})
+            return sorted(uid for uid, (expires, _) in users.items() if expires > now)
+
+def _create_presence(app):
+    path = None
+    if app.config.get('CHAT_PRESENCE_SHARED', True):
+        path = app.config.get('CHAT_PRESENCE_PATH') or os.path.join(app.instance_path, 'presence.bin')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return PresenceRegistry(
+        max_users=app.config.get('CHAT_PRESENCE_MAX_USERS', 65536),
+        ttl=app.config.get('CHAT_PRESENCE_TTL', 60),
+        path=path
+    )
+
+def _create_typing_state(app):
+    return TypingRegistry(ttl=app.config.get('CHAT_TYPING_TTL', 6))
+
+presence = app_local('presence', _create_presence)
+typing_state = app_local('typing_state', _create_typing_state)
+
+def heartbeat(user_id):
+    return presence.touch(user_id)
+
+def presence_status(user_ids):
+    return presence.status(user_ids)
+
+def set_typing(conversation_key, user_id, typing):
+    return typing_state.update(conversation_key, user_id, typing)
+
+def typing_users(conversation_key):
+    return typing_state.typing_users(conversation_key)
+
+def typing_ttl():
+    return typing_state.ttl
@@ -0,0 +1,101 @@
+"""Bulk user provisioning.
+
+``provision_users`` creates many accounts in one request and reports
+each row's outcome. All rows are validated first. Usernames and emails
+are checked against each other and against ``users`` in a single query,
+so a bad row costs no hashing. The remaining passwords are hashed in
+parallel (``hash_passwords``), and the users are inserted with one
+executemany and committed together. Rows that fail validation are
+reported and skipped, and the rest are still created.
+"""
+import csv
+import io
+import json
+from sqlalchemy import insert, or_
+from models.user import db, User
+from services.auth import invalidate_identities
+from services.passwords import hash_passwords
+from services.permissions import ROLES
+
+REQUIRED_FIELDS = ('username', 'password', 'full_name', 'email')
+
+CSV_TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+def parse_csv_rows(content):
+    """Rows from CSV with a header line; ``skills`` is a ``;``-separated list"""
+    rows = []
+    for record in csv.DictReader(io.StringIO(content.lstrip('\ufeff'))):
+        # Empty cells fall back to the defaults
+        row = {key.strip(): value.strip() for key, value in record.items() if key and value and value.strip()}
+        if 'skills' in row:
+            row['skills'] = [skill.strip() for skill in row['skills'].split(';') if skill.strip()]
+        if 'is_active' in row:
+            row['is_active'] = row['is_active'].lower() in CSV_TRUE_VALUES
+        rows.append(row)
+    return rows
+
+def _row_error(row):
+    if not isinstance(row, dict):
+        return 'Row must be an object'
+    for field in REQUIRED_FIELDS:
+        if not row.get(field) or not isinstance(row[field], str):
+            return f'{field} is required'
+    if row.get('role', 'employee') not in ROLES:
+        return 'Unknown role'
+    if row.get('skills') is not None and not isinstance(row['skills'], list):
+        return 'skills must be a list'
+    return None
+
+def provision_users(rows):
+    """Create the valid rows and return ``(created_count, per-row results)``"""
+    results = [{'row': index + 1, 'username': row.get('username') if isinstance(row, dict) else None} for index, row in enumerate(rows)]
+    valid = []
+    for result, row in zip(results, rows):
+        error = _row_error(row)
+        if error:
+            result.update(status='error', error=error)
+        else:
+            row['username'] = row['username'].strip()
+            row['email'] = row['email'].strip()
+            valid.append((result, row))
+    
+    # Duplicates within the batch, then against the table in one query
+    seen_usernames, seen_emails, unique = set(), set(), []
+    for result, row in valid:
+        if row['username'] in seen_usernames or row['email'] in seen_emails:
+            result.update(status='error', error='Duplicate username or email in request')
+            continue
+        seen_usernames.add(row['username'])
+        seen_emails.add(row['email'])
+        unique.append((result, row))
+    taken = db.session.query(User.username, User.email).filter(
+        or_(User.username.in_(seen_usernames), User.email.in_(seen_emails))
+    ).all() if unique else []
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+    accepted = []
+    for result, row in unique:
+        if row['username'] in taken_usernames or row['email'] in taken_emails:
+            result.update(status='error', error='Username or email already exists')
+        else:
+            accepted.append((result, row))
+    if not accepted:
+        return 0, results
+    
+    password_hashes = hash_passwords([row['password'] for _, row in accepted])
+    # RETURNING order is not guaranteed across a batched insert, so ids are matched by username
+    created = dict(db.session.execute(insert(User).returning(User.username, User.id), [{
+        'username': row['username'],
+        'password_hash': password_hash,
+        'full_name': row['full_name'],
+        'email': row['email'],
+        'role': row.get('role', 'employee'),
+        'skills': json.dumps(row['skills']) if row.get('skills') else None,
+        'is_active': bool(row.get('is_active', True))
+    } for (_, row), password_hash in zip(accepted, password_hashes)]).all())
+    db.session.commit()
+    invalidate_identities()
+    
+    for result, row in accepted:
+        result.update(status='created', id=created[row['username']])
+    return len(created), results
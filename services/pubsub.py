@@ -0,0 +1,147 @@
+"""In-process publish/subscribe broker used by the push endpoints.
+
+Subscribers are plain objects holding a bounded deque guarded by a
+``threading.Condition``, so the broker works unchanged under threaded
+workers and under gevent (whose monkey patching makes the condition
+cooperative). Events only reach subscribers living in the same process;
+run push endpoints on workers that also handle the writes, or accept that
+clients on other workers fall back to their resync logic.
+"""
+import itertools
+import os
+import secrets
+import threading
+from collections import deque
+
+
+class Subscription:
+    """A single subscriber's bounded event queue"""
+    
+    def __init__(self, topics, max_queue):
+        self.topics = frozenset(topics)
+        self.events = deque(maxlen=max_queue)
+        self.condition = threading.Condition()
+        self.lagged = False
+        self.closed = False
+    
+    def put(self, item):
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                # Oldest event is dropped; the consumer must resync
+                self.lagged = True
+            self.events.append(item)
+            self.condition.notify()
+    
+    def drain(self, timeout=None):
+        """Wait up to ``timeout`` seconds and return all pending events (possibly empty)"""
+        with self.condition:
+            if not self.events and not self.closed:
+                self.condition.wait(timeout)
+            items = list(self.events)
+            self.events.clear()
+            return items
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Broker:
+    """Topic based fan-out of ``(seq, topic, event, data)`` tuples to subscribers.
+    
+    With ``history`` set, the last ``history`` events of every topic are kept
+    so long-poll clients can ask for everything after a cursor. Sequence
+    numbers are per process and restart from 1 with it, so cursors handed
+    to clients are ``<epoch>:<seq>``. The epoch (pid plus a random token,
+    renewed in forked children) makes a cursor from another worker or an
+    earlier run of this one fail to parse instead of matching local events.
+    """
+    
+    def __init__(self, max_queue=100, history=0):
+        self.max_queue = max_queue
+        self.history = history
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._recent = {}
+        self._seq = itertools.count(1)
+        self.last_seq = 0
+        self._epoch_pid = None
+        self._epoch = None
+    
+    @property
+    def epoch(self):
+        pid = os.getpid()
+        if pid != self._epoch_pid:
+            self._epoch = f'{pid}-{secrets.token_hex(4)}'
+            self._epoch_pid = pid
+        return self._epoch
+    
+    def cursor(self, seq=None):
+        """Client-facing cursor for ``seq`` (default: the latest event)"""
+        return f'{self.epoch}:{self.last_seq if seq is None else seq}'
+    
+    def parse_cursor(self, cursor):
+        """Sequence number of a cursor issued by this process, or None for any other cursor"""
+        epoch, _, seq = (cursor or '').rpartition(':')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+    
+    def subscribe(self, topics):
+        subscription = Subscription(topics, self.max_queue)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+    
+    def publish(self, topic, event, data=None):
+        with self._lock:
+            seq = next(self._seq)
+            self.last_seq = seq
+            item = (seq, topic, event, data)
+            if self.history:
+                recent = self._recent.get(topic)
+                if recent is None:
+                    recent = self._recent[topic] = deque(maxlen=self.history)
+                recent.append(item)
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put(item)
+        return seq
+    
+    def events_since(self, topics, since):
+        """Return ``(events, complete)`` for retained events newer than ``since``.
+        
+        ``complete`` is False when older events the caller has not seen were
+        already evicted, in which case the client has to resync from the
+        database. ``since`` must come from ``parse_cursor``.
+        """
+        complete = since <= self.last_seq
+        events = []
+        with self._lock:
+            for topic in topics:
+                recent = self._recent.get(topic)
+                if not recent:
+                    continue
+                if len(recent) == recent.maxlen and recent[0][0] > since:
+                    complete = False
+                events.extend(item for item in recent if item[0] > since)
+        events.sort(key=lambda item: item[0])
+        return events, complete
+    
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._subscribers.get(topic, ()))
+            return len({sub for subs in self._subscribers.values() for sub in subs})
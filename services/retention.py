@@ -0,0 +1,177 @@
+"""Notification retention: age and per-user caps enforced in bounded batches.
+
+Policy comes from app config:
+
+``NOTIFICATION_RETENTION_DAYS``      delete rows older than this (0 disables)
+``NOTIFICATION_RETENTION_MAX_PER_USER`` keep at most this many rows per user (0 disables)
+``NOTIFICATION_RETENTION_KEEP_UNREAD`` never delete unread rows
+``NOTIFICATION_RETENTION_BATCH_SIZE`` rows deleted per transaction
+``NOTIFICATION_ARCHIVE_DIR``         if set, rows are appended to
+                                     ``notifications-YYYY-MM.ndjson.gz`` there before deletion
+``NOTIFICATION_RETENTION_INTERVAL``  seconds between background runs (0 disables the thread)
+
+Each batch is its own short transaction so the SQLite write lock is never
+held for more than one batch; the report records the longest hold.
+"""
+import fcntl
+import gzip
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func
+from models.user import db, Notification, BroadcastNotification, BroadcastReceipt
+from services.notifications import adjust_counters, queue_event
+
+def _archive(rows, archive_dir):
+    by_month = defaultdict(list)
+    for row in rows:
+        month = row.created_at.strftime('%Y-%m') if row.created_at else 'undated'
+        by_month[month].append(row)
+    for month, month_rows in by_month.items():
+        path = os.path.join(archive_dir, f'notifications-{month}.ndjson.gz')
+        # Appending starts a new gzip member; gzip readers concatenate members
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in month_rows:
+                archive.write(json.dumps(row.to_dict(), ensure_ascii=False) + '\n')
+
+def _delete_batch(ids, archive_dir, report):
+    rows = Notification.query.filter(Notification.id.in_(ids)).all()
+    if archive_dir:
+        _archive(rows, archive_dir)
+        report['archived'] += len(rows)
+    
+    started = time.perf_counter()
+    # Counter deltas come from the rows this DELETE removed; they may have been read since the SELECT above
+    deleted_rows = db.session.execute(
+        delete(Notification).where(Notification.id.in_(ids)).returning(Notification.user_id, Notification.is_read),
+        execution_options={'synchronize_session': False}
+    ).all()
+    deleted = len(deleted_rows)
+    totals = Counter(user_id for user_id, _ in deleted_rows)
+    unread = Counter(user_id for user_id, is_read in deleted_rows if not is_read)
+    adjust_counters({user_id: (-unread[user_id], -total) for user_id, total in totals.items()})
+    for user_id in unread:
+        queue_event(user_id, 'count')
+    db.session.commit()
+    held = time.perf_counter() - started
+    
+    db.session.expunge_all()
+    report['deleted'] += deleted
+    report['batches'] += 1
+    report['lock_seconds_total'] += held
+    report['lock_seconds_max'] = max(report['lock_seconds_max'], held)
+
+def run_retention(config):
+    """Apply the retention policy once and return a report of what was reclaimed"""
+    max_age_days = config.get('NOTIFICATION_RETENTION_DAYS', 0)
+    max_per_user = config.get('NOTIFICATION_RETENTION_MAX_PER_USER', 0)
+    keep_unread = config.get('NOTIFICATION_RETENTION_KEEP_UNREAD', True)
+    batch_size = config.get('NOTIFICATION_RETENTION_BATCH_SIZE', 500)
+    archive_dir = config.get('NOTIFICATION_ARCHIVE_DIR')
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+    
+    report = {
+        'deleted': 0,
+        'archived': 0,
+        'broadcasts_deleted': 0,
+        'batches': 0,
+        'lock_seconds_total': 0.0,
+        'lock_seconds_max': 0.0
+    }
+    started = time.perf_counter()
+    
+    if max_age_days:
+        cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+        while True:
+            query = db.session.query(Notification.id).filter(Notification.created_at < cutoff)
+            if keep_unread:
+                query = query.filter(Notification.is_read == True)
+            ids = [row.id for row in query.order_by(Notification.id).limit(batch_size)]
+            if not ids:
+                break
+            _delete_batch(ids, archive_dir, report)
+            if len(ids) < batch_size:
+                break
+    
+        # Broadcasts age out with the same policy; their sparse receipts go with them
+        while True:
+            ids = [row.id for row in db.session.query(BroadcastNotification.id).filter(
+                BroadcastNotification.created_at < cutoff
+            ).order_by(BroadcastNotification.id).limit(batch_size)]
+            if not ids:
+                break
+            BroadcastReceipt.query.filter(BroadcastReceipt.broadcast_id.in_(ids)).delete(synchronize_session=False)
+            report['broadcasts_deleted'] += BroadcastNotification.query.filter(
+                BroadcastNotification.id.in_(ids)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if len(ids) < batch_size:
+                break
+    
+    if max_per_user:
+        over_limit = db.session.query(Notification.user_id).group_by(
+            Notification.user_id
+        ).having(func.count(Notification.id) > max_per_user).all()
+        
+        for (user_id,) in over_limit:
+            # Everything past the newest max_per_user rows is eligible
+            newest = db.session.query(Notification.id).filter(
+                Notification.user_id == user_id
+            ).order_by(Notification.created_at.desc(), Notification.id.desc()).limit(max_per_user)
+            while True:
+                query = db.session.query(Notification.id).filter(
+                    Notification.user_id == user_id,
+                    Notification.id.notin_(newest.scalar_subquery())
+                )
+                if keep_unread:
+                    query = query.filter(Notification.is_read == True)
+                ids = [row.id for row in query.order_by(Notification.id).limit(batch_size)]
+                if not ids:
+                    break
+                _delete_batch(ids, archive_dir, report)
+                if len(ids) < batch_size:
+                    break
+    
+    report['duration_seconds'] = round(time.perf_counter() - started, 4)
+    report['lock_seconds_total'] = round(report['lock_seconds_total'], 4)
+    report['lock_seconds_max'] = round(report['lock_seconds_max'], 4)
+    return report
+
+def run_retention_exclusive(app):
+    """Run retention unless another process on this host already is; returns None if skipped"""
+    lock_path = os.path.join(app.instance_path, 'notification-retention.lock')
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            with app.app_context():
+                return run_retention(app.config)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def start_retention_worker(app):
+    """Start a daemon thread applying the retention policy every NOTIFICATION_RETENTION_INTERVAL seconds"""
+    interval = app.config.get('NOTIFICATION_RETENTION_INTERVAL', 0)
+    if not interval:
+        return None
+    
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                report = run_retention_exclusive(app)
+                if report and report['deleted']:
+                    app.logger.info('Notification retention: %s', report)
+            except Exception:
+                app.logger.exception('Notification retention run failed')
+    
+    thread = threading.Thread(target=loop, name='notification-retention', daemon=True)
+    thread.start()
+    return thread
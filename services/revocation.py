@@ -0,0 +1,116 @@
+"""Revoked JWT denylist, checked on every request without SQL.
+
+Logout and refresh-token rotation write the token's ``jti`` to
+``revoked_tokens`` and, after commit, bump the shared ``revoked_tokens``
+counter. Each process keeps a Bloom filter and an exact set of revoked
+jtis. When the counter moves it pulls only the rows added since its last
+sync. A lookup first asks the Bloom filter, which answers "not revoked"
+for almost every live token after a few hashes. Only a filter hit
+consults the exact set, so false positives never reject a valid token.
+
+Rows are only needed until the token's own expiry. ``prune_revoked_tokens``
+deletes the rest. The in-memory structures start over from the table once
+they reach ``REVOKED_TOKEN_CAPACITY`` entries.
+"""
+import hashlib
+import math
+import threading
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.user import db, RevokedToken
+from services.shared_state import app_local, bump_counter, get_counter, set_app_state
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+    
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class TokenDenylist:
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._version = None
+        self._reset()
+    
+    def _reset(self):
+        self._bloom = BloomFilter(self.capacity)
+        self._exact = set()
+        self._last_id = 0
+    
+    def _sync(self):
+        bloom, exact, last_id = self._bloom, self._exact, self._last_id
+        if len(exact) >= self.capacity:
+            # Start over from the table in fresh structures; expired rows are skipped
+            bloom, exact, last_id = BloomFilter(self.capacity), set(), 0
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(
+            RevokedToken.id > last_id,
+            RevokedToken.expires_at > datetime.utcnow()
+        ).order_by(RevokedToken.id).all()
+        for row_id, jti in rows:
+            bloom.add(jti)
+            exact.add(jti)
+            last_id = row_id
+        self._bloom, self._exact, self._last_id = bloom, exact, last_id
+    
+    def is_revoked(self, jti):
+        version = get_counter('revoked_tokens')
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._sync()
+                    self._version = version
+        return jti in self._bloom and jti in self._exact
+    
+    def __len__(self):
+        return len(self._exact)
+
+def _create_denylist(app):
+    return TokenDenylist(app.config.get('REVOKED_TOKEN_CAPACITY', 100000))
+
+denylist = app_local('denylist', _create_denylist)
+
+def init_denylist(app):
+    return set_app_state(app, 'denylist', _create_denylist(app))
+
+def is_token_revoked(jti):
+    return denylist.is_revoked(jti)
+
+def revoke_token(jwt_data):
+    """Record a decoded token as revoked in the current session; call publish_revocations() after commit.
+
+    Returns False when the token was already revoked, so a refresh token can be rotated only once.
+    """
+    result = db.session.execute(
+        sqlite_insert(RevokedToken.__table__).on_conflict_do_nothing(index_elements=['jti']),
+        {
+            'jti': jwt_data['jti'],
+            'token_type': jwt_data.get('type', 'access'),
+            'user_id': int(jwt_data['sub']) if jwt_data.get('sub') is not None else None,
+            'expires_at': datetime.utcfromtimestamp(jwt_data['exp']),
+            'revoked_at': datetime.utcnow()
+        }
+    )
+    return result.rowcount == 1
+
+def publish_revocations():
+    bump_counter('revoked_tokens')
+
+def prune_revoked_tokens():
+    """Delete rows for tokens that have expired on their own; returns the number removed"""
+    removed = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
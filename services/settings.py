@@ -0,0 +1,107 @@
+"""Application settings with a per-process cache.
+
+The whole ``settings`` table is small, so each worker keeps one snapshot
+of it, keyed to the shared ``settings`` counter. Reading a setting
+(``setting_value``) is a counter read from shared memory plus a dict
+lookup. A worker refetches the table on the first read after any worker
+has bumped the counter.
+
+Writes go through ``save_settings``: one executemany upsert for any
+number of keys, then a counter bump after commit. Known keys are typed
+by ``SETTING_TYPES``. Values are stored as text, and ``setting_value``
+converts them back.
+"""
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.user import db, Setting
+from services.shared_state import VersionedCache, app_local, bump_counter
+
+SETTING_TYPES = {
+    'company_name': str,
+    'language': str,
+    'theme': str,
+    'currency': str,
+    'low_stock_threshold': int,
+}
+
+# Seeded on first boot
+DEFAULT_SETTINGS = [
+    {'key': 'company_name', 'value': 'شركة إدارة علاقات العملاء', 'description': 'اسم الشركة'},
+    {'key': 'language', 'value': 'ar', 'description': 'اللغة الافتراضية'},
+    {'key': 'theme', 'value': 'light', 'description': 'السمة الافتراضية'},
+    {'key': 'currency', 'value': 'SAR', 'description': 'العملة الافتراضية'},
+    {'key': 'low_stock_threshold', 'value': '10', 'description': 'حد تنبيه المخزون المنخفض'}
+]
+
+_cache = app_local('settings_cache', lambda app: VersionedCache('settings', max_entries=1))
+
+def _load():
+    return {setting.key: setting.to_dict() for setting in Setting.query.all()}
+
+def settings_snapshot():
+    """Every setting as ``{key: Setting.to_dict()}``; treat the result as read-only"""
+    return _cache.get('all', _load)
+
+def _convert(key, value):
+    return SETTING_TYPES.get(key, str)(value)
+
+def setting_value(key, default=None):
+    """Typed value of ``key``, or ``default`` when it is unset or unparseable"""
+    setting = settings_snapshot().get(key)
+    if setting is None or setting['value'] is None:
+        return default
+    try:
+        return _convert(key, setting['value'])
+    except (TypeError, ValueError):
+        return default
+
+def validate_setting(key, value):
+    """Error message when ``value`` does not fit the type of ``key``, else None"""
+    if value is None:
+        return None
+    try:
+        _convert(key, str(value))
+    except (TypeError, ValueError):
+        return f'{key} must be of type {SETTING_TYPES[key].__name__}'
+    return None
+
+def save_settings(values, descriptions=None):
+    """Upsert ``{key: value}`` in one statement, commit, and invalidate every worker's cache"""
+    if not values:
+        return
+    descriptions = descriptions or {}
+    now = datetime.utcnow()
+    stmt = sqlite_insert(Setting.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['key'],
+        set_={
+            'value': stmt.excluded.value,
+            # Keep the stored description unless a new one is given
+            'description': func.coalesce(stmt.excluded.description, Setting.__table__.c.description),
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.session.execute(stmt, [{
+        'key': key,
+        'value': str(value) if value is not None else None,
+        'description': descriptions.get(key),
+        'created_at': now,
+        'updated_at': now
+    } for key, value in values.items()])
+    db.session.commit()
+    bump_counter('settings')
+
+def delete_setting(key):
+    """Delete ``key``; returns False when it did not exist"""
+    deleted = Setting.query.filter_by(key=key).delete()
+    db.session.commit()
+    if deleted:
+        bump_counter('settings')
+    return bool(deleted)
+
+def seed_default_settings():
+    """Insert the default settings that are missing, leaving existing values alone; the caller commits"""
+    stmt = sqlite_insert(Setting.__table__).on_conflict_do_nothing(index_elements=['key'])
+    now = datetime.utcnow()
+    db.session.execute(stmt, [dict(setting, created_at=now, updated_at=now) for setting in DEFAULT_SETTINGS])
@@ -0,0 +1,156 @@
+"""Version counters shared by every worker process on the host.
+
+Counters live in a small memory-mapped file, so reading one is a struct
+unpack from shared memory with no system call and no SQL. Increments take
+an exclusive ``flock`` on the file. Per-process caches compare a counter
+with the value they were filled under and drop themselves when another
+worker has bumped it. Past the named counters, the rest of the file
+holds one counter per user (user ids share a slot modulo their count), so
+a change to one user invalidates only what was cached for that user; a
+shared slot costs the other users one refetch. The file (``SHARED_STATE_PATH``, by default in the
+instance folder) is opened on the first counter access, not when the app
+is built, so importing ``main`` writes nothing.
+
+Everything a process keeps for an application (these counters, caches,
+brokers, registries) belongs to that application: ``app_state`` keeps it
+in ``app.extensions``, and ``app_local`` gives modules a global-looking
+proxy to the current app's instance. Two apps built in one process
+(tests, scripts) never see each other's users, tokens or settings.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+SLOT_SIZE = 8
+FILE_SIZE = 4096
+
+# Each named counter owns one fixed 8-byte slot in the file
+SLOTS = {
+    'chat_membership': 0,
+    'users': 1,
+    'revoked_tokens': 2,
+    'workload': 3,
+    'settings': 4,
+}
+
+USER_SLOTS_START = 64
+USER_SLOTS = FILE_SIZE // SLOT_SIZE - USER_SLOTS_START
+
+class SharedCounters:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+            self._fd = fd
+            self._map = mmap.mmap(fd, FILE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        else:
+            self._fd = None
+            self._map = mmap.mmap(-1, FILE_SIZE)
+    
+    def get(self, name):
+        return self.get_slot(SLOTS[name])
+    
+    def bump(self, name):
+        return self.bump_slot(SLOTS[name])
+    
+    def get_slot(self, slot):
+        return struct.unpack_from('<Q', self._map, slot * SLOT_SIZE)[0]
+    
+    def bump_slot(self, slot):
+        offset = slot * SLOT_SIZE
+        with self._lock:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from('<Q', self._map, offset)[0] + 1
+                struct.pack_into('<Q', self._map, offset, value)
+                return value
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+_app_state_lock = threading.Lock()
+
+def app_state(name, factory):
+    """The current app's ``name`` object, created with ``factory(app)`` on first use"""
+    app = current_app._get_current_object()
+    state = app.extensions.setdefault('crm', {})
+    if name not in state:
+        with _app_state_lock:
+            if name not in state:
+                state[name] = factory(app)
+    return state[name]
+
+def set_app_state(app, name, value):
+    app.extensions.setdefault('crm', {})[name] = value
+    return value
+
+def reset_app_state(app):
+    """Forget every per-process object of ``app``; each is rebuilt from config on next use"""
+    app.extensions['crm'] = {}
+
+def app_local(name, factory):
+    """Module-level proxy to ``app_state(name, factory)``; code running outside the app context must unwrap it first"""
+    return LocalProxy(lambda: app_state(name, factory))
+
+def _open_shared_counters(app):
+    path = app.config.get('SHARED_STATE_PATH') or os.path.join(app.instance_path, 'shared-state.bin')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return SharedCounters(path)
+
+shared_counters = app_local('shared_counters', _open_shared_counters)
+
+def get_counter(name):
+    return shared_counters.get(name)
+
+def bump_counter(name):
+    return shared_counters.bump(name)
+
+def get_user_counter(user_id):
+    return shared_counters.get_slot(USER_SLOTS_START + user_id % USER_SLOTS)
+
+def bump_user_counter(user_id):
+    return shared_counters.bump_slot(USER_SLOTS_START + user_id % USER_SLOTS)
+
+
+class VersionedCache:
+    """Bounded per-process LRU that empties itself whenever a shared counter moves
+
+    With no ``counter_name`` it never empties itself; callers put the
+    versions their value depends on into the key, and stale keys age out.
+    """
+    
+    def __init__(self, counter_name, max_entries=1024):
+        self.counter_name = counter_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = OrderedDict()
+    
+    def get(self, key, load):
+        """Return the cached value for ``key``, calling ``load()`` on a miss; None results are not cached"""
+        version = get_counter(self.counter_name) if self.counter_name else None
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = load()
+        if value is not None:
+            with self._lock:
+                # Skip the store if the counter moved while loading
+                if self._version == version:
+                    self._entries[key] = value
+                    if len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return value
@@ -0,0 +1,111 @@
+"""Employee workload figures from a few grouped queries.
+
+``employee_workload`` returns, for every active employee, their open
+tasks by status and priority, how many are overdue, and the orders they
+created this month. It makes three queries (employees, tasks grouped by
+assignee, orders grouped by creator) and merges them in Python, however
+many employees there are.
+
+Results are cached per process under the shared ``workload`` counter.
+Any commit that wrote a task or order bumps it, including the bulk
+``Query.update`` in the task routes. User changes already bump ``users``,
+which is part of the cache key, as is the current date because overdue
+and "this month" move with it.
+"""
+from datetime import datetime, time
+from itertools import chain
+from sqlalchemy import and_, case, event, func
+from sqlalchemy.orm import Session
+from models.user import db, Order, Task, User
+from services.permissions import EMPLOYEE_ROLES
+from services.shared_state import VersionedCache, app_local, bump_counter, get_counter
+
+CLOSED_TASK_STATUSES = ('completed', 'cancelled')
+
+WORKLOAD_MODELS = (Task, Order)
+
+_cache = app_local('workload_cache', lambda app: VersionedCache('workload', max_entries=4))
+
+def _compute(today):
+    day_start = datetime.combine(today, time.min)
+    month_start = day_start.replace(day=1)
+    
+    employees = User.query.filter(
+        User.is_active == True,
+        User.role.in_(EMPLOYEE_ROLES)
+    ).order_by(User.full_name).all()
+    workload = {
+        employee.id: {
+            'id': employee.id,
+            'full_name': employee.full_name,
+            'role': employee.role,
+            'email': employee.email,
+            'open_tasks': 0,
+            'overdue_tasks': 0,
+            'open_by_status': {},
+            'open_by_priority': {},
+            'orders_this_month': 0,
+            'orders_total_this_month': 0.0
+        } for employee in employees
+    }
+    if not workload:
+        return []
+    
+    task_rows = db.session.query(
+        Task.assigned_to, Task.status, Task.priority, func.count(Task.id),
+        func.sum(case((and_(Task.due_date.isnot(None), Task.due_date < day_start), 1), else_=0))
+    ).filter(
+        Task.assigned_to.in_(workload.keys()),
+        Task.status.notin_(CLOSED_TASK_STATUSES)
+    ).group_by(Task.assigned_to, Task.status, Task.priority)
+    for user_id, status, priority, count, overdue in task_rows:
+        entry = workload[user_id]
+        entry['open_tasks'] += count
+        entry['overdue_tasks'] += overdue or 0
+        entry['open_by_status'][status] = entry['open_by_status'].get(status, 0) + count
+        entry['open_by_priority'][priority] = entry['open_by_priority'].get(priority, 0) + count
+    
+    order_rows = db.session.query(
+        Order.created_by, func.count(Order.id), func.coalesce(func.sum(Order.total_amount), 0)
+    ).filter(
+        Order.created_by.in_(workload.keys()),
+        Order.created_at >= month_start
+    ).group_by(Order.created_by)
+    for user_id, count, total in order_rows:
+        workload[user_id]['orders_this_month'] = count
+        workload[user_id]['orders_total_this_month'] = float(total)
+    
+    return list(workload.values())
+
+def employee_workload(today=None):
+    today = today or datetime.utcnow().date()
+    return _cache.get((today, get_counter('users')), lambda: _compute(today))
+
+def assigned_task_counts(user_ids):
+    """Total tasks assigned to each of ``user_ids`` (any status), in one grouped query"""
+    if not user_ids:
+        return {}
+    return dict(db.session.query(Task.assigned_to, func.count(Task.id)).filter(
+        Task.assigned_to.in_(user_ids)
+    ).group_by(Task.assigned_to).all())
+
+@event.listens_for(Session, 'after_flush')
+def _note_flushed_changes(session, flush_context):
+    if any(isinstance(obj, WORKLOAD_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['workload_changed'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in WORKLOAD_MODELS:
+            orm_execute_state.session.info['workload_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_workload(session):
+    if session.info.pop('workload_changed', False):
+        bump_counter('workload')
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_workload_changes(session):
+    session.info.pop('workload_changed', None)
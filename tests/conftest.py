@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app
+from models.user import db
+from services.bootstrap import init_database, seed_database
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/crm.db',
+        'CHAT_DATABASE_URI': f'sqlite:///{tmp_path}/chat.db',
+        'CHAT_ARCHIVE_DATABASE_URI': f'sqlite:///{tmp_path}/chat_archive.db',
+        # Concurrent writers wait for the SQLite lock instead of failing at once
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        'SHARED_STATE_PATH': str(tmp_path / 'shared-state.bin'),
+        'CHAT_PRESENCE_SHARED': False,
+        'BCRYPT_ROUNDS': 4,
+    })
+    with app.app_context():
+        init_database()
+        seed_database()
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def login(client):
+    """``login(username, password)`` returns Authorization headers for that user"""
+    def _login(username='admin', password='admin123'):
+        response = client.post('/auth/login', json={'username': username, 'password': password})
+        assert response.status_code == 200, response.get_json()
+        return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    return _login
@@ -0,0 +1,14 @@
+"""Building the app (as ``import main`` does) must not write runtime files."""
+from main import create_app
+
+def test_create_app_writes_no_runtime_files(tmp_path):
+    create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/crm.db',
+        'CHAT_DATABASE_URI': f'sqlite:///{tmp_path}/chat.db',
+        'CHAT_ARCHIVE_DATABASE_URI': f'sqlite:///{tmp_path}/chat_archive.db',
+        'SHARED_STATE_PATH': str(tmp_path / 'shared-state.bin'),
+        'CHAT_PRESENCE_PATH': str(tmp_path / 'presence.bin'),
+    })
+    
+    # Databases, the shared-state and presence maps are all created on first use instead
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,53 @@
+"""Two apps in one process keep their own identity caches, settings and brokers."""
+from main import create_app
+from models.user import db, User
+from services.bootstrap import init_database, seed_database
+from services.notifications import broker
+from services.settings import save_settings, setting_value
+
+def _second_app(tmp_path):
+    directory = tmp_path / 'second'
+    directory.mkdir()
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/crm.db',
+        'CHAT_DATABASE_URI': f'sqlite:///{directory}/chat.db',
+        'CHAT_ARCHIVE_DATABASE_URI': f'sqlite:///{directory}/chat_archive.db',
+        'SHARED_STATE_PATH': str(directory / 'shared-state.bin'),
+        'CHAT_PRESENCE_SHARED': False,
+        'BCRYPT_ROUNDS': 4,
+    })
+    with app.app_context():
+        init_database()
+        # User 1 exists here too, but only as an employee
+        clerk = User(username='clerk', full_name='Clerk', email='clerk@example.com', role='employee')
+        clerk.set_password('secret')
+        db.session.add(clerk)
+        db.session.commit()
+        assert clerk.id == 1
+    return app
+
+def test_identity_cache_does_not_leak_between_apps(app, client, login, tmp_path):
+    assert client.get('/api/users', headers=login()).status_code == 200
+    
+    second = _second_app(tmp_path)
+    second_client = second.test_client()
+    response = second_client.post('/auth/login', json={'username': 'clerk', 'password': 'secret'})
+    headers = {'Authorization': f"Bearer {response.get_json()['access_token']}"}
+    assert second_client.get('/api/users', headers=headers).status_code == 403
+    
+    with second.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+def test_settings_and_brokers_are_per_app(app, tmp_path):
+    second = _second_app(tmp_path)
+    with app.app_context():
+        seed_database()
+        save_settings({'low_stock_threshold': 3})
+        first_broker = broker._get_current_object()
+    with second.app_context():
+        assert setting_value('low_stock_threshold', 10) == 10
+        assert broker._get_current_object() is not first_broker
+        for engine in db.engines.values():
+            engine.dispose()
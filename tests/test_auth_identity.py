@@ -0,0 +1,39 @@
+"""Role and status changes invalidate the user's tokens and cached identity, and only theirs."""
+from services.auth import load_identity
+
+def _create_user(client, headers, username='agent', role='employee'):
+    response = client.post('/api/users', headers=headers, json={
+        'username': username, 'password': 'secret123', 'full_name': 'Field Agent',
+        'email': f'{username}@example.com', 'role': role
+    })
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+def test_stale_auth_version_is_rejected_after_update_user(client, login):
+    admin = login()
+    user_id = _create_user(client, admin)
+    agent = login('agent', 'secret123')
+    assert client.get('/auth/me', headers=agent).status_code == 200
+    
+    response = client.put(f'/api/users/{user_id}', headers=admin, json={'role': 'manager'})
+    assert response.status_code == 200
+    
+    response = client.get('/auth/me', headers=agent)
+    assert response.status_code == 401
+    assert client.get('/auth/me', headers=login('agent', 'secret123')).status_code == 200
+    # The admin's own token is untouched
+    assert client.get('/auth/me', headers=admin).status_code == 200
+
+def test_update_user_keeps_other_cached_identities(app, client, login):
+    admin = login()
+    user_id = _create_user(client, admin)
+    with app.test_request_context():
+        admin_identity = load_identity('1')
+        user_identity = load_identity(str(user_id))
+    
+    assert client.put(f'/api/users/{user_id}', headers=admin, json={'full_name': 'Renamed'}).status_code == 200
+    
+    with app.test_request_context():
+        assert load_identity('1') is admin_identity
+        assert load_identity(str(user_id)) is not user_identity
+        assert load_identity(str(user_id)).full_name == 'Renamed'
@@ -0,0 +1,36 @@
+"""Refresh-token rotation and logout revocation."""
+from flask_jwt_extended import decode_token
+from models.user import db
+from services.revocation import revoke_token
+
+def _tokens(client):
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_refresh_token_rotates_only_once(app, client):
+    refresh_token = _tokens(client)['refresh_token']
+    with app.app_context():
+        # A concurrent refresh revoked the token but this worker has not synced its denylist yet
+        assert revoke_token(decode_token(refresh_token)) is True
+        db.session.commit()
+        assert revoke_token(decode_token(refresh_token)) is False
+        db.session.rollback()
+    
+    response = client.post('/auth/refresh', headers={'Authorization': f'Bearer {refresh_token}'})
+    assert response.status_code == 401
+
+def test_logout_with_malformed_refresh_token_still_revokes_access_token(client):
+    headers = {'Authorization': f"Bearer {_tokens(client)['access_token']}"}
+    
+    response = client.post('/auth/logout', json={'refresh_token': 'not-a-token'}, headers=headers)
+    assert response.status_code == 200
+    assert client.get('/auth/me', headers=headers).status_code == 401
+
+def test_tokens_pass_subject_verification(app, client):
+    assert app.config.get('JWT_VERIFY_SUB', True)
+    headers = {'Authorization': f"Bearer {_tokens(client)['access_token']}"}
+    
+    response = client.get('/auth/me', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['user']['username'] == 'admin'
@@ -0,0 +1,68 @@
+"""Automatic assignment picks the least-loaded active employee that fits the role and skill."""
+import json
+from models.user import db, Task, User
+
+def _user(username, role='employee', skills=None, is_active=True):
+    user = User(
+        username=username, full_name=username.title(), email=f'{username}@example.com', role=role,
+        skills=json.dumps(skills) if skills else None, is_active=is_active
+    )
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def _task(assigned_to=None, priority='medium', status='pending'):
+    task = Task(title='Task', created_by=1, assigned_to=assigned_to, priority=priority, status=status)
+    db.session.add(task)
+    db.session.commit()
+    return task.id
+
+def _auto_assign(client, headers, task_id, **constraints):
+    return client.post('/api/users/auto/assign-task', headers=headers, json={'task_id': task_id, **constraints})
+
+def test_least_loaded_active_employee_is_picked(app, client, login):
+    with app.app_context():
+        alice = _user('alice', skills=['Arabic'])
+        bob = _user('bob', role='sales')
+        _user('idle', is_active=False)
+        _user('boss', role='manager')
+        _task(alice, 'high')
+        _task(bob, 'low')
+        # Closed tasks carry no load
+        _task(bob, 'urgent', status='completed')
+        task_ids = [_task() for _ in range(3)]
+    headers = login()
+    
+    picks = []
+    for task_id in task_ids:
+        response = _auto_assign(client, headers, task_id)
+        assert response.status_code == 200, response.get_json()
+        picks.append(response.get_json()['task']['assigned_to'])
+    # bob 1 -> 3 ties alice at 3 and the lower id wins, then bob again at 3 against 5
+    assert picks == [bob, alice, bob]
+
+def test_role_and_skill_constraints(app, client, login):
+    with app.app_context():
+        alice = _user('alice', skills=['Arabic'])
+        bob = _user('bob', role='sales')
+        _task(alice, 'urgent')
+        task_id = _task()
+    headers = login()
+    
+    assert _auto_assign(client, headers, task_id, skill=' arabic ').get_json()['task']['assigned_to'] == alice
+    assert _auto_assign(client, headers, task_id, role='sales').get_json()['task']['assigned_to'] == bob
+    assert _auto_assign(client, headers, task_id, role='support').status_code == 409
+
+def test_new_task_can_be_assigned_automatically(app, client, login):
+    with app.app_context():
+        alice = _user('alice')
+        bob = _user('bob')
+        _task(alice, 'high')
+    
+    response = client.post('/tasks', headers=login(), json={'title': 'Follow up', 'assigned_to': 'auto'})
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['assigned_to'] == bob
+    # Employees cannot hand work out
+    response = client.post('/tasks', headers=login('alice', 'secret'), json={'title': 'Mine', 'assigned_to': 'auto'})
+    assert response.status_code == 403
@@ -0,0 +1,65 @@
+"""Broadcasts: one row per send, sparse receipts per reader, and audience targeting."""
+from models.user import db, BroadcastReceipt, Notification, User
+
+def _user(username, role='employee'):
+    user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role=role)
+    user.set_password('secret123')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def _broadcast(client, headers, **fields):
+    response = client.post('/notifications/broadcasts', headers=headers, json={'title': 'Notice', 'message': 'Hello', **fields})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['broadcast_id']
+
+def _count(client, headers):
+    return client.get('/notifications/count', headers=headers).get_json()['count']
+
+def test_receipts_are_written_only_when_read(app, client, login):
+    with app.app_context():
+        _user('alice')
+    admin, alice = login(), login('alice', 'secret123')
+    everyone = _broadcast(client, admin)
+    _broadcast(client, admin, target_role='manager')
+    
+    with app.app_context():
+        assert Notification.query.count() == 0
+        assert BroadcastReceipt.query.count() == 0
+    listed = client.get('/notifications', headers=alice).get_json()
+    assert [(item['broadcast_id'], item['is_read']) for item in listed] == [(everyone, False)]
+    assert _count(client, alice) == 1
+    
+    for _ in range(2):
+        assert client.put(f'/notifications/broadcasts/{everyone}/read', headers=alice).status_code == 200
+    assert _count(client, alice) == 0
+    assert client.get('/notifications', headers=alice).get_json()[0]['is_read'] is True
+    assert client.get('/notifications?unread_only=true', headers=alice).get_json() == []
+    with app.app_context():
+        assert [(row.broadcast_id, row.user_id) for row in BroadcastReceipt.query.all()] == [(everyone, 2)]
+    # Another reader's receipt is their own
+    assert _count(client, admin) == 1
+
+def test_mark_all_read_covers_only_visible_broadcasts(app, client, login):
+    with app.app_context():
+        _user('alice')
+        _user('mona', role='manager')
+    admin = login()
+    _broadcast(client, admin)
+    managers_only = _broadcast(client, admin, target_role='manager')
+    alice, mona = login('alice', 'secret123'), login('mona', 'secret123')
+    
+    assert client.put('/notifications/mark-all-read', headers=alice).status_code == 200
+    assert _count(client, alice) == 0
+    assert _count(client, mona) == 2
+    with app.app_context():
+        assert managers_only not in {row.broadcast_id for row in BroadcastReceipt.query.filter_by(user_id=2)}
+
+def test_users_do_not_inherit_earlier_broadcasts(app, client, login):
+    _broadcast(client, login())
+    with app.app_context():
+        _user('newcomer')
+    newcomer = login('newcomer', 'secret123')
+    
+    assert _count(client, newcomer) == 0
+    assert client.get('/notifications', headers=newcomer).get_json() == []
@@ -0,0 +1,52 @@
+"""Chat archiving: ids are never reused, and a colliding archive row stops the run instead of losing a message."""
+from datetime import datetime, timedelta
+import pytest
+from models.user import db, ArchivedChatMessage, ChatMessage
+from services.chat_archive import ArchiveConflict, archive_messages
+
+ARCHIVE_CONFIG = {'CHAT_ARCHIVE_AFTER_DAYS': 30, 'CHAT_ARCHIVE_BATCH_SIZE': 2}
+
+def _message(text, days_old):
+    message = ChatMessage(sender_id=1, receiver_id=2, message_text=text, timestamp=datetime.utcnow() - timedelta(days=days_old))
+    db.session.add(message)
+    db.session.commit()
+    return message.id
+
+def test_ids_are_not_reused_after_archiving_empties_the_table(app):
+    with app.app_context():
+        old_ids = [_message(f'old {index}', 60) for index in range(3)]
+        assert archive_messages(ARCHIVE_CONFIG)['archived'] == 3
+        assert ChatMessage.query.count() == 0
+        
+        new_id = _message('new', 0)
+        assert new_id > max(old_ids)
+        assert db.session.get(ArchivedChatMessage, old_ids[-1]).message_text == 'old 2'
+
+def test_interrupted_copy_is_resumed(app):
+    with app.app_context():
+        message_id = _message('old', 60)
+        message = db.session.get(ChatMessage, message_id)
+        # The copy committed, then the run died before deleting the hot row
+        db.session.add(ArchivedChatMessage(
+            id=message.id, conversation_key=message.conversation_key, sender_id=message.sender_id,
+            receiver_id=message.receiver_id, message_compressed=b'', timestamp=message.timestamp
+        ))
+        db.session.commit()
+        
+        assert archive_messages(ARCHIVE_CONFIG)['archived'] == 1
+        assert ChatMessage.query.count() == 0
+        assert ArchivedChatMessage.query.count() == 1
+
+def test_colliding_archive_row_keeps_the_hot_message(app):
+    with app.app_context():
+        message_id = _message('old', 60)
+        db.session.add(ArchivedChatMessage(
+            id=message_id, conversation_key='dm:7:8', sender_id=7, receiver_id=8,
+            message_compressed=b'', timestamp=datetime.utcnow() - timedelta(days=400)
+        ))
+        db.session.commit()
+        
+        with pytest.raises(ArchiveConflict):
+            archive_messages(ARCHIVE_CONFIG)
+        db.session.rollback()
+        assert db.session.get(ChatMessage, message_id).message_text == 'old'
@@ -0,0 +1,52 @@
+"""Inbox summaries: one row per participant, kept current by sends and group changes."""
+from models.user import db, User
+
+def _create_user(app, username):
+    with app.app_context():
+        user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def _send(client, headers, text, **target):
+    response = client.post('/api/chat/messages', headers=headers, json={'message_text': text, **target})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+def _inbox(client, headers):
+    response = client.get('/api/chat/conversations', headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_direct_messages_update_both_participants(app, client, login):
+    alice_id, bob_id = _create_user(app, 'alice'), _create_user(app, 'bob')
+    admin, bob, alice = login(), login('bob', 'secret'), login('alice', 'secret')
+    _send(client, admin, 'one', receiver_id=alice_id)
+    last_from_admin = _send(client, admin, 'two', receiver_id=alice_id)
+    last_from_bob = _send(client, bob, 'three', receiver_id=alice_id)
+    
+    inbox = _inbox(client, alice)['conversations']
+    assert [(row['user_name'], row['last_message_id'], row['last_message_preview'], row['unread_count']) for row in inbox] == [
+        ('Bob', last_from_bob, 'three', 1),
+        ('System Administrator', last_from_admin, 'two', 2),
+    ]
+    assert [row['conversation_key'] for row in inbox] == [f'dm:{alice_id}:{bob_id}', f'dm:1:{alice_id}']
+    
+    # The sender's own row moves too, without unread messages
+    [own] = _inbox(client, admin)['direct_conversations']
+    assert (own['user_id'], own['last_sender_id'], own['unread_count']) == (alice_id, 1, 0)
+
+def test_groups_appear_before_their_first_message(app, client, login):
+    alice_id = _create_user(app, 'alice')
+    admin, alice = login(), login('alice', 'secret')
+    group = client.post('/api/chat/groups', headers=admin, json={'name': 'Sales', 'member_ids': [alice_id]}).get_json()
+    
+    [summary] = _inbox(client, alice)['group_conversations']
+    assert (summary['name'], summary['member_count'], summary['last_message_id'], summary['unread_count']) == ('Sales', 2, None, 0)
+    
+    message_id = _send(client, alice, 'hello team', type='group', group_id=group['id'])
+    [admin_summary] = _inbox(client, admin)['group_conversations']
+    [alice_summary] = _inbox(client, alice)['group_conversations']
+    assert (admin_summary['last_message_id'], admin_summary['unread_count']) == (message_id, 1)
+    assert (alice_summary['last_message_id'], alice_summary['unread_count']) == (message_id, 0)
@@ -0,0 +1,69 @@
+"""Keyset pages of chat history: per conversation, newest first, continuing into the archive."""
+from datetime import datetime, timedelta
+from models.user import db, ChatMessage, User
+from services.chat_archive import archive_messages
+
+ARCHIVE_CONFIG = {'CHAT_ARCHIVE_AFTER_DAYS': 30, 'CHAT_ARCHIVE_BATCH_SIZE': 2}
+
+def _create_user(app, username):
+    with app.app_context():
+        user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def _message(sender_id, receiver_id, text, days_old):
+    message = ChatMessage(
+        sender_id=sender_id, receiver_id=receiver_id, message_text=text,
+        timestamp=datetime.utcnow() - timedelta(days=days_old)
+    )
+    db.session.add(message)
+    db.session.commit()
+    return message.id
+
+def _page(client, headers, chat_id, before_id=None):
+    url = f'/api/chat/messages?chat_id={chat_id}&per_page=2'
+    if before_id:
+        url += f'&before_id={before_id}'
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_pages_cross_from_hot_messages_into_the_archive(app, client, login):
+    alice_id, bob_id = _create_user(app, 'alice'), _create_user(app, 'bob')
+    with app.app_context():
+        ids = []
+        for index, days_old in enumerate((90, 80, 70, 1, 0)):
+            ids.append(_message(1, alice_id, f'message {index}', days_old))
+            # Another conversation interleaves its ids with this one
+            _message(1, bob_id, f'other {index}', days_old)
+        assert archive_messages(ARCHIVE_CONFIG)['archived'] == 6
+    headers = login()
+    
+    pages, before_id = [], None
+    while True:
+        page = _page(client, headers, alice_id, before_id)
+        pages.append([(message['id'], message.get('archived', False)) for message in page['messages']])
+        if not page['has_more']:
+            break
+        before_id = page['next_before_id']
+        assert before_id == page['messages'][-1]['id']
+    
+    assert pages == [
+        [(ids[4], False), (ids[3], False)],
+        [(ids[2], True), (ids[1], True)],
+        [(ids[0], True)],
+    ]
+
+def test_a_page_can_mix_hot_and_archived_messages(app, client, login):
+    alice_id = _create_user(app, 'alice')
+    with app.app_context():
+        old_id = _message(1, alice_id, 'old', 60)
+        archive_messages(ARCHIVE_CONFIG)
+        new_id = _message(alice_id, 1, 'new', 0)
+    
+    page = _page(client, login(), alice_id)
+    assert [(message['id'], message['message_text']) for message in page['messages']] == [(new_id, 'new'), (old_id, 'old')]
+    assert page['messages'][1]['archived'] is True
+    assert (page['has_more'], page['next_before_id']) == (False, None)
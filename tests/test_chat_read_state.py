@@ -0,0 +1,51 @@
+"""Read watermarks: they only move forward, recount unread, and back the receipts endpoint."""
+from models.user import db, ChatMessage, User
+
+def _create_user(app, username):
+    with app.app_context():
+        user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def _send(client, headers, text, **target):
+    response = client.post('/api/chat/messages', headers=headers, json={'message_text': text, **target})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+def test_group_watermarks_and_receipts(app, client, login):
+    alice_id, bob_id = _create_user(app, 'alice'), _create_user(app, 'bob')
+    admin, alice = login(), login('alice', 'secret')
+    group_id = client.post('/api/chat/groups', headers=admin, json={'name': 'Ops', 'member_ids': [alice_id, bob_id]}).get_json()['id']
+    first, second, third = (_send(client, admin, text, type='group', group_id=group_id) for text in ('a', 'b', 'c'))
+    key = f'g:{group_id}'
+    
+    summary = client.put(f'/api/chat/conversations/{key}/read?up_to={second}', headers=alice).get_json()
+    assert (summary['last_read_message_id'], summary['unread_count']) == (second, 1)
+    # Watermarks never move back
+    summary = client.put(f'/api/chat/conversations/{key}/read?up_to={first}', headers=alice).get_json()
+    assert (summary['last_read_message_id'], summary['unread_count']) == (second, 1)
+    
+    receipts = client.get(f'/api/chat/conversations/{key}/receipts?message_id={second}', headers=admin).get_json()
+    assert receipts['read_by'] == [alice_id]
+    assert {row['user_id']: row['last_read_message_id'] for row in receipts['receipts']}[bob_id] is None
+    assert client.get(f'/api/chat/conversations/{key}/receipts?message_id={third}', headers=admin).get_json()['read_by'] == []
+    
+    # Outsiders see neither the conversation nor its receipts
+    _create_user(app, 'carol')
+    assert client.get(f'/api/chat/conversations/{key}/receipts', headers=login('carol', 'secret')).status_code == 404
+
+def test_reading_a_direct_message_reads_everything_before_it(app, client, login):
+    alice_id = _create_user(app, 'alice')
+    admin, alice = login(), login('alice', 'secret')
+    ids = [_send(client, admin, text, receiver_id=alice_id) for text in ('a', 'b', 'c')]
+    
+    assert client.put(f'/api/chat/messages/{ids[1]}/read', headers=alice).status_code == 200
+    
+    [summary] = client.get('/api/chat/conversations', headers=alice).get_json()['direct_conversations']
+    assert (summary['last_read_message_id'], summary['unread_count']) == (ids[1], 1)
+    with app.app_context():
+        assert {message.id: message.is_read for message in ChatMessage.query.all()} == {ids[0]: True, ids[1]: True, ids[2]: False}
+    # Only the receiver can mark a message read
+    assert client.put(f'/api/chat/messages/{ids[2]}/read', headers=admin).status_code == 403
@@ -0,0 +1,57 @@
+"""Chat search: Arabic spelling variants and attached articles match, and only readable messages are found."""
+from models.user import db, User
+from services.chat_search import build_match_query, normalize, stem
+
+def _create_user(app, username):
+    with app.app_context():
+        user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def _send(client, headers, text, receiver_id):
+    response = client.post('/api/chat/messages', headers=headers, json={'message_text': text, 'receiver_id': receiver_id})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+def _search(client, headers, query):
+    response = client.get('/api/chat/search', headers=headers, query_string={'q': query})
+    assert response.status_code == 200, response.get_json()
+    return [result['id'] for result in response.get_json()['results']]
+
+def test_normalize_folds_spelling_variants():
+    # Diacritics and tatweel go; hamza forms, alef maqsura and ta marbuta fold
+    assert normalize('مُـــحَمَّد') == 'محمد'
+    assert normalize('أحمد إلى آخر') == normalize('احمد الي اخر')
+    assert normalize('مدرسة') == 'مدرسه'
+    assert normalize('Invoice') == 'invoice'
+
+def test_stem_strips_articles_with_attached_prepositions():
+    assert [stem(token) for token in ('بالعميل', 'والعميل', 'للعميل', 'العميل', 'عميل')] == ['عميل'] * 5
+    # Too short to be an article plus a word
+    assert stem('الم') == 'الم'
+
+def test_match_query_requires_every_term_as_a_prefix():
+    assert build_match_query('الفاتورة رقم') == (
+        '(body:"الفاتوره"* OR stems:"فاتوره"*) AND (body:"رقم"* OR stems:"رقم"*)'
+    )
+    assert build_match_query('  ؟! ') == ''
+
+def test_search_matches_variants_within_readable_conversations(app, client, login):
+    alice_id = _create_user(app, 'alice')
+    _create_user(app, 'bob')
+    admin, alice, bob = login(), login('alice', 'secret'), login('bob', 'secret')
+    client_message = _send(client, admin, 'تم التواصل بالعميل بخصوص الفاتورة', alice_id)
+    management = _send(client, alice, 'اجتماع الإدارة غداً', 1)
+    private = _send(client, bob, 'العميل الآخر', 1)
+    
+    assert _search(client, alice, 'العميل') == [client_message]
+    assert _search(client, alice, 'فاتوره') == [client_message]
+    assert _search(client, alice, 'ادارة') == [management]
+    assert _search(client, alice, 'اجتماع غدا') == [management]
+    # Prefixes match while typing
+    assert _search(client, alice, 'تواص') == [client_message]
+    assert _search(client, admin, 'العميل') == [private, client_message]
+    assert _search(client, bob, 'الفاتورة') == []
+    assert client.get('/api/chat/search', headers=alice).status_code == 400
@@ -0,0 +1,38 @@
+"""Legacy chat tables in the main database: duplicates do not block the move, and conversations get built."""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from models.user import db, ChatConversation, ChatGroup, ChatGroupMember, ChatMessage
+from services.bootstrap import init_database
+
+def _create_legacy_tables():
+    # As created before the split: in the main file, without the unique membership index
+    with db.engine.begin() as connection:
+        for table in (ChatGroup.__table__, ChatGroupMember.__table__, ChatMessage.__table__):
+            connection.execute(CreateTable(table))
+        connection.execute(text("INSERT INTO chat_groups (id, name, created_by) VALUES (1, 'team', 1)"))
+        connection.execute(text("""
+            INSERT INTO chat_group_members (id, group_id, user_id) VALUES (1, 1, 1), (2, 1, 2), (3, 1, 2)
+        """))
+        connection.execute(text("""
+            INSERT INTO chat_messages (id, sender_id, group_id, message_text, timestamp, is_read)
+            VALUES (1, 1, 1, 'hello', :now, 0), (2, 2, 1, 'hi', :now, 0)
+        """), {'now': datetime.utcnow()})
+
+def test_duplicate_memberships_do_not_keep_the_source_tables(app):
+    with app.app_context():
+        _create_legacy_tables()
+        init_database()
+        
+        assert 'chat_group_members' not in inspect(db.engine).get_table_names()
+        assert sorted(db.session.query(ChatGroupMember.id, ChatGroupMember.user_id)) == [(1, 1), (2, 2)]
+        assert ChatMessage.query.count() == 2
+
+def test_conversations_are_built_for_migrated_messages(app):
+    with app.app_context():
+        _create_legacy_tables()
+        init_database()
+        
+        conversations = {row.user_id: row for row in ChatConversation.query.all()}
+        assert set(conversations) == {1, 2}
+        assert all(row.last_message_id == 2 for row in conversations.values())
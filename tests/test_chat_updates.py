@@ -0,0 +1,45 @@
+"""Long-poll cursors: events after a cursor, and resync for cursors from another process."""
+from models.user import db, User
+from services.pubsub import Broker
+
+def _create_user(app, username):
+    with app.app_context():
+        user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+def test_cursor_from_another_broker_does_not_parse():
+    worker_a, worker_b = Broker(history=10), Broker(history=10)
+    for _ in range(3):
+        worker_a.publish('topic', 'message')
+    for _ in range(10):
+        worker_b.publish('topic', 'message')
+    
+    assert worker_a.parse_cursor(worker_a.cursor()) == 3
+    assert worker_b.parse_cursor(worker_a.cursor()) is None
+    assert worker_b.parse_cursor('3') is None
+    assert worker_b.parse_cursor(None) is None
+
+def test_updates_deliver_events_after_the_cursor(app, client, login):
+    receiver_id = _create_user(app, 'receiver')
+    sender = login()
+    receiver = login('receiver', 'secret')
+    cursor = client.get('/api/chat/updates', headers=receiver).get_json()['cursor']
+    
+    response = client.post('/api/chat/messages', json={'message_text': 'hello', 'receiver_id': receiver_id}, headers=sender)
+    assert response.status_code == 201
+    
+    body = client.get(f'/api/chat/updates?since={cursor}&timeout=1', headers=receiver).get_json()
+    assert body['resync'] is False
+    assert [event['type'] for event in body['events']] == ['message']
+    assert body['cursor'] != cursor
+
+def test_foreign_cursor_forces_resync(app, client, login):
+    _create_user(app, 'receiver')
+    receiver = login('receiver', 'secret')
+    
+    body = client.get('/api/chat/updates?since=1234-deadbeef:3&timeout=5', headers=receiver).get_json()
+    assert body == {'events': [], 'cursor': body['cursor'], 'resync': True}
+    assert not body['cursor'].startswith('1234-deadbeef:')
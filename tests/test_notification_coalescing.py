@@ -0,0 +1,60 @@
+"""Repeated notifications about one entity fold into a single unread row."""
+from datetime import datetime, timedelta
+from models.user import db, Notification, NotificationCounter, Task
+from services.notifications import notify
+
+def _task():
+    task = Task(title='Call back', created_by=1, assigned_to=1, status='pending', priority='medium')
+    db.session.add(task)
+    db.session.commit()
+    return task.id
+
+def _unread_counter():
+    return db.session.get(NotificationCounter, 1).unread_count
+
+def test_repeat_within_the_window_updates_the_row(app):
+    with app.app_context():
+        task_id = _task()
+        first = notify(1, 'Task updated', 'status changed', related_task_id=task_id)
+        db.session.commit()
+        first_id, first_updated = first.id, first.updated_at
+        
+        second = notify(1, 'Task updated', 'priority changed', related_task_id=task_id)
+        db.session.commit()
+        
+        assert second.id == first_id
+        assert Notification.query.count() == 1
+        assert (second.occurrences, second.message) == (2, 'priority changed')
+        assert second.updated_at > first_updated
+        assert _unread_counter() == 1
+
+def test_read_or_expired_rows_are_not_reused(app):
+    app.config['NOTIFICATION_COALESCE_WINDOW'] = 60
+    with app.app_context():
+        task_id = _task()
+        read = notify(1, 'Task updated', 'one', related_task_id=task_id)
+        read.is_read = True
+        db.session.commit()
+        
+        stale = notify(1, 'Task updated', 'two', related_task_id=task_id)
+        db.session.commit()
+        stale.updated_at = datetime.utcnow() - timedelta(seconds=120)
+        db.session.commit()
+        
+        fresh = notify(1, 'Task updated', 'three', related_task_id=task_id)
+        db.session.commit()
+        
+        assert len({read.id, stale.id, fresh.id}) == 3
+        assert fresh.occurrences == 1
+        assert _unread_counter() == 2
+
+def test_other_types_and_entities_are_kept_apart(app):
+    with app.app_context():
+        task_id, other_task_id = _task(), _task()
+        notify(1, 'Task updated', 'a', related_task_id=task_id)
+        notify(1, 'Task assigned', 'b', notification_type='task_assigned', related_task_id=task_id)
+        notify(1, 'Task updated', 'c', related_task_id=other_task_id)
+        db.session.commit()
+        
+        assert Notification.query.count() == 3
+        assert _unread_counter() == 3
@@ -0,0 +1,132 @@
+"""Stress test: per-user notification counters never drift from the table.
+
+Several threads insert, read and delete notifications for a handful of
+users at once, through both the ORM and bulk insert paths, the HTTP
+routes and the retention job. Afterwards every counter must equal ``COUNT(*)`` over
+``notifications``. Writes that lose the SQLite lock roll back, and they
+must roll their counter changes back with them.
+"""
+import random
+import threading
+from sqlalchemy import func
+from models.user import db, Notification, NotificationCounter, User
+from services.notifications import add_notifications, notify
+from services.retention import run_retention
+
+USERS = 4
+THREADS = 8
+OPERATIONS_PER_THREAD = 60
+
+# Unread rows are eligible too, so retention races with mark-read
+RETENTION_CONFIG = {
+    'NOTIFICATION_RETENTION_DAYS': 0,
+    'NOTIFICATION_RETENTION_MAX_PER_USER': 5,
+    'NOTIFICATION_RETENTION_KEEP_UNREAD': False,
+    'NOTIFICATION_RETENTION_BATCH_SIZE': 3,
+}
+
+def _create_users(app):
+    with app.app_context():
+        users = []
+        for index in range(USERS):
+            user = User(username=f'user{index}', full_name=f'User {index}', email=f'user{index}@example.com', role='employee')
+            user.set_password('secret')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+def _table_counts(user_id):
+    total = Notification.query.filter_by(user_id=user_id).count()
+    unread = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+    return unread, total
+
+def _writer(app, client, user_ids, headers, seed, failures):
+    rng = random.Random(seed)
+    for step in range(OPERATIONS_PER_THREAD):
+        user_id = rng.choice(user_ids)
+        operation = rng.randrange(7)
+        try:
+            if operation == 0:
+                with app.app_context():
+                    notify(user_id, 'Single', f'{seed}-{step}', notification_type=f'stress-{seed}-{step}')
+                    db.session.commit()
+            elif operation == 1:
+                with app.app_context():
+                    add_notifications([
+                        {'user_id': rng.choice(user_ids), 'title': 'Bulk', 'message': f'{seed}-{step}-{index}', 'type': 'info'}
+                        for index in range(rng.randint(1, 5))
+                    ])
+                    db.session.commit()
+            elif operation == 2:
+                with app.app_context():
+                    ids = [row.id for row in Notification.query.filter_by(user_id=user_id).limit(5)]
+                for notification_id in ids:
+                    client.put(f'/notifications/{notification_id}/read', headers=headers[user_id])
+            elif operation == 3:
+                client.put('/notifications/mark-all-read', headers=headers[user_id])
+            elif operation == 4:
+                client.delete('/notifications/read', headers=headers[user_id])
+            elif operation == 5:
+                with app.app_context():
+                    run_retention(RETENTION_CONFIG)
+            else:
+                client.get('/notifications/count', headers=headers[user_id])
+        except Exception as error:  # a lost lock rolls the whole write back
+            failures.append(error)
+
+def test_counters_match_table_under_concurrent_writers(app, login):
+    user_ids = _create_users(app)
+    headers = {user_id: login(f'user{index}', 'secret') for index, user_id in enumerate(user_ids)}
+    failures = []
+    
+    threads = [
+        threading.Thread(target=_writer, args=(app, app.test_client(), user_ids, headers, seed, failures))
+        for seed in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    with app.app_context():
+        assert Notification.query.count() > 0
+        for user_id in user_ids:
+            counter = db.session.get(NotificationCounter, user_id)
+            unread, total = _table_counts(user_id)
+            assert counter is not None
+            assert (counter.unread_count, counter.total_count) == (unread, total), f'user {user_id} drifted'
+        # Drift in either direction would show up as a negative counter somewhere
+        assert db.session.query(func.min(NotificationCounter.unread_count)).scalar() >= 0
+
+def test_count_endpoint_reads_the_counter(app, client, login):
+    user_id = _create_users(app)[0]
+    headers = login('user0', 'secret')
+    with app.app_context():
+        add_notifications([{'user_id': user_id, 'title': 'Hi', 'message': str(index), 'type': 'info'} for index in range(3)])
+        db.session.commit()
+    assert client.get('/notifications/count', headers=headers).get_json()['count'] == 3
+    client.put('/notifications/mark-all-read', headers=headers)
+    assert client.get('/notifications/count', headers=headers).get_json()['count'] == 0
+
+def test_first_flush_of_several_notifications_counts_each_once(app):
+    user_id = _create_users(app)[0]
+    with app.app_context():
+        # One flush, one batched INSERT, and no counter row yet
+        notify(user_id, 'First', 'one')
+        notify(user_id, 'Second', 'two')
+        db.session.commit()
+        counter = db.session.get(NotificationCounter, user_id)
+        assert (counter.unread_count, counter.total_count) == _table_counts(user_id) == (2, 2)
+
+def test_ids_are_not_reused_after_retention_empties_the_table(app):
+    user_id = _create_users(app)[0]
+    with app.app_context():
+        first = add_notifications([{'user_id': user_id, 'title': 'Old', 'message': str(index), 'type': 'info'} for index in range(3)])
+        db.session.commit()
+        newest_id = max(notification.id for notification in first)
+        Notification.query.delete()
+        db.session.commit()
+        later = notify(user_id, 'New', 'after the purge')
+        db.session.commit()
+        assert later.id > newest_id
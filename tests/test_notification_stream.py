@@ -0,0 +1,53 @@
+"""The SSE notification stream: query-string auth, the opening count, heartbeats and cleanup."""
+import json
+from models.user import db
+from services.notifications import broker, notify, user_topic
+
+def _token(client):
+    response = client.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+    return response.get_json()['access_token']
+
+def _open(client, token):
+    response = client.get(f'/notifications/stream?jwt={token}', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return response, (chunk.decode('utf-8') for chunk in response.response)
+
+def _event(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+    return fields['event'], json.loads(fields['data'])
+
+def test_stream_requires_a_token(client):
+    assert client.get('/notifications/stream').status_code == 401
+    assert client.get('/notifications/stream?jwt=not-a-token').status_code == 422
+
+def test_stream_authenticates_from_the_query_string_and_opens_with_the_count(app, client):
+    with app.app_context():
+        notify(1, 'First', 'one')
+        notify(1, 'Second', 'two')
+        db.session.commit()
+    response, chunks = _open(client, _token(client))
+    
+    assert next(chunks) == 'retry: 5000\n\n'
+    assert _event(next(chunks)) == ('count', {'count': 2})
+    response.close()
+
+def test_stream_sends_heartbeats_and_live_events_then_unsubscribes_on_close(app, client):
+    app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 0.01
+    response, chunks = _open(client, _token(client))
+    next(chunks)
+    next(chunks)
+    
+    assert next(chunks) == ': heartbeat\n\n'
+    with app.app_context():
+        notify(1, 'Live', 'now')
+        db.session.commit()
+    event_name, data = _event(next(chunks))
+    assert (event_name, data['title']) == ('notification', 'Live')
+    assert _event(next(chunks)) == ('count', {'count': 1})
+    
+    with app.app_context():
+        assert broker.subscriber_count(user_topic(1)) == 1
+        # A client disconnect closes the response, which ends the generator
+        response.close()
+        assert broker.subscriber_count(user_topic(1)) == 0
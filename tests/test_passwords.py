@@ -0,0 +1,58 @@
+"""Login under hashing pressure answers 503, and stored hashes are only ever upgraded."""
+import bcrypt
+from models.user import db, User
+from services.passwords import PasswordHasher, hash_cost
+from services.shared_state import set_app_state
+
+def _use_hasher(app, **options):
+    hasher = PasswordHasher(**{'rounds': 4, 'workers': 1, **options})
+    set_app_state(app, 'password_hasher', hasher)
+    return hasher
+
+def _store_hash(app, rounds):
+    with app.app_context():
+        user = User.query.filter_by(username='admin').first()
+        user.password_hash = bcrypt.hashpw(b'admin123', bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+        db.session.commit()
+
+def _stored_cost(app):
+    with app.app_context():
+        return hash_cost(User.query.filter_by(username='admin').first().password_hash)
+
+def _login(client):
+    return client.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+
+def test_saturated_hasher_answers_503(app, client):
+    hasher = _use_hasher(app, max_pending=0)
+    # Another login holds the only slot
+    assert hasher._admission.acquire(blocking=False)
+    
+    response = _login(client)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    
+    hasher._admission.release()
+    assert _login(client).status_code == 200
+
+def test_verification_timeout_answers_503(app, client):
+    _store_hash(app, 12)
+    _use_hasher(app, timeout=0.001)
+    
+    response = _login(client)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_login_upgrades_a_cheaper_hash(app, client):
+    _store_hash(app, 4)
+    _use_hasher(app, rounds=5)
+    
+    assert _login(client).status_code == 200
+    assert _stored_cost(app) == 5
+    assert _login(client).status_code == 200
+
+def test_login_keeps_a_costlier_hash(app, client):
+    _store_hash(app, 6)
+    _use_hasher(app, rounds=4)
+    
+    assert _login(client).status_code == 200
+    assert _stored_cost(app) == 6
@@ -0,0 +1,37 @@
+"""Permission masks: roles plus per-user grants and revocations, enforced by ``requires``."""
+import json
+from models.user import db, User
+from services.permissions import ALL_PERMISSIONS, PERMISSION_BITS, compile_permissions, permission_names
+
+def test_roles_compile_to_their_rights():
+    assert compile_permissions('admin') == ALL_PERMISSIONS
+    assert permission_names(compile_permissions('manager')) == ['users.view', 'tasks.assign', 'notifications.broadcast']
+    assert compile_permissions('employee') == 0
+    assert compile_permissions('unknown-role') == 0
+
+def test_user_grants_adjust_the_role_mask():
+    grants = json.dumps({'reports.view_all': True, 'tasks.assign': False, 'no.such.right': True})
+    assert permission_names(compile_permissions('manager', grants)) == ['users.view', 'reports.view_all', 'notifications.broadcast']
+    # A plain list only grants
+    assert compile_permissions('employee', json.dumps(['settings.manage'])) == PERMISSION_BITS['settings.manage']
+    # Unreadable grants fall back to the role
+    assert compile_permissions('manager', 'not json') == compile_permissions('manager')
+
+def test_granted_right_takes_effect_with_the_next_token(app, client, login):
+    with app.app_context():
+        user = User(username='alice', full_name='Alice', email='alice@example.com', role='employee')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        alice_id = user.id
+    admin, alice = login(), login('alice', 'secret')
+    assert client.get('/api/users', headers=alice).status_code == 403
+    
+    response = client.put(f'/api/users/{alice_id}', headers=admin, json={'permissions': {'users.view': True}})
+    assert response.status_code == 200
+    
+    assert client.get('/api/users', headers=login('alice', 'secret')).status_code == 200
+    
+    # Revoking a right the role grants works the same way
+    client.put(f'/api/users/{alice_id}', headers=admin, json={'role': 'manager', 'permissions': {'users.view': False}})
+    assert client.get('/api/users', headers=login('alice', 'secret')).status_code == 403
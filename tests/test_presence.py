@@ -0,0 +1,69 @@
+"""Presence heartbeats, the bounded overflow for large ids, and typing indicators."""
+from models.user import db, User
+from services.chat import direct_key
+from services.presence import PresenceRegistry, TypingRegistry
+
+def test_heartbeat_marks_user_online_until_ttl():
+    registry = PresenceRegistry(max_users=16, ttl=60)
+    assert registry.touch(3, now=1000) is True
+    assert registry.touch(3, now=1010) is False
+    
+    assert registry.status([3, 4], now=1050) == {
+        3: {'online': True, 'last_seen': '1970-01-01T00:16:50'},
+        4: {'online': False, 'last_seen': None}
+    }
+    assert registry.status([3], now=1071)[3]['online'] is False
+
+def test_overflow_ids_expire_instead_of_accumulating():
+    registry = PresenceRegistry(max_users=16, ttl=60)
+    for user_id in range(100, 1100):
+        registry.touch(user_id, now=1000)
+    assert len(registry._overflow) == 1000
+    
+    registry.touch(5000, now=1061)
+    assert list(registry._overflow) == [5000]
+    assert registry.status([5000], now=1061)[5000]['online'] is True
+
+def test_typing_pings_inside_half_the_ttl_are_absorbed():
+    typing = TypingRegistry(ttl=6)
+    assert typing.update('dm:1:2', 1, True, now=100) is True
+    assert typing.update('dm:1:2', 1, True, now=102) is False
+    assert typing.update('dm:1:2', 1, True, now=104) is True
+    assert typing.typing_users('dm:1:2', now=105) == [1]
+    assert typing.typing_users('dm:1:2', now=111) == []
+    
+    assert typing.update('dm:1:2', 1, True, now=120) is True
+    assert typing.update('dm:1:2', 1, False, now=121) is True
+    assert typing.typing_users('dm:1:2', now=121) == []
+
+def test_presence_endpoint_only_reports_active_users(app, client, login):
+    with app.app_context():
+        inactive = User(username='gone', full_name='Gone', email='gone@example.com', role='employee', is_active=False)
+        inactive.set_password('secret')
+        db.session.add(inactive)
+        db.session.commit()
+        inactive_id = inactive.id
+    headers = login()
+    
+    assert client.post('/api/chat/presence/heartbeat', headers=headers).status_code == 200
+    response = client.get(f'/api/chat/presence?user_ids=1,{inactive_id},99999', headers=headers)
+    assert response.status_code == 200
+    presence = response.get_json()['presence']
+    assert list(presence) == ['1']
+    assert presence['1']['online'] is True
+
+def test_typing_endpoint_requires_a_participant(app, client, login):
+    with app.app_context():
+        peer = User(username='peer', full_name='Peer', email='peer@example.com', role='employee')
+        peer.set_password('secret')
+        db.session.add(peer)
+        db.session.commit()
+        peer_id = peer.id
+    headers = login()
+    key = direct_key(1, peer_id)
+    
+    assert client.post(f'/api/chat/conversations/{key}/typing', json={'typing': True}, headers=headers).status_code == 200
+    assert client.get(f'/api/chat/conversations/{key}/typing', headers=login('peer', 'secret')).get_json()['typing'] == [1]
+    
+    other_key = direct_key(peer_id, peer_id + 1)
+    assert client.get(f'/api/chat/conversations/{other_key}/typing', headers=headers).status_code == 404
@@ -0,0 +1,21 @@
+"""Low-stock listings follow the ``low_stock_threshold`` setting."""
+from models.user import db, Product
+from services.settings import save_settings
+
+def test_low_stock_uses_the_threshold_setting(app, client, login):
+    with app.app_context():
+        db.session.add_all([
+            Product(name='scarce', price=1, stock_quantity=3),
+            Product(name='plenty', price=1, stock_quantity=8)
+        ])
+        db.session.commit()
+        save_settings({'low_stock_threshold': 5})
+    headers = login()
+    
+    listed = client.get('/api/products/low-stock', headers=headers).get_json()
+    assert [product['name'] for product in listed['products']] == ['scarce']
+    filtered = client.get('/api/products?low_stock=1', headers=headers).get_json()
+    assert [product['name'] for product in filtered['products']] == ['scarce']
+    
+    overridden = client.get('/api/products/low-stock?threshold=10', headers=headers).get_json()
+    assert overridden['count'] == 2
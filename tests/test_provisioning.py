@@ -0,0 +1,67 @@
+"""Bulk user provisioning: per-row outcomes, CSV input, and hashing on a process pool."""
+import bcrypt
+from models.user import User
+from services.passwords import hash_cost, hash_passwords
+
+def _row(username, **fields):
+    return {'username': username, 'password': f'{username}-pass', 'full_name': username.title(), 'email': f'{username}@example.com', **fields}
+
+def test_valid_rows_are_created_and_the_rest_reported(app, client, login):
+    rows = [
+        _row('alice', skills=['Arabic']),
+        _row('bob', role='sales'),
+        _row('alice', email='other@example.com'),
+        _row('admin', email='second-admin@example.com'),
+        _row('carol', role='wizard'),
+        {'username': 'dave', 'password': 'x'},
+        'not a row',
+    ]
+    response = client.post('/api/users/bulk', headers=login(), json={'users': rows})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body['created'], body['failed']) == (2, 5)
+    assert [(result['row'], result['status'], result.get('error')) for result in body['results']] == [
+        (1, 'created', None),
+        (2, 'created', None),
+        (3, 'error', 'Duplicate username or email in request'),
+        (4, 'error', 'Username or email already exists'),
+        (5, 'error', 'Unknown role'),
+        (6, 'error', 'full_name is required'),
+        (7, 'error', 'Row must be an object'),
+    ]
+    
+    with app.app_context():
+        alice = User.query.filter_by(username='alice').one()
+        assert (alice.id, alice.skills, hash_cost(alice.password_hash)) == (body['results'][0]['id'], '["Arabic"]', 4)
+    assert login('bob', 'bob-pass')
+
+def test_csv_upload(app, client, login):
+    content = (
+        '\ufeffusername,password,full_name,email,role,skills,is_active\n'
+        'erin,erin-pass,Erin,erin@example.com,support,billing; arabic,no\n'
+        'frank,frank-pass,Frank,frank@example.com,,,\n'
+    )
+    response = client.post('/api/users/bulk', headers=login(), data=content, content_type='text/csv')
+    assert response.get_json()['created'] == 2
+    
+    with app.app_context():
+        erin, frank = User.query.filter_by(username='erin').one(), User.query.filter_by(username='frank').one()
+        assert (erin.role, erin.skills, erin.is_active) == ('support', '["billing", "arabic"]', False)
+        assert (frank.role, frank.is_active) == ('employee', True)
+
+def test_nothing_valid_is_rejected(client, login):
+    response = client.post('/api/users/bulk', headers=login(), json=[{'username': 'x'}])
+    assert response.status_code == 400
+    assert response.get_json()['created'] == 0
+    assert client.post('/api/users/bulk', headers=login(), json=[]).status_code == 400
+
+def test_pool_hashes_match_their_passwords_in_order(app):
+    passwords = [f'password-{index}' for index in range(6)]
+    with app.app_context():
+        # Two workers take the forkserver process pool even on one core
+        hashes = hash_passwords(passwords, workers=2)
+    
+    assert len(hashes) == len(passwords)
+    for password, password_hash in zip(passwords, hashes):
+        assert hash_cost(password_hash) == 4
+        assert bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
@@ -0,0 +1,62 @@
+"""Bulk task updates: only permitted tasks change, and assignee loads stay in step."""
+from models.user import db, Task, User
+from services.assignment import PRIORITY_WEIGHTS, AssignmentHeap, assignment_heap
+
+def _user(username):
+    user = User(username=username, full_name=username.title(), email=f'{username}@example.com', role='employee')
+    user.set_password('secret123')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def _task(title, created_by, assigned_to, priority='medium'):
+    task = Task(title=title, created_by=created_by, assigned_to=assigned_to, priority=priority, status='pending')
+    db.session.add(task)
+    db.session.commit()
+    return task.id
+
+def test_tasks_without_permission_are_skipped(app, client, login):
+    with app.app_context():
+        alice, bob = _user('alice'), _user('bob')
+        assigned = _task('assigned to alice', 1, alice)
+        created = _task('created by alice', alice, alice)
+        foreign = _task('bob only', 1, bob)
+    headers = login('alice', 'secret123')
+    
+    response = client.post('/tasks/bulk', headers=headers, json={
+        'ids': [assigned, created, foreign], 'changes': {'status': 'in_progress'}
+    })
+    assert response.status_code == 200
+    assert response.get_json()['task_ids'] == [assigned, created]
+    assert response.get_json()['skipped'] == [foreign]
+    
+    # Only creators may reassign, so the task alice merely works on stays hers
+    response = client.post('/tasks/bulk', headers=headers, json={
+        'ids': [assigned, created], 'changes': {'assigned_to': bob}
+    })
+    assert response.get_json()['task_ids'] == [created]
+    assert response.get_json()['skipped'] == [assigned]
+    with app.app_context():
+        assert {task.id: task.assigned_to for task in Task.query.all()} == {assigned: alice, created: bob, foreign: bob}
+        assert db.session.get(Task, foreign).status == 'pending'
+
+def test_bulk_reassign_keeps_assignee_loads_current(app, client, login):
+    with app.app_context():
+        alice, bob = _user('alice'), _user('bob')
+        task_ids = [_task(f'task {index}', 1, alice, priority) for index, priority in enumerate(('high', 'urgent', 'low'))]
+        assignment_heap.rebuild()
+    
+    response = client.post('/tasks/bulk', headers=login(), json={
+        'ids': task_ids[:2], 'changes': {'assigned_to': bob, 'priority': 'medium'}
+    })
+    assert response.status_code == 200
+    
+    with app.app_context():
+        expected = {alice: PRIORITY_WEIGHTS['low'], bob: 2 * PRIORITY_WEIGHTS['medium']}
+        # Updated in place from the recorded deltas, not left for a rebuild
+        assert assignment_heap._versions is not None
+        assert assignment_heap.loads() == expected
+        fresh = AssignmentHeap()
+        fresh.rebuild()
+        assert fresh.loads() == expected
+        assert assignment_heap.pick() == alice